@@ -0,0 +1,271 @@
+"""
+週報メールのAI解析段
+
+解析（Vertex AI呼び出し）をスレッドプールで並行実行する。
+- トークンバケットでリクエスト数を制限（クォータ対策）
+- 一時的なエラーは指数バックオフで再試行
+- 結果は入力と同じ順番で返す（DBへの登録順を決定的にするため）
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 同時に実行する解析リクエスト数
+ANALYSIS_CONCURRENCY = 4
+
+# 1分あたりの解析リクエスト数の上限（Vertex AIのクォータに合わせる）
+ANALYSIS_RATE_PER_MINUTE = 60
+
+# 一時的なエラーの再試行回数と待ち時間（秒）
+ANALYSIS_MAX_RETRIES = 4
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+
+# 再試行対象のHTTPステータス（レート制限・サーバーエラー）
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# バッチ解析: 1リクエストにまとめるメール数の上限と、まとめるメール本文の合計バイト数（UTF-8）の上限
+ANALYSIS_BATCH_SIZE = 8
+ANALYSIS_BATCH_MAX_BYTES = 36000
+
+
+class AnalysisError(Exception):
+    """解析結果が不正（JSONとして解釈できない等）"""
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット（rate: 1秒あたりの補充数）"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得（なければ補充されるまで待つ）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_transient_error(error):
+    """再試行すれば成功する可能性のあるエラーか判定"""
+    if isinstance(error, (AnalysisError, TimeoutError, ConnectionError)):
+        return True
+    # google.api_core.exceptions.GoogleAPICallError は code にHTTPステータスを持つ
+    code = getattr(error, 'code', None)
+    if callable(code):
+        # grpc.RpcError は code() を持つ
+        code = getattr(code(), 'value', (None,))[0]
+    return code in TRANSIENT_STATUS_CODES
+
+
+def is_transient_request_error(error):
+    """
+    通信・HTTPステータスによる一時的なエラーか判定（解析結果の不正 AnalysisError は含めない）
+
+    バッチ解析の応答の形式が不正な場合は、バッチ全体を再試行しても改善しにくく
+    コストがバッチの件数倍になるため、再試行せずに1件ずつの解析に切り替える。
+    """
+    return not isinstance(error, AnalysisError) and is_transient_error(error)
+
+
+def call_with_retries(func, max_retries=ANALYSIS_MAX_RETRIES,
+                      base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, retryable=is_transient_error):
+    """一時的なエラー（retryable が True を返すもの）を指数バックオフ（ジッター付き）で再試行しながら func を呼ぶ"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+
+class AnalysisStage:
+    """
+    解析をスレッドプールで並行実行するパイプライン段
+
+    run() は (キー, 入力) の列を受け取り、入力順に (キー, 入力, 結果, エラー) を返す。
+    入力が例外オブジェクト（前段での取得失敗）の場合は解析せずにそのままエラーとして返す。
+    先行して実行する解析は concurrency の2倍までに制限する。
+    """
+
+    def __init__(self, analyze, concurrency=ANALYSIS_CONCURRENCY,
+                 rate_per_minute=ANALYSIS_RATE_PER_MINUTE, max_retries=ANALYSIS_MAX_RETRIES):
+        self.analyze = analyze
+        self.concurrency = max(concurrency, 1)
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate_per_minute / 60.0) if rate_per_minute else None
+
+    def _analyze_one(self, payload):
+        def attempt():
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            return self.analyze(payload)
+        return call_with_retries(attempt, max_retries=self.max_retries)
+
+    def _submit(self, executor, key, payload):
+        if isinstance(payload, Exception):
+            return key, payload, None
+        return key, payload, executor.submit(self._analyze_one, payload)
+
+    def run(self, items):
+        items = iter(items)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        try:
+            for key, payload in items:
+                pending.append(self._submit(executor, key, payload))
+                if len(pending) >= self.concurrency * 2:
+                    break
+            while pending:
+                key, payload, future = pending.popleft()
+                if future is None:
+                    result, error = None, payload
+                else:
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                next_item = next(items, None)
+                if next_item is not None:
+                    pending.append(self._submit(executor, *next_item))
+                yield key, payload, result, error
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class BatchAnalysisStage(AnalysisStage):
+    """
+    複数の入力を1回の解析リクエストにまとめるパイプライン段
+
+    analyze_batch は入力のリストを受け取り、入力ごとの結果（失敗した入力は例外オブジェクト）のリストを返す。
+    バッチの応答に含まれなかった・不正だった入力は analyze で1件ずつ解析し直す。
+    バッチの再試行は通信・HTTPステータスのエラーに限り、応答の不正（AnalysisError）はすぐに1件ずつの解析に切り替える。
+    バッチは入力の大きさ（size_of）の合計が max_batch_size を超えないようにまとめる。
+    size_of が失敗した入力は単独のバッチにし、1件ずつの解析と同じく失敗・再試行の扱いにする。
+    バッチの一部が失敗した場合は以降のバッチの件数を半分にし、全件成功すると1件ずつ戻す。
+    """
+
+    def __init__(self, analyze, analyze_batch, batch_size=ANALYSIS_BATCH_SIZE,
+                 max_batch_size=ANALYSIS_BATCH_MAX_BYTES, size_of=len, **kwargs):
+        super().__init__(analyze, **kwargs)
+        self.analyze_batch = analyze_batch
+        self.batch_size = max(batch_size, 1)
+        self.max_batch_size = max_batch_size
+        self.size_of = size_of
+        self.batch_limit = self.batch_size
+        self.batch_count = 0
+        self.fallback_count = 0
+        self._stats_lock = threading.Lock()
+
+    def _batches(self, items):
+        """入力を (キー, 入力) のリストにまとめる。例外オブジェクトの入力は単独のバッチにする"""
+        batch = []
+        total = 0
+        for key, payload in items:
+            size = None
+            if not isinstance(payload, Exception):
+                try:
+                    size = self.size_of(payload)
+                except Exception:
+                    # 大きさが分からない入力（壊れたメール等）は単独で解析させ、失敗はその入力だけの扱いにする
+                    pass
+            if size is None:
+                if batch:
+                    yield batch
+                    batch, total = [], 0
+                yield [(key, payload)]
+                continue
+            if batch and (len(batch) >= self.batch_limit or total + size > self.max_batch_size):
+                yield batch
+                batch, total = [], 0
+            batch.append((key, payload))
+            total += size
+        if batch:
+            yield batch
+
+    def _analyze_batch(self, batch):
+        """バッチを解析し、入力ごとの (結果, エラー) のリストを返す"""
+        payloads = [payload for _, payload in batch]
+        if len(payloads) == 1:
+            results = [None]
+        else:
+            def attempt():
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                return self.analyze_batch(payloads)
+            try:
+                results = call_with_retries(attempt, max_retries=self.max_retries,
+                                            retryable=is_transient_request_error)
+            except Exception as e:
+                results = [e] * len(payloads)
+
+        outcomes = []
+        missing = 0
+        for payload, result in zip(payloads, results):
+            if result is not None and not isinstance(result, Exception):
+                outcomes.append((result, None))
+                continue
+            # バッチで得られなかった入力は1件ずつ解析し直す
+            missing += 1
+            try:
+                outcomes.append((self._analyze_one(payload), None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+        with self._stats_lock:
+            self.batch_count += 1
+            if len(payloads) > 1 and missing:
+                self.fallback_count += missing
+                self.batch_limit = max(self.batch_limit // 2, 1)
+            elif not missing or len(payloads) == 1:
+                self.batch_limit = min(self.batch_limit + 1, self.batch_size)
+        return outcomes
+
+    def _submit_batch(self, executor, batch):
+        if isinstance(batch[0][1], Exception):
+            return batch, None
+        return batch, executor.submit(self._analyze_batch, batch)
+
+    def run(self, items):
+        batches = self._batches(iter(items))
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(self._submit_batch(executor, batch))
+                if len(pending) >= self.concurrency * 2:
+                    break
+            while pending:
+                batch, future = pending.popleft()
+                if future is None:
+                    outcomes = [(None, payload) for _, payload in batch]
+                else:
+                    try:
+                        outcomes = future.result()
+                    except Exception as e:
+                        outcomes = [(None, e)] * len(batch)
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    pending.append(self._submit_batch(executor, next_batch))
+                for (key, payload), (result, error) in zip(batch, outcomes):
+                    yield key, payload, result, error
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
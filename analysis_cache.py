@@ -0,0 +1,149 @@
+"""
+AI解析結果のディスクキャッシュ
+
+件名・本文・送信者・日付（正規化後）、プロンプトのバージョン、モデル名のハッシュをキーに解析結果を保存する。
+同じメールの再解析（処理状態のリセット・案件削除後の再処理など）ではモデルを呼ばずに結果を返す。
+デプロイ対象の weekly_reports.db とは別のSQLiteファイルに保存し、合計サイズが上限を超えたら
+最後に使われたのが古いものから削除する。
+"""
+
+import hashlib
+import json
+import threading
+import unicodedata
+
+import report_db
+
+# キャッシュの合計サイズの上限（解析結果のJSONのバイト数）
+ANALYSIS_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# 上限を超えたときは、この割合まで減らす（削除を毎回行わないため）
+EVICT_TARGET_RATIO = 0.9
+
+# ヒットしたエントリの最終使用日時・ヒット数の更新は、この件数たまるか次の put()・close() でまとめて書き込む
+TOUCH_BATCH_SIZE = 100
+
+
+def normalize_text(text):
+    """表記ゆれでキーが変わらないよう正規化（Unicode NFC・改行コード・行末の空白）"""
+    text = unicodedata.normalize('NFC', text or '')
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+
+
+def cache_key(subject, body, sender, date, prompt_version, model_name):
+    """解析結果のキャッシュキー（SHA-256）を作成"""
+    parts = [subject, body, sender, date, prompt_version, model_name]
+    payload = '\x00'.join(normalize_text(str(part)) for part in parts)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    スレッドセーフな解析結果キャッシュ（SQLite）
+
+    get() / put() は解析段の複数スレッドから呼ばれるため、1つの接続をロックで保護して使う。
+    ヒットのたびに書き込み・コミットしないよう、最終使用日時の更新はメモリにためてまとめて書き込む
+    （削除対象の選択の前にも書き込むため、最近使われたエントリが先に削除されることはない）。
+    """
+
+    def __init__(self, path, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._touched = {}   # キー → 未書き込みのヒット数
+        self._lock = threading.Lock()
+        self._conn = report_db.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT NOT NULL DEFAULT (datetime('now')),
+                last_used_at REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache(last_used_at)'
+        )
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM analysis_cache').fetchone()[0]
+
+    def get(self, key):
+        """キャッシュされた解析結果を取得（なければ None）"""
+        with self._lock:
+            row = self._conn.execute('SELECT result FROM analysis_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._touched[key] = self._touched.get(key, 0) + 1
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._write_touches()
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def _write_touches(self):
+        """ためておいたヒットを書き込む（コミットは呼び出し側で行う）"""
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE analysis_cache SET last_used_at = julianday('now'), hit_count = hit_count + ? WHERE key = ?",
+            [(count, key) for key, count in self._touched.items()]
+        )
+        self._touched = {}
+
+    def put(self, key, result):
+        """解析結果を保存（上限を超えた分は最後に使われたのが古いものから削除）"""
+        data = json.dumps(result, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._write_touches()
+            old = self._conn.execute('SELECT size FROM analysis_cache WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, result, size, last_used_at) "
+                "VALUES (?, ?, ?, julianday('now'))",
+                (key, data, size)
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        rows = self._conn.execute('SELECT key, size FROM analysis_cache ORDER BY last_used_at')
+        victims = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            victims.append((key,))
+            self._size -= size
+        self._conn.executemany('DELETE FROM analysis_cache WHERE key = ?', victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        """ヒット・ミス数と使用量を取得"""
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def close(self):
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+            self._conn.close()
@@ -1,10 +1,25 @@
 import os
 import sqlite3
 import json
-from datetime import datetime
-from flask import Flask, render_template, jsonify, request, send_from_directory
+import base64
+import binascii
+import csv
+import gzip
+import hashlib
+import io
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import Flask, render_template, jsonify, request, send_from_directory, g
 from flask_cors import CORS
 
+import ingest_jobs
+import report_db
+import weekly_report_processor
+from response_cache import ResponseCache
+
 # Flask初期化
 app = Flask(__name__)
 CORS(app)
@@ -14,142 +29,305 @@ DATABASE = os.environ.get('DATABASE_PATH', 'weekly_reports.db')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SECRET_KEY'] = SECRET_KEY
 
+# APIレスポンスのキャッシュ（ワーカープロセスごと、データバージョンで無効化）
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+)
+
+# この大きさ以上のJSONレスポンスをgzip圧縮する
+GZIP_MIN_SIZE = 1024
+
+# 1ページあたりの最大件数
+MAX_PER_PAGE = 100
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+
+# 週報処理ジョブのログファイル名の接頭辞（一時ディレクトリに作成し、ジョブと一緒に削除する）
+JOB_LOG_PREFIX = 'weekly_report_job_'
+
+# ジョブのイベント配信（Server-Sent Events）
+SSE_POLL_SECONDS = 0.25        # ログファイルへの追記を確認する間隔
+SSE_STATUS_SECONDS = 1.0       # ジョブの状態・進捗をDBで確認する間隔
+SSE_HEARTBEAT_SECONDS = 15     # 何も送らない状態がこの秒数続いたらコメント行を送る（プロキシの切断防止）
+SSE_STREAM_SECONDS = 55        # 1回の接続の最大時間（gunicornの --timeout より短くし、EventSource の自動再接続で続ける）
+SSE_RETRY_MS = 1000            # 切断後に EventSource が再接続するまでの時間
+LOG_SCAN_BYTES = 4096          # 再開位置を行の先頭に戻すときに一度に読み戻すバイト数
+# ワーカープロセスごとの同時配信数の上限（1配信が1スレッドを占有するため、--threads より小さくして
+# 残りのスレッドを通常のAPIに残す。上限を超えた接続には 503 を返し、クライアントは process_status のポーリングに切り替える）
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 2))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# ワーカープロセスごとの接続プール（gunicornのスレッド間で共有）
+db_pool = report_db.ConnectionPool(DATABASE, size=DB_POOL_SIZE, row_factory=sqlite3.Row)
+schema_lock = threading.Lock()
+
+# 全文検索インデックスの状態（プロセスごとに初回接続時に確認）
+search_index_enabled = None
+
 def get_db():
-    """データベース接続を取得"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """データベース接続をプールから取得（close()でプールに返却）"""
+    global search_index_enabled
+    conn = db_pool.acquire()
+    if search_index_enabled is None:
+        with schema_lock:
+            if search_index_enabled is None:
+                # アップロードされた既存DBにも未適用のマイグレーションを適用する
+                search_index_enabled = report_db.migrate(conn)
     return conn
 
 def init_db():
     """データベースを初期化"""
-    conn = get_db()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS weekly_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            mail_id TEXT,
-            report_date TEXT,
-            reporter TEXT,
-            client_name TEXT,
-            client_department TEXT,
-            client_person TEXT,
-            employee_name TEXT,
-            content TEXT
-        )
-    ''')
-    conn.commit()
+    global search_index_enabled
+    conn = db_pool.acquire()
+    search_index_enabled = report_db.migrate(conn)
     conn.close()
 
+def data_versioned(view):
+    """
+    データバージョンに基づくHTTPキャッシュ（ETag / Last-Modified）を付与するデコレータ
+
+    データが変わっていなければビューを実行せずに 304 を返す。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        conn = get_db()
+        version, updated_at, epoch = report_db.get_data_version(conn)
+        conn.close()
+        # 差し替えられたDBで同じバージョンになってもキャッシュが混ざらないようエポックと組み合わせる
+        g.data_version = (epoch, version)
+        
+        # 同じURL（クエリ含む）・同じDB（エポック）・同じデータバージョンなら同じ内容
+        path_hash = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+        etag = f'{epoch}-v{version}-{path_hash}'
+        last_modified = datetime.fromtimestamp(updated_at, tz=timezone.utc)
+        
+        # gzip版のETagにも一致させる
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match or f'{etag}-gzip' in request.if_none_match
+        else:
+            not_modified = (request.if_modified_since is not None
+                            and last_modified <= request.if_modified_since)
+        
+        if not_modified:
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # ブラウザに毎回再検証させる（変更がなければ304）
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def response_cached(view):
+    """
+    計算結果（JSON本文）をプロセス内キャッシュに保存するデコレータ
+
+    data_versioned の内側で使い、同じデータバージョンの間はキャッシュから返す。
+    キーはパスと正規化したクエリパラメータ（空の値を除いてソート）。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        params = sorted((k, v) for k, v in request.args.items(multi=True) if v != '')
+        key = request.path + '?' + '&'.join(f'{k}={v}' for k, v in params)
+        version = g.data_version
+        
+        body = response_cache.get(key, version)
+        if body is not None:
+            return app.response_class(body, mimetype='application/json')
+        
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response_cache.put(key, version, response.get_data())
+        return response
+    return wrapper
+
+@app.after_request
+def compress_response(response):
+    """大きなJSONレスポンスをgzip圧縮"""
+    if (response.status_code != 200
+            or response.is_streamed
+            or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+    
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag:
+        # 圧縮版は別の表現なので別のETagにする
+        response.set_etag(f'{etag}-gzip', weak)
+    return response
+
 @app.route('/')
 def index():
     """メインページ"""
     return render_template('index.html')
 
-@app.route('/api/reports')
-def get_reports():
-    """週報データを取得するAPI"""
-    # クエリパラメータ取得
-    reporter = request.args.get('reporter')
-    client = request.args.get('client')
-    product = request.args.get('product')
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    search = request.args.get('search')
-    # ページネーション（バリデーション付き）
+# 案件1件分の列（詳細・一覧・エクスポート共通）
+PROJECT_COLUMNS = ('id', 'mail_id', 'report_date', 'reporter', 'client_name',
+                   'client_department', 'client_person', 'employee_name', 'product_name', 'content')
+
+def get_page_args(default_per_page=20):
+    """page / per_page パラメータを取得（per_page は MAX_PER_PAGE まで）"""
     try:
-        page = int(request.args.get('page', 1))
+        page = max(int(request.args.get('page', 1)), 1)
     except (ValueError, TypeError):
         page = 1
     
     try:
-        per_page = int(request.args.get('per_page', 20))
+        per_page = int(request.args.get('per_page', default_per_page))
     except (ValueError, TypeError):
-        per_page = 20
-    
-    # メールごとにグループ化したクエリ
-    query = '''
-        SELECT mail_id, 
-               MIN(report_date) as report_date, 
-               MIN(reporter) as reporter,
-               COUNT(*) as report_count,
-               GROUP_CONCAT(DISTINCT client_name) as clients,
-               GROUP_CONCAT(DISTINCT product_name) as products,
-               GROUP_CONCAT(content, ' | ') as all_content
-        FROM weekly_reports
-        WHERE 1=1
-    '''
+        per_page = default_per_page
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    return page, per_page
+
+def build_report_filters(args):
+    """
+    /api/reports と同じ絞り込み条件のWHERE句（AND から始まる）とパラメータを組み立てる
+    """
+    reporter = args.get('reporter')
+    client = args.get('client')
+    product = args.get('product')
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
+    search = args.get('search')
+    
+    where = ''
     params = []
     
     if reporter:
-        query += ' AND reporter = ?'
+        where += ' AND reporter = ?'
         params.append(reporter)
     
     if client:
-        query += ' AND client_name LIKE ?'
-        params.append(f'%{client}%')
+        facet_sql, facet_params = report_db.facet_condition('report_clients', client)
+        where += facet_sql
+        params.extend(facet_params)
     
     if product:
-        query += ' AND product_name LIKE ?'
-        params.append(f'%{product}%')
+        facet_sql, facet_params = report_db.facet_condition('report_products', product)
+        where += facet_sql
+        params.extend(facet_params)
     
     if date_from:
-        query += ' AND report_date >= ?'
+        where += ' AND report_date >= ?'
         params.append(date_from)
     
     if date_to:
-        query += ' AND report_date <= ?'
+        where += ' AND report_date <= ?'
         params.append(date_to)
     
     if search:
-        query += ' AND (content LIKE ? OR client_name LIKE ? OR client_person LIKE ? OR product_name LIKE ?)'
-        params.extend([f'%{search}%', f'%{search}%', f'%{search}%', f'%{search}%'])
+        search_sql, search_params = report_db.search_condition(search, search_index_enabled)
+        where += search_sql
+        params.extend(search_params)
     
-    # メールごとにグループ化して日付の新しい順にソート
-    query += ' GROUP BY mail_id ORDER BY report_date DESC LIMIT ? OFFSET ?'
-    params.append(per_page)
-    params.append((page - 1) * per_page)
-    
-    # 総メール数を取得（フィルタ適用）
-    count_query = '''
-        SELECT COUNT(DISTINCT mail_id) as total
-        FROM weekly_reports
-        WHERE 1=1
-    '''
-    count_params = []
+    return where, params
+
+def encode_cursor(report_date, mail_id):
+    """(report_date, mail_id) を不透明なカーソル文字列に変換"""
+    raw = json.dumps([report_date, mail_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """カーソル文字列を (report_date, mail_id) に戻す（不正な場合は ValueError）"""
+    try:
+        report_date, mail_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError('invalid cursor')
+    if not isinstance(mail_id, str) or not (report_date is None or isinstance(report_date, str)):
+        raise ValueError('invalid cursor')
+    return report_date, mail_id
+
+@app.route('/api/reports')
+@data_versioned
+@response_cached
+def get_reports():
+    """
+    週報データを取得するAPI
+
+    cursor を指定すると (report_date, mail_id) によるキーセットページネーション、
+    指定しない場合は従来の page/per_page によるページネーションを行う。
+    include_total=0 の場合は総件数の集計を省略する。
+    """
+    # ページネーション（バリデーション付き）
+    page, per_page = get_page_args()
     
-    if reporter:
-        count_query += ' AND reporter = ?'
-        count_params.append(reporter)
+    cursor_param = request.args.get('cursor')
+    include_total = request.args.get('include_total', '1').lower() not in ('0', 'false', 'no')
     
-    if client:
-        count_query += ' AND client_name LIKE ?'
-        count_params.append(f'%{client}%')
+    where, filter_params = build_report_filters(request.args)
     
-    if product:
-        count_query += ' AND product_name LIKE ?'
-        count_params.append(f'%{product}%')
+    cursor_date = cursor_mail_id = None
+    if cursor_param:
+        try:
+            cursor_date, cursor_mail_id = decode_cursor(cursor_param)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
     
-    if date_from:
-        count_query += ' AND report_date >= ?'
-        count_params.append(date_from)
+    # メールごとの集計テーブルから取得（絞り込み条件は案件単位で判定）
+    base_query = '''
+        SELECT mail_id, report_date, reporter, report_count,
+               clients, products, all_content
+        FROM mail_summaries
+        WHERE 1=1
+    '''
+    base_params = []
     
-    if date_to:
-        count_query += ' AND report_date <= ?'
-        count_params.append(date_to)
+    if where:
+        base_query += ' AND mail_id IN (SELECT mail_id FROM weekly_reports WHERE 1=1' + where + ')'
+        base_params.extend(filter_params)
     
-    if search:
-        count_query += ' AND (content LIKE ? OR client_name LIKE ? OR client_person LIKE ? OR product_name LIKE ?)'
-        count_params.extend([f'%{search}%', f'%{search}%', f'%{search}%', f'%{search}%'])
+    def fetch_page(conn, condition, condition_params, limit, offset=0):
+        """日付の新しい順（NULLは最後）に集計行を取得"""
+        query = base_query + condition + ' ORDER BY report_date DESC, mail_id DESC LIMIT ? OFFSET ?'
+        return conn.execute(query, base_params + condition_params + [limit, offset]).fetchall()
     
     # データ取得
     conn = get_db()
     
-    # 総件数取得
-    total_count = conn.execute(count_query, count_params).fetchone()['total']
+    # 総件数取得（フィルタ適用、省略可）
+    total_count = None
+    if include_total:
+        if where:
+            count_query = '''
+                SELECT COUNT(DISTINCT mail_id) as total
+                FROM weekly_reports
+                WHERE 1=1
+            ''' + where
+        else:
+            count_query = 'SELECT COUNT(*) as total FROM mail_summaries'
+        total_count = conn.execute(count_query, filter_params).fetchone()['total']
     
-    # レポート取得
-    cursor = conn.execute(query, params)
+    # レポート取得（次ページの有無を判定するため1件多く取得）
+    if not cursor_param:
+        rows = fetch_page(conn, '', [], per_page + 1, (page - 1) * per_page)
+    elif cursor_date is None:
+        rows = fetch_page(conn, ' AND report_date IS NULL AND mail_id < ?', [cursor_mail_id], per_page + 1)
+    else:
+        # カーソル位置より後ろの日付付きのメール（インデックスを範囲検索）
+        rows = fetch_page(conn, ' AND (report_date, mail_id) < (?, ?)', [cursor_date, cursor_mail_id], per_page + 1)
+        if len(rows) <= per_page:
+            # 日付のないメールは最後に続ける
+            rows += fetch_page(conn, ' AND report_date IS NULL', [], per_page + 1 - len(rows))
+    conn.close()
+    
+    has_more = len(rows) > per_page
     reports = []
-    for row in cursor:
+    for row in rows[:per_page]:
         reports.append({
             'mail_id': row['mail_id'],
             'report_date': row['report_date'],
@@ -159,17 +337,23 @@ def get_reports():
             'products': row['products'],
             'all_content': row['all_content']
         })
-    conn.close()
+    
+    next_cursor = None
+    if has_more:
+        last = reports[-1]
+        next_cursor = encode_cursor(last['report_date'], last['mail_id'])
     
     return jsonify({
         'reports': reports,
         'total_count': total_count,
         'page': page,
         'per_page': per_page,
-        'has_more': total_count > page * per_page
+        'has_more': has_more,
+        'next_cursor': next_cursor
     })
 
 @app.route('/api/mail_detail/<mail_id>')
+@data_versioned
 def get_mail_detail(mail_id):
     """メールの詳細情報を取得"""
     conn = get_db()
@@ -199,6 +383,7 @@ def get_mail_detail(mail_id):
     return jsonify(reports)
 
 @app.route('/api/reporters')
+@data_versioned
 def get_reporters():
     """報告者リストを取得"""
     conn = get_db()
@@ -208,159 +393,200 @@ def get_reporters():
     return jsonify(reporters)
 
 @app.route('/api/clients')
+@data_versioned
+@response_cached
 def get_clients():
-    """客先リストを取得（カンマ区切りを分離）"""
+    """客先リストを取得（カンマ区切りは登録時に分離済み）"""
     conn = get_db()
-    cursor = conn.execute('SELECT DISTINCT client_name FROM weekly_reports WHERE client_name IS NOT NULL AND client_name != ""')
-    
-    # カンマ（,）と日本語読点（、）で区切りの客先名を個別に分離
-    clients_set = set()
-    for row in cursor:
-        if row['client_name']:
-            # カンマと日本語読点で分割して個別の客先名を取得
-            import re
-            clients = re.split(r'[,、]', row['client_name'])
-            for client in clients:
-                client = client.strip()  # 前後の空白を削除
-                if client:  # 空文字列でない場合のみ追加
-                    clients_set.add(client)
-    
-    # リストに変換してソート
-    clients = sorted(list(clients_set))
+    cursor = conn.execute('SELECT DISTINCT name FROM report_clients ORDER BY name')
+    clients = [row['name'] for row in cursor]
     conn.close()
     return jsonify(clients)
 
 @app.route('/api/products')
+@data_versioned
+@response_cached
 def get_products():
-    """製品リストを取得（カンマ区切りを分離）"""
+    """製品リストを取得（カンマ区切りは登録時に分離済み）"""
     conn = get_db()
-    cursor = conn.execute('SELECT DISTINCT product_name FROM weekly_reports WHERE product_name IS NOT NULL AND product_name != ""')
-    
-    # カンマ（,）と日本語読点（、）で区切りの製品名を個別に分離
-    products_set = set()
-    for row in cursor:
-        if row['product_name']:
-            # カンマと日本語読点で分割して個別の製品名を取得
-            import re
-            products = re.split(r'[,、]', row['product_name'])
-            for product in products:
-                product = product.strip()  # 前後の空白を削除
-                if product:  # 空文字列でない場合のみ追加
-                    products_set.add(product)
-    
-    # リストに変換してソート
-    products = sorted(list(products_set))
+    cursor = conn.execute('SELECT DISTINCT name FROM report_products ORDER BY name')
+    products = [row['name'] for row in cursor]
     conn.close()
     return jsonify(products)
 
-@app.route('/api/client_projects/<client>')
-def get_client_projects(client):
-    """特定客先の案件一覧を取得"""
+def get_facet_projects(table, name):
+    """客先・製品ファセットに一致する案件をページ単位で取得"""
+    page, per_page = get_page_args(default_per_page=50)
+    
     conn = get_db()
-    cursor = conn.execute('''
-        SELECT id, mail_id, report_date, reporter, client_name, 
-               client_department, client_person, employee_name, product_name, content
+    total_count = conn.execute(
+        f'SELECT COUNT(*) as total FROM {table} WHERE name = ?', (name,)
+    ).fetchone()['total']
+    
+    # 次ページの有無を判定するため1件多く取得
+    rows = conn.execute(f'''
+        SELECT {', '.join(PROJECT_COLUMNS)}
         FROM weekly_reports
-        WHERE client_name LIKE ?
+        WHERE id IN (SELECT report_id FROM {table} WHERE name = ?)
         ORDER BY report_date DESC, id DESC
-    ''', (f'%{client}%',))
-    
-    projects = []
-    for row in cursor:
-        projects.append({
-            'id': row['id'],
-            'mail_id': row['mail_id'],
-            'report_date': row['report_date'],
-            'reporter': row['reporter'],
-            'client_name': row['client_name'],
-            'client_department': row['client_department'],
-            'client_person': row['client_person'],
-            'employee_name': row['employee_name'],
-            'product_name': row['product_name'],
-            'content': row['content']
-        })
-    
+        LIMIT ? OFFSET ?
+    ''', (name, per_page + 1, (page - 1) * per_page)).fetchall()
     conn.close()
-    return jsonify(projects)
+    
+    projects = [{col: row[col] for col in PROJECT_COLUMNS} for row in rows[:per_page]]
+    return jsonify({
+        'projects': projects,
+        'total_count': total_count,
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(rows) > per_page
+    })
+
+@app.route('/api/client_projects/<client>')
+@data_versioned
+def get_client_projects(client):
+    """特定客先の案件一覧を取得（ページ単位）"""
+    return get_facet_projects('report_clients', client)
 
 @app.route('/api/product_projects/<product>')
+@data_versioned
 def get_product_projects(product):
-    """特定製品の案件一覧を取得"""
-    conn = get_db()
-    cursor = conn.execute('''
-        SELECT id, mail_id, report_date, reporter, client_name, 
-               client_department, client_person, employee_name, product_name, content
+    """特定製品の案件一覧を取得（ページ単位）"""
+    return get_facet_projects('report_products', product)
+
+@app.route('/api/export')
+def export_reports():
+    """
+    /api/reports と同じ絞り込み条件の案件をエクスポート
+
+    format=ndjson（既定）または csv。カーソルから1行ずつストリーミングするため、
+    件数にかかわらずメモリ使用量は一定。
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    where, params = build_report_filters(request.args)
+    query = f'''
+        SELECT {', '.join(PROJECT_COLUMNS)}
         FROM weekly_reports
-        WHERE product_name LIKE ?
-        ORDER BY report_date DESC, id DESC
-    ''', (f'%{product}%',))
+        WHERE 1=1
+    ''' + where + ' ORDER BY report_date DESC, id DESC'
     
-    projects = []
-    for row in cursor:
-        projects.append({
-            'id': row['id'],
-            'mail_id': row['mail_id'],
-            'report_date': row['report_date'],
-            'reporter': row['reporter'],
-            'client_name': row['client_name'],
-            'client_department': row['client_department'],
-            'client_person': row['client_person'],
-            'employee_name': row['employee_name'],
-            'product_name': row['product_name'],
-            'content': row['content']
-        })
+    def generate():
+        conn = get_db()
+        try:
+            cursor = conn.execute(query, params)
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                # Excelで文字化けしないようにBOMを付ける
+                buffer.write('\ufeff')
+                writer.writerow(PROJECT_COLUMNS)
+                for row in cursor:
+                    writer.writerow(tuple(row))
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                for row in cursor:
+                    yield json.dumps(dict(zip(PROJECT_COLUMNS, row)), ensure_ascii=False) + '\n'
+        finally:
+            conn.close()
     
-    conn.close()
-    return jsonify(projects)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if export_format == 'csv':
+        mimetype = 'text/csv'
+        filename = f'weekly_reports_{timestamp}.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = f'weekly_reports_{timestamp}.ndjson'
+    
+    response = app.response_class(generate(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @app.route('/api/stats')
+@data_versioned
+@response_cached
 def get_stats():
-    """統計情報を取得"""
-    conn = get_db()
+    """
+    統計情報を取得
+
+    日単位の集計テーブル（report_rollups）から求めるため、案件数に依存しない。
+    date_from / date_to で期間を指定できる。期間指定がない場合の月別件数は最近 months ヶ月分（既定6）。
+    """
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    try:
+        months = max(int(request.args.get('months', 6)), 1)
+    except (ValueError, TypeError):
+        months = 6
     
-    # 総件数
-    total = conn.execute('SELECT COUNT(*) as cnt FROM weekly_reports').fetchone()['cnt']
+    # 期間の絞り込み
+    where = ''
+    params = []
+    if date_from:
+        where += " AND day >= ?"
+        params.append(date_from)
+    if date_to:
+        where += " AND day <= ?"
+        params.append(date_to)
+    if date_from or date_to:
+        where += " AND day != ''"
     
-    # 報告者別件数
+    conn = get_db()
+    
+    # 報告者別件数（総件数も報告者別の合計から求める）
     reporter_stats = []
     cursor = conn.execute('''
-        SELECT reporter, COUNT(*) as cnt 
-        FROM weekly_reports 
-        GROUP BY reporter 
+        SELECT NULLIF(key, '') as reporter, SUM(count) as cnt
+        FROM report_rollups
+        WHERE dimension = 'reporter'
+    ''' + where + '''
+        GROUP BY key
         ORDER BY cnt DESC
-    ''')
+    ''', params)
     for row in cursor:
         reporter_stats.append({
             'reporter': row['reporter'],
             'count': row['cnt']
         })
+    total = sum(item['count'] for item in reporter_stats)
     
     # 客先別件数
     client_stats = []
     cursor = conn.execute('''
-        SELECT client_name, COUNT(*) as cnt 
-        FROM weekly_reports 
-        WHERE client_name IS NOT NULL AND client_name != ''
-        GROUP BY client_name 
+        SELECT key as client_name, SUM(count) as cnt
+        FROM report_rollups
+        WHERE dimension = 'client'
+    ''' + where + '''
+        GROUP BY key
         ORDER BY cnt DESC
         LIMIT 10
-    ''')
+    ''', params)
     for row in cursor:
         client_stats.append({
             'client': row['client_name'],
             'count': row['cnt']
         })
     
-    # 月別件数（最近6ヶ月）
+    # 月別件数（期間指定がなければ最近 months ヶ月）
     monthly_stats = []
-    cursor = conn.execute('''
-        SELECT strftime('%Y-%m', report_date) as month, COUNT(*) as cnt
-        FROM weekly_reports
-        WHERE report_date IS NOT NULL
+    monthly_query = '''
+        SELECT strftime('%Y-%m', day) as month, SUM(count) as cnt
+        FROM report_rollups
+        WHERE dimension = 'reporter' AND day != ''
+    ''' + where + '''
         GROUP BY month
         ORDER BY month DESC
-        LIMIT 6
-    ''')
+    '''
+    monthly_params = list(params)
+    if not (date_from or date_to):
+        monthly_query += ' LIMIT ?'
+        monthly_params.append(months)
+    cursor = conn.execute(monthly_query, monthly_params)
     for row in cursor:
         monthly_stats.append({
             'month': row['month'],
@@ -434,6 +660,11 @@ def update_project(project_id):
         conn.close()
         return jsonify({'error': 'Project not found'}), 404
     
+    # 客先・製品ファセットとメール集計を更新
+    report_db.sync_facets(conn, project_id, data.get('client_name'), data.get('product_name'))
+    mail_id = conn.execute('SELECT mail_id FROM weekly_reports WHERE id = ?', (project_id,)).fetchone()['mail_id']
+    report_db.refresh_mail_summary(conn, mail_id)
+    
     conn.commit()
     conn.close()
     
@@ -443,12 +674,15 @@ def update_project(project_id):
 def delete_project(project_id):
     """個別プロジェクトを削除"""
     conn = get_db()
-    cursor = conn.execute('DELETE FROM weekly_reports WHERE id = ?', (project_id,))
+    project = conn.execute('SELECT mail_id FROM weekly_reports WHERE id = ?', (project_id,)).fetchone()
     
-    if cursor.rowcount == 0:
+    if not project:
         conn.close()
         return jsonify({'error': 'Project not found'}), 404
     
+    conn.execute('DELETE FROM weekly_reports WHERE id = ?', (project_id,))
+    report_db.refresh_mail_summary(conn, project['mail_id'])
+    
     conn.commit()
     conn.close()
     
@@ -461,6 +695,7 @@ def delete_mail_projects(mail_id):
     cursor = conn.execute('DELETE FROM weekly_reports WHERE mail_id = ?', (mail_id,))
     
     deleted_count = cursor.rowcount
+    report_db.refresh_mail_summary(conn, mail_id)
     conn.commit()
     conn.close()
     
@@ -469,129 +704,126 @@ def delete_mail_projects(mail_id):
         'deleted_count': deleted_count
     })
 
-# プロセス管理用のグローバル変数
-running_processes = {}
+def run_processor_job(job_id, log_file):
+    """週報処理（sync）をこのプロセス内で実行する（バックグラウンドのスレッドで実行される）"""
+    cancel_event = threading.Event()
+    progress = {}
+    with open(log_file, 'a', encoding='utf-8', errors='replace') as log:
+        def run():
+            # ログはジョブの終了を記録する前に書き終える（SSEは終了を確認した後に残りのログを送る）
+            try:
+                options = weekly_report_processor.parse_args(['sync'])
+                with weekly_report_processor.WeeklyReportProcessor(
+                        options, out=log, db_file=DATABASE, cancel_event=cancel_event, progress=progress) as processor:
+                    summary = processor.run()
+            except Exception as e:
+                log.write(f'\n[ERROR] {str(e)}\n')
+                log.flush()
+                raise
+            log.write(f"ジョブ終了 (新規登録 {summary.get('registered', 0)}件)\n")
+            log.flush()
+            return summary
+
+        log.write("週報処理を開始します...\n")
+        log.flush()
+        try:
+            ingest_jobs.run_job(DATABASE, job_id, run, cancel_event, progress)
+        except Exception:
+            # エラーはログとジョブの状態（failed）に記録済み
+            pass
+
+def complete_lines(data, final=False):
+    """ログの読み取り分のうち、改行で終わる行までのバイト列（final なら全部）"""
+    return data if final else data[:data.rfind(b'\n') + 1]
+
+def line_start(f, offset):
+    """
+    ログの offset（バイト位置）を、その位置を含む行の先頭に戻す
+
+    クライアントが指定した位置が行やマルチバイト文字の途中でも、行の先頭から読み直す
+    （壊れた文字を含む行の断片を送らない）。行の先頭を指している場合はそのまま返す。
+    """
+    f.seek(0, os.SEEK_END)
+    end = min(offset, f.tell())
+    while end > 0:
+        start = max(0, end - LOG_SCAN_BYTES)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+def read_job_log(log_file, offset, final=False):
+    """
+    ジョブのログを offset（バイト位置）から読み、(テキスト, 次のバイト位置) を返す
+
+    offset は行の先頭に揃えてから読む。実行中のジョブは書き込み途中の行（マルチバイト文字の途中を含む）を
+    返さないよう、改行までで区切る。
+    """
+    with open(log_file, 'rb') as f:
+        offset = line_start(f, offset)
+        f.seek(offset)
+        data = complete_lines(f.read(), final)
+    return data.decode('utf-8', errors='replace'), offset + len(data)
+
+def parse_log_offset(value):
+    """
+    ログのバイト位置の指定（offset / Last-Event-ID）を解釈する
+
+    数値でなければ ValueError を送出し、負の値は 0 とみなす。
+    """
+    return max(0, int(value or 0))
+
+def sse_event(data, event=None, event_id=None):
+    """Server-Sent Events の1イベント（複数行のデータは data: 行に分ける）"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
 
 @app.route('/api/start_process_reports', methods=['POST'])
 def start_process_reports():
-    """週報処理スクリプトを非同期で開始"""
+    """
+    週報処理をジョブとして開始
+
+    ジョブはこのワーカープロセス内のスレッドで実行し、状態はDBの ingest_jobs に記録する。
+    実行中のジョブ（コマンドラインからの実行を含む）がある場合は 409 とそのジョブIDを返す。
+    """
     try:
-        import subprocess
-        import os
-        import threading
-        import uuid
-        import tempfile
-        
-        # プロセスIDを生成
-        process_id = str(uuid.uuid4())
-        
-        # 一時ログファイルを作成
-        log_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.log')
-        log_file_path = log_file.name
-        log_file.close()
-        
-        # スクリプトのパスを取得
-        script_path = os.path.join(os.path.dirname(__file__), 'weekly_report_processor.py')
-        
-        # プロセス情報を保存
-        running_processes[process_id] = {
-            'log_file': log_file_path,
-            'is_complete': False,
-            'success': False,
-            'new_reports': 0,
-            'total_reports': 0,
-            'process': None
-        }
-        
-        # バックグラウンドでスクリプトを実行する関数
-        def run_process():
-            try:
-                # 初期ログを書き込み
-                with open(log_file_path, 'w', encoding='utf-8', errors='replace') as log_f:
-                    log_f.write("週報処理を開始します...\n")
-                
-                # 環境変数でUTF-8を強制
-                env = os.environ.copy()
-                env['PYTHONIOENCODING'] = 'utf-8'
-                
-                # Pythonスクリプトを実行（stdout/stderrをPIPEで取得）
-                process = subprocess.Popen(
-                    ['python', script_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    cwd=os.path.dirname(__file__),
-                    bufsize=1,
-                    universal_newlines=True,
-                    encoding='utf-8',
-                    errors='replace',
-                    env=env
-                )
-                
-                running_processes[process_id]['process'] = process
-                
-                # プロセス開始をログに記録
-                with open(log_file_path, 'a', encoding='utf-8', errors='replace') as log_f:
-                    log_f.write(f"プロセス開始 (PID: {process.pid})\n")
-                
-                # 出力をリアルタイムで読み取ってファイルに書き込み
-                with open(log_file_path, 'a', encoding='utf-8', errors='replace') as log_f:
-                    for line in iter(process.stdout.readline, ''):
-                        log_f.write(line)
-                        log_f.flush()
-                    
-                # プロセスの完了を待機
-                return_code = process.wait()
-                
-                # プロセス完了をログに記録
-                with open(log_file_path, 'a', encoding='utf-8', errors='replace') as log_f:
-                    log_f.write(f"プロセス完了 (終了コード: {return_code})\n")
-                
-                # ログファイルから結果を解析
-                with open(log_file_path, 'r', encoding='utf-8', errors='replace') as read_log:
-                    output = read_log.read()
-                    
-                    new_reports = 0
-                    total_reports = 0
-                    
-                    # 出力から件数情報を抽出
-                    for line in output.split('\n'):
-                        if 'をDBに登録しました' in line:
-                            new_reports += 1
-                        elif '件のメールを処理しました' in line:
-                            import re
-                            match = re.search(r'(\d+)件のメールを処理しました', line)
-                            if match:
-                                total_reports = int(match.group(1))
-                    
-                    # 結果を更新
-                    running_processes[process_id].update({
-                        'is_complete': True,
-                        'success': return_code == 0,
-                        'new_reports': new_reports,
-                        'total_reports': total_reports
-                    })
-                    
-            except Exception as e:
-                # エラーをログファイルに書き込み
-                with open(log_file_path, 'a', encoding='utf-8', errors='replace') as log_f:
-                    log_f.write(f'\n[ERROR] {str(e)}\n')
-                
-                running_processes[process_id].update({
-                    'is_complete': True,
-                    'success': False
-                })
-        
-        # バックグラウンドスレッドで実行
-        thread = threading.Thread(target=run_process)
-        thread.daemon = True
+        fd, log_file = tempfile.mkstemp(prefix=JOB_LOG_PREFIX, suffix='.log')
+        os.close(fd)
+
+        conn = get_db()
+        try:
+            # 保存期間を過ぎた古いジョブとログファイルを削除
+            ingest_jobs.cleanup_jobs(conn)
+            job_id = ingest_jobs.start_job(conn, 'sync', log_file)
+        except Exception:
+            os.remove(log_file)
+            raise
+        finally:
+            conn.close()
+
+        thread = threading.Thread(target=run_processor_job, args=(job_id, log_file),
+                                  name=f'ingest-job-{job_id}', daemon=True)
         thread.start()
-        
+
         return jsonify({
             'success': True,
-            'process_id': process_id
+            'process_id': job_id
         })
-        
+
+    except ingest_jobs.JobConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'process_id': e.job_id
+        }), 409
+
     except Exception as e:
         return jsonify({
             'success': False,
@@ -600,40 +832,190 @@ def start_process_reports():
 
 @app.route('/api/process_status/<process_id>')
 def get_process_status(process_id):
-    """プロセスの状態とログを取得"""
+    """ジョブの状態とログを取得（どのワーカーからでもDBのジョブIDで参照できる）"""
     try:
-        if process_id not in running_processes:
+        conn = get_db()
+        job = ingest_jobs.get_job(conn, process_id)
+        conn.close()
+        if job is None:
             return jsonify({'error': 'Process not found'}), 404
-        
-        process_info = running_processes[process_id]
-        offset = int(request.args.get('offset', 0))
-        
-        # ログファイルから新しい出力を読み取り
+
+        try:
+            offset = parse_log_offset(request.args.get('offset'))
+        except ValueError:
+            return jsonify({'error': 'Invalid offset'}), 400
+
+        # ログファイルから新しい出力を読み取り（offset はバイト位置）
         new_output = ""
         current_offset = offset
-        
+
         try:
-            with open(process_info['log_file'], 'r', encoding='utf-8', errors='replace') as f:
-                f.seek(offset)
-                new_output = f.read()
-                current_offset = f.tell()
-        except (FileNotFoundError, UnicodeDecodeError) as e:
+            new_output, current_offset = read_job_log(job['log_file'], offset, final=job['status'] != 'running')
+        except (TypeError, OSError) as e:
             new_output = f"[エラー] ログファイルの読み取りに失敗: {str(e)}"
-        
+
         return jsonify({
-            'is_complete': process_info['is_complete'],
-            'success': process_info['success'],
-            'new_reports': process_info['new_reports'],
-            'total_reports': process_info['total_reports'],
+            'status': job['status'],
+            'is_complete': job['status'] != 'running',
+            'success': job['status'] == 'succeeded',
+            'cancel_requested': bool(job['cancel_requested']),
+            'new_reports': job['new_reports'],
+            'total_reports': job['total_reports'],
+            'progress_done': job['progress_done'],
+            'progress_total': job['progress_total'],
+            'error': job['error'],
             'new_output': new_output,
             'current_offset': current_offset
         })
-        
+
     except Exception as e:
         return jsonify({
             'error': str(e)
         }), 500
 
+@app.route('/api/process_events/<process_id>')
+def stream_process_events(process_id):
+    """
+    ジョブのログと進捗を Server-Sent Events で配信
+
+    - log: 追記されたログ行（id はログファイルの次のバイト位置。再接続時は Last-Event-ID を含む行の先頭から再開する）
+    - progress: 状態・進捗が変わったとき（JSON）
+    - complete: ジョブが終了したとき（JSON。この後に接続を閉じる）
+    送るものがない間は SSE_HEARTBEAT_SECONDS ごとにコメント行を送る。
+    1回の接続は SSE_STREAM_SECONDS で閉じ、クライアント（EventSource）が自動で再接続する。
+    同時配信数が SSE_MAX_STREAMS に達している場合は 503 を返す（/api/process_status のポーリングで代替する）。
+    """
+    conn = get_db()
+    job = ingest_jobs.get_job(conn, process_id)
+    conn.close()
+    if job is None:
+        return jsonify({'error': 'Process not found'}), 404
+
+    try:
+        offset = parse_log_offset(request.headers.get('Last-Event-ID') or request.args.get('offset'))
+    except ValueError:
+        return jsonify({'error': 'Invalid offset'}), 400
+
+    def job_state():
+        conn = get_db()
+        try:
+            return ingest_jobs.get_job(conn, process_id)
+        finally:
+            conn.close()
+
+    def progress_payload(job):
+        return {
+            'status': job['status'],
+            'cancel_requested': bool(job['cancel_requested']),
+            'done': job['progress_done'],
+            'total': job['progress_total'],
+        }
+
+    def generate():
+        nonlocal offset
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        started = last_sent = last_checked = time.monotonic()
+        last_progress = None
+        buffer = b''
+        current = job
+        try:
+            log = open(current['log_file'], 'rb')
+        except (TypeError, OSError) as e:
+            yield sse_event(f'[エラー] ログファイルの読み取りに失敗: {e}', 'log')
+            log = None
+        try:
+            if log:
+                # Last-Event-ID が行の途中を指していても、その行の先頭から送り直す
+                offset = line_start(log, offset)
+                log.seek(offset)
+            while True:
+                now = time.monotonic()
+                finished = current['status'] != 'running'
+
+                # 追記されたログ行（終了したジョブは末尾の改行のない行も送る）
+                if log:
+                    buffer += log.read()
+                    lines = complete_lines(buffer, final=finished)
+                    if lines:
+                        buffer = buffer[len(lines):]
+                        offset += len(lines)
+                        text = lines.decode('utf-8', errors='replace')
+                        yield sse_event(text[:-1] if text.endswith('\n') else text, 'log', offset)
+                        last_sent = now
+
+                progress = progress_payload(current)
+                if progress != last_progress:
+                    yield sse_event(json.dumps(progress, ensure_ascii=False), 'progress')
+                    last_progress = progress
+                    last_sent = now
+
+                if finished:
+                    yield sse_event(json.dumps({
+                        'status': current['status'],
+                        'success': current['status'] == 'succeeded',
+                        'new_reports': current['new_reports'],
+                        'total_reports': current['total_reports'],
+                        'error': current['error'],
+                    }, ensure_ascii=False), 'complete')
+                    return
+
+                if now - last_sent >= SSE_HEARTBEAT_SECONDS:
+                    yield ': keep-alive\n\n'
+                    last_sent = now
+                if now - started >= SSE_STREAM_SECONDS:
+                    return
+
+                time.sleep(SSE_POLL_SECONDS)
+                if time.monotonic() - last_checked >= SSE_STATUS_SECONDS:
+                    current = job_state() or current
+                    last_checked = time.monotonic()
+        finally:
+            if log:
+                log.close()
+
+    if not sse_slots.acquire(blocking=False):
+        response = jsonify({
+            'error': 'Too many event streams',
+            'fallback': f'/api/process_status/{process_id}'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_STREAM_SECONDS)
+        return response
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    # 接続が閉じられたとき（ジェネレータを開始する前の切断を含む）に枠を返す
+    response.call_on_close(sse_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx（Elastic Beanstalk）のバッファリングを無効にしてすぐに届ける
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/process_cancel/<process_id>', methods=['POST'])
+def cancel_process(process_id):
+    """実行中のジョブにキャンセルを要求（解析済みの結果を書き込んでから停止する）"""
+    conn = get_db()
+    requested = ingest_jobs.request_cancel(conn, process_id)
+    conn.close()
+    if not requested:
+        return jsonify({'success': False, 'error': 'Process not running'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/process_jobs')
+def get_process_jobs():
+    """最近のジョブの一覧（新しい順）"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_PER_PAGE)
+    conn = get_db()
+    jobs = ingest_jobs.recent_jobs(conn, limit)
+    conn.close()
+    for job in jobs:
+        del job['log_file']
+    return jsonify({'jobs': jobs})
+
+
+@app.route('/api/cache_stats')
+def get_cache_stats():
+    """レスポンスキャッシュのヒット率・使用量を取得（このワーカープロセス分）"""
+    return jsonify(response_cache.stats())
 
 @app.route('/health')
 def health():
@@ -7,13 +7,12 @@
     python auto_deploy.py
 
 実行内容:
-    1. weekly_report_processor.pyを実行してメール処理
+    1. weekly_report_processor の sync を同じプロセス内でジョブとして実行してメール処理
     2. エラーチェック
-    3. weekly_reports.dbをwith_db_deploy/にコピー
+    3. weekly_reports.dbのスキーマを最新化してwith_db_deploy/にコピー
     4. with_db_deploy/の内容をZIPにパッケージング
 """
 
-import subprocess
 import sys
 import os
 import shutil
@@ -21,6 +20,10 @@ import zipfile
 from pathlib import Path
 from datetime import datetime
 
+import ingest_jobs
+import report_db
+import weekly_report_processor
+
 
 def print_section(title):
     """セクションタイトルを表示"""
@@ -30,47 +33,41 @@ def print_section(title):
 
 
 def run_weekly_report_processor():
-    """週報処理スクリプトを実行"""
+    """週報処理を同じプロセス内で実行"""
     print_section("ステップ 1: 週報メール処理")
 
-    print("週報処理を開始します...")
-    print("python weekly_report_processor.py を実行中...\n")
+    print("週報処理を開始します...\n")
 
     try:
-        result = subprocess.run(
-            [sys.executable, "weekly_report_processor.py"],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
-        )
-
-        # 出力を表示
-        print(result.stdout)
-
-        if result.stderr:
-            print("警告/エラー出力:")
-            print(result.stderr)
-
-        # エラーチェック
-        if result.returncode != 0:
-            print(f"\n[エラー] 週報処理が失敗しました (終了コード: {result.returncode})")
-            return False
-
-        # 「処理完了」メッセージの確認
-        if "処理完了" not in result.stdout:
-            print("\n[警告] 処理完了メッセージが見つかりません")
-            response = input("続行しますか？ (y/n): ")
-            if response.lower() != 'y':
-                return False
+        options = weekly_report_processor.parse_args(['sync'])
+        with weekly_report_processor.WeeklyReportProcessor(options) as processor:
+            # Webアプリ等からの実行と同時にDBへ書き込まないよう、ジョブとして登録して実行する
+            summary = processor.run_as_job()
+
+    except ingest_jobs.JobConflict as e:
+        print(f"\n[エラー] 他の週報処理が実行中のため開始できません（ジョブ {e.job_id}）")
+        print("実行中の処理が終わってから再度実行するか、Webアプリからキャンセルしてください")
+        return False
 
-        print("\n[OK] 週報処理が正常に完了しました")
-        return True
+    except weekly_report_processor.ProcessorError as e:
+        print(f"\n[エラー] 週報処理が失敗しました: {e}")
+        return False
 
     except Exception as e:
         print(f"\n[エラー] 週報処理の実行中に例外が発生しました: {e}")
         return False
 
+    # 中断・失敗したメールがある場合は確認する
+    if summary['interrupted'] or summary['failed']:
+        print(f"\n[警告] 週報処理が完了していません（失敗 {summary['failed']}件"
+              f"{'、中断されました' if summary['interrupted'] else ''}）")
+        response = input("続行しますか？ (y/n): ")
+        if response.lower() != 'y':
+            return False
+
+    print("\n[OK] 週報処理が正常に完了しました")
+    return True
+
 
 def copy_database():
     """データベースファイルをデプロイディレクトリにコピー"""
@@ -90,6 +87,19 @@ def copy_database():
         print(f"[エラー] {dest_dir} ディレクトリが見つかりません")
         return False
 
+    # スキーマを最新化（デプロイ先の初回アクセスでマイグレーションが走らないように）
+    try:
+        conn = report_db.connect(src_db)
+        before = report_db.schema_version(conn)
+        report_db.migrate(conn)
+        print(f"スキーマバージョン: {before} -> {report_db.schema_version(conn)}")
+        # WALの内容をDBファイル本体に反映してからコピーする
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+    except Exception as e:
+        print(f"[エラー] スキーマの更新に失敗しました: {e}")
+        return False
+
     # ファイルサイズ確認
     src_size = os.path.getsize(src_db) / 1024 / 1024
     print(f"コピー元: {src_db} ({src_size:.2f} MB)")
@@ -104,6 +114,12 @@ def copy_database():
     # コピー実行
     try:
         shutil.copy2(src_db, dest_db)
+        # デプロイ先では別のDBとして扱わせる（同じデータバージョンでもETagが変わり、ブラウザのキャッシュが使われない）
+        conn = report_db.connect(dest_db)
+        report_db.reset_data_epoch(conn)
+        conn.commit()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
         dest_size = os.path.getsize(dest_db) / 1024 / 1024
         print(f"コピー先: {dest_db} ({dest_size:.2f} MB)")
         print("\n[OK] データベースファイルのコピーが完了しました")
@@ -0,0 +1,123 @@
+"""
+メール取得元と解析モデルのバックエンド
+
+週報処理のパイプラインは MailSource（Gmail APIと同じ形のサービスを返す）と
+Analyzer（プロンプトを受け取りモデルの出力テキストを返す。ストリーミング生成も可）を通して外部サービスを使う。
+本番用の Gmail / Vertex AI の実装はここに、計測・テスト用のフェイクは fake_services.py にある。
+GoogleのSDKは実際に使う時点で読み込む。
+"""
+
+import os
+import pickle
+import threading
+
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+
+class MailSource:
+    """メールの取得元"""
+
+    name = 'mail'
+
+    def service(self):
+        """Gmail APIのサービスと同じインターフェースのオブジェクトを返す（スレッドごとに呼ばれる）"""
+        raise NotImplementedError
+
+
+class Analyzer:
+    """解析モデル"""
+
+    name = 'model'
+
+    def generate(self, prompt):
+        """プロンプトに対するモデルの出力テキストを返す"""
+        raise NotImplementedError
+
+    def generate_stream(self, prompt):
+        """
+        モデルの出力テキストを生成された順に断片で返すジェネレーター
+
+        途中で close() すると残りの生成を打ち切る。既定では generate() の結果を1つの断片として返す。
+        """
+        yield self.generate(prompt)
+
+
+class GmailMailSource(MailSource):
+    """
+    Gmail API（OAuth認証）
+
+    認証は最初に service() が呼ばれた時点で行い、トークンは token_file に保存する。
+    """
+
+    name = 'gmail'
+
+    def __init__(self, token_file='token.pkl', credentials_file='credentials.json', scopes=GMAIL_SCOPES):
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.scopes = scopes
+        self._creds = None
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is not None:
+                return self._creds
+            creds = None
+            if os.path.exists(self.token_file):
+                with open(self.token_file, 'rb') as token_file:
+                    creds = pickle.load(token_file)
+
+            if not creds or not creds.valid:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, self.scopes)
+                creds = flow.run_local_server(port=0)
+                with open(self.token_file, 'wb') as token_file:
+                    pickle.dump(creds, token_file)
+            self._creds = creds
+            return creds
+
+    def service(self):
+        from googleapiclient.discovery import build
+        return build('gmail', 'v1', credentials=self.credentials())
+
+
+class VertexAnalyzer(Analyzer):
+    """Vertex AI の Gemini モデル（初回の generate() で初期化する）"""
+
+    def __init__(self, project, location, model_name, key_file='vertex-key.json'):
+        self.project = project
+        self.location = location
+        self.name = model_name
+        self.key_file = key_file
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import vertexai
+                from vertexai.generative_models import GenerativeModel
+
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = self.key_file
+                vertexai.init(project=self.project, location=self.location)
+                self._model = GenerativeModel(self.name)
+            return self._model
+
+    def generate(self, prompt):
+        return self.model().generate_content(prompt).text
+
+    def generate_stream(self, prompt):
+        responses = self.model().generate_content(prompt, stream=True)
+        try:
+            for response in responses:
+                try:
+                    text = response.text
+                except ValueError:
+                    # テキストを含まない断片（終了理由のみ等）
+                    continue
+                yield text
+        finally:
+            # 途中で打ち切った場合はストリームを閉じて生成を止める
+            close = getattr(responses, 'close', None)
+            if close:
+                close()
@@ -0,0 +1,369 @@
+"""
+テスト・計測用のプロセス内フェイクサービス
+
+FakeGmailService は googleapiclient の Gmail サービスのうち、週報処理で使う部分だけを模倣する。
+FakeAnalyzer は Vertex AI の代わりに週報の解析結果らしいJSONを返す。
+ネットワークやOAuthなしでパイプラインを動かすために使う。
+
+遅延・エラーは設定でき、エラーの発生は (seed, 対象, 試行回数) から決まるため、
+スレッドの実行順に関係なく同じ設定なら同じ結果になる。
+"""
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime, timedelta
+
+from backends import Analyzer, MailSource
+
+
+def _should_fail(seed, key, attempt, error_rate):
+    """(seed, key, 試行回数) から決まる疑似乱数でエラーにするか判定"""
+    if not error_rate:
+        return False
+    return random.Random(f'{seed}:{key}:{attempt}').random() < error_rate
+
+
+class FakeHttpError(Exception):
+    """Gmail APIのエラー応答の代わり"""
+
+    def __init__(self, status, message=''):
+        super().__init__(f'{status} {message}'.strip())
+        self.status = status
+
+
+class FakeApiError(Exception):
+    """Vertex AIのエラー応答の代わり（google.api_core の例外と同じく code にHTTPステータスを持つ）"""
+
+    def __init__(self, code, message=''):
+        super().__init__(f'{code} {message}'.strip())
+        self.code = code
+
+
+class _Request:
+    """execute() で結果を返すリクエスト"""
+
+    def __init__(self, service, func):
+        self._service = service
+        self._func = func
+
+    def execute(self):
+        self._service._round_trip()
+        return self._func()
+
+
+class _BatchRequest:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        request_id = request_id or str(len(self._requests))
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        # バッチ全体で1往復
+        self._service._round_trip()
+        self._service.batch_count += 1
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._func(), None
+            except Exception as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _Resource:
+    """users().messages() などのリソース呼び出しをメソッドに振り分ける"""
+
+    def __init__(self, service, handlers):
+        self._service = service
+        self._handlers = handlers
+
+    def __getattr__(self, name):
+        if name not in self._handlers:
+            raise AttributeError(name)
+        handler = self._handlers[name]
+        if callable(handler):
+            return lambda **kwargs: _Request(self._service, lambda: handler(**kwargs))
+        return lambda: handler
+
+
+class FakeGmailService:
+    """
+    メモリ上のメールボックスを持つGmailサービスのフェイク
+
+    messages は add_message() で追加する。latency は1往復あたりの待ち時間（秒）。
+    error_rate の割合で messages().get が一時的なエラー（503）になる。
+    """
+
+    LABEL_ID = 'Label_weekly'
+
+    def __init__(self, latency=0.0, page_size=100, label_name='週報', error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self._attempts = Counter()
+        self.page_size = page_size
+        self.label_name = label_name
+        self.messages = {}
+        # 追加履歴 [(historyId, メッセージID)]。oldest_history_id より前は期限切れ扱い
+        self.history_id = 1000
+        self.history = []
+        self.oldest_history_id = 1000
+        self.request_count = 0
+        self.batch_count = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_message(self, msg_id, subject, sender, date, body):
+        """text/plain のメッセージを追加"""
+        if isinstance(date, datetime):
+            date = format_datetime(date)
+        data = base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii')
+        self.messages[msg_id] = {
+            'id': msg_id,
+            'threadId': msg_id,
+            'labelIds': [self.LABEL_ID],
+            'payload': {
+                'mimeType': 'multipart/alternative',
+                'headers': [
+                    {'name': 'Subject', 'value': subject},
+                    {'name': 'From', 'value': sender},
+                    {'name': 'Date', 'value': date},
+                ],
+                'body': {'size': 0},
+                'parts': [
+                    {'mimeType': 'text/plain', 'body': {'data': data, 'size': len(body)}},
+                ],
+            },
+        }
+        self.history_id += 1
+        self.history.append((self.history_id, msg_id))
+
+    def expire_history(self):
+        """これまでの履歴を期限切れにする（history().list が404を返す）"""
+        self.oldest_history_id = self.history_id + 1
+
+    def _list_labels(self, userId):
+        return {'labels': [{'id': self.LABEL_ID, 'name': self.label_name}]}
+
+    def _get_label(self, userId, id):
+        return {'id': id, 'name': self.label_name, 'messagesTotal': len(self.messages)}
+
+    def _get_profile(self, userId):
+        return {'emailAddress': 'me@example.com', 'historyId': str(self.history_id)}
+
+    def _list_history(self, userId, startHistoryId, labelId=None, historyTypes=None, pageToken=None):
+        start = int(startHistoryId)
+        if start < self.oldest_history_id:
+            raise FakeHttpError(404, 'Requested entity was not found.')
+        records = [
+            {'id': str(history_id),
+             'messagesAdded': [{'message': {'id': msg_id, 'labelIds': [self.LABEL_ID]}}]}
+            for history_id, msg_id in self.history
+            if history_id > start and msg_id in self.messages
+        ]
+        offset = int(pageToken or 0)
+        result = {'history': records[offset:offset + self.page_size], 'historyId': str(self.history_id)}
+        if offset + self.page_size < len(records):
+            result['nextPageToken'] = str(offset + self.page_size)
+        return result
+
+    def _list_messages(self, userId, labelIds=None, pageToken=None, maxResults=None):
+        ids = sorted(self.messages, key=lambda x: int(x, 16), reverse=True)
+        start = int(pageToken or 0)
+        size = maxResults or self.page_size
+        page = ids[start:start + size]
+        result = {'messages': [{'id': i, 'threadId': i} for i in page], 'resultSizeEstimate': len(ids)}
+        if start + size < len(ids):
+            result['nextPageToken'] = str(start + size)
+        return result
+
+    def _get_message(self, userId, id, format='full'):
+        if id not in self.messages:
+            raise FakeHttpError(404, 'Not Found')
+        with self._lock:
+            self._attempts[id] += 1
+            attempt = self._attempts[id]
+        if _should_fail(self.seed, id, attempt, self.error_rate):
+            raise FakeHttpError(503, 'Backend Error')
+        return self.messages[id]
+
+    def users(self):
+        messages = _Resource(self, {
+            'list': self._list_messages,
+            'get': self._get_message,
+        })
+        labels = _Resource(self, {'list': self._list_labels, 'get': self._get_label})
+        history = _Resource(self, {'list': self._list_history})
+        return _Resource(self, {
+            'messages': messages,
+            'labels': labels,
+            'history': history,
+            'getProfile': self._get_profile,
+        })
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
+
+
+def make_fake_mailbox(count, latency=0.0, start=None, error_rate=0.0, seed=0):
+    """週報らしい本文を持つメールを count 通含むフェイクサービスを作成"""
+    service = FakeGmailService(latency=latency, error_rate=error_rate, seed=seed)
+    start = start or datetime(2025, 1, 6, 9, 0)
+    reporters = ["西田", "村田", "田村", "上島", "藤原"]
+    for i in range(count):
+        sent = start + timedelta(days=7 * (i // len(reporters)), minutes=i)
+        reporter = reporters[i % len(reporters)]
+        service.add_message(
+            f'{0x18d0000000000000 + i:x}',
+            f'週報 {sent:%Y/%m/%d} {reporter}',
+            f'{reporter} <{i}@example.com>',
+            sent,
+            f'今週の活動報告です。\nホンダ 開発部 田中様 TF-4060のデモを実施。\n同行: 藤原\n'
+        )
+    return service
+
+
+class FakeMailSource(MailSource):
+    """合成メールボックスを持つメール取得元（全スレッドで同じ FakeGmailService を共有する）"""
+
+    name = 'fake'
+
+    def __init__(self, count, latency=0.0, error_rate=0.0, seed=0):
+        self.fake_service = make_fake_mailbox(count, latency=latency, error_rate=error_rate, seed=seed)
+
+    def service(self):
+        return self.fake_service
+
+
+# バッチ解析のプロンプトのメールの区切り（weekly_report_processor.BATCH_MAIL_HEADER）
+BATCH_SECTION = re.compile(r'^=== メールID: (\S+) ===$', re.MULTILINE)
+
+
+class FakeAnalyzer(Analyzer):
+    """
+    解析モデルのフェイク
+
+    responses（JSON文字列または辞書のリスト）を指定すると、プロンプトのハッシュで選んだものを返す。
+    指定しない場合は、プロンプト中の送信者・送信日から報告者・報告日を埋めた週報のJSONを返す。
+    skip_rate の割合のメールは週報ではないと判定し、error_rate の割合で一時的なエラー（503）を送出する。
+
+    バッチ解析のプロンプト（「=== メールID: ... ===」で区切られた複数メール）には、メールIDをキーとした
+    JSONオブジェクトを返す。drop_rate の割合のメールは応答から欠落させる。
+    バッチの遅延は latency × (1 + batch_latency_factor × (メール数 - 1))。
+
+    generate_stream() は出力を stream_chunk_chars 文字ずつ返す。遅延のうち first_chunk_share の割合を
+    最初の断片の前に、残りを出力の長さに比例して各断片の前に待つ（途中で打ち切ると残りの遅延はかからない）。
+    """
+
+    name = 'fake-model'
+
+    def __init__(self, latency=0.0, error_rate=0.0, responses=None, reports_per_mail=2,
+                 skip_rate=0.0, seed=0, drop_rate=0.0, batch_latency_factor=0.3,
+                 stream_chunk_chars=32, first_chunk_share=0.2):
+        self.latency = latency
+        self.stream_chunk_chars = stream_chunk_chars
+        self.first_chunk_share = first_chunk_share
+        self.drop_rate = drop_rate
+        self.batch_latency_factor = batch_latency_factor
+        self.error_rate = error_rate
+        self.responses = responses
+        self.reports_per_mail = reports_per_mail
+        self.skip_rate = skip_rate
+        self.seed = seed
+        self.call_count = 0
+        self.cancelled_count = 0    # 途中で打ち切られたストリーミング生成の数
+        self._attempts = Counter()
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        latency, output = self._respond(prompt)
+        time.sleep(latency)
+        return output
+
+    def generate_stream(self, prompt):
+        latency, output = self._respond(prompt)
+        time.sleep(latency * self.first_chunk_share)
+        per_char = latency * (1 - self.first_chunk_share) / max(len(output), 1)
+        finished = False
+        try:
+            for start in range(0, len(output), self.stream_chunk_chars):
+                chunk = output[start:start + self.stream_chunk_chars]
+                time.sleep(per_char * len(chunk))
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                with self._lock:
+                    self.cancelled_count += 1
+
+    def _respond(self, prompt):
+        """(遅延, 出力テキスト) を返す（一時的なエラーは遅延の後に送出する）"""
+        key = zlib.crc32(prompt.encode('utf-8'))
+        with self._lock:
+            self.call_count += 1
+            self._attempts[key] += 1
+            attempt = self._attempts[key]
+        sections = BATCH_SECTION.split(prompt)
+        mails = list(zip(sections[1::2], sections[2::2]))
+        latency = self.latency * (1 + self.batch_latency_factor * max(len(mails) - 1, 0))
+        if _should_fail(self.seed, key, attempt, self.error_rate):
+            time.sleep(latency)
+            raise FakeApiError(503, 'Service Unavailable')
+        return latency, self._output(prompt, key, mails)
+
+    def _output(self, prompt, key, mails):
+        if mails:
+            return json.dumps({
+                mail_id: self._report(section, zlib.crc32(section.encode('utf-8')))
+                for mail_id, section in mails
+                if not _should_fail(self.seed, mail_id, 'drop', self.drop_rate)
+            }, ensure_ascii=False)
+        if self.responses:
+            response = self.responses[key % len(self.responses)]
+            return response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+        return json.dumps(self._report(prompt, key), ensure_ascii=False)
+
+    def _report(self, prompt, key):
+        if _should_fail(self.seed, key, 'skip', self.skip_rate):
+            # 実際のモデルと同様に、週報でない場合も判定の後に残りの項目を出力する
+            return {"週報判定": False, "報告者": None, "報告日": None, "報告内容": []}
+        sender = re.search(r'^メール送信者: (.*)$', prompt, re.MULTILINE)
+        sent = re.search(r'^メール送信日: (.*)$', prompt, re.MULTILINE)
+        reporter = sender.group(1).split('<')[0].strip() if sender else None
+        try:
+            report_date = parsedate_to_datetime(sent.group(1)).strftime('%Y-%m-%d')
+        except (AttributeError, TypeError, ValueError):
+            report_date = None
+        clients = ["ホンダ", "トヨタ", "日立", "ソニー", "三菱電機"]
+        products = ["TF-4060", "TF-2020", "HapLog", "IMS-SD", "TF-3040"]
+        return {
+            "週報判定": True,
+            "報告者": reporter,
+            "報告日": report_date,
+            "報告内容": [
+                {
+                    "客先名": clients[(key + i) % len(clients)],
+                    "客先部署名": "開発部",
+                    "客先担当者名": "田中",
+                    "同行社員名": "藤原",
+                    "製品名": products[(key + i) % len(products)],
+                    "案件内容": f"{products[(key + i) % len(products)]}のデモを実施"
+                }
+                for i in range(self.reports_per_mail)
+            ]
+        }
@@ -0,0 +1,253 @@
+"""
+Gmailからの週報メール取得
+
+メッセージ本文の取得は解析とは別のパイプライン段として、バックグラウンドのスレッドで先読みする。
+Gmailのバッチリクエストで複数メッセージを1往復で取得し、先読み量には上限を設ける（バックプレッシャー）。
+"""
+
+import base64
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 1回のバッチリクエストで取得するメッセージ数（Gmail APIの推奨は50以下）
+FETCH_BATCH_SIZE = 20
+
+# 取得スレッド数
+FETCH_WORKERS = 2
+
+# 解析待ちで先読みしておくバッチ数の上限
+FETCH_PREFETCH_BATCHES = 4
+
+
+class HistoryExpired(Exception):
+    """保存していたhistoryIdが古すぎて履歴を取得できない（全件一覧が必要）"""
+
+
+def http_status(error):
+    """googleapiclient の HttpError 等からHTTPステータスを取得"""
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None) or getattr(error, 'status', None)
+
+
+def get_label_id(service, name):
+    """ラベル名からラベルIDを取得（なければ None）"""
+    labels = service.users().labels().list(userId='me').execute().get('labels', [])
+    return next((l['id'] for l in labels if l['name'] == name), None)
+
+
+def get_label_total(service, label_id):
+    """ラベルの付いたメールの総数を取得"""
+    return service.users().labels().get(userId='me', id=label_id).execute().get('messagesTotal', 0)
+
+
+def get_current_history_id(service):
+    """メールボックスの現在のhistoryIdを取得"""
+    return service.users().getProfile(userId='me').execute()['historyId']
+
+
+def sort_newest_first(message_ids):
+    """メッセージIDを最新順に並べる"""
+    return sorted(message_ids, key=lambda x: int(x, 16), reverse=True)
+
+
+def list_label_message_ids(service, label_id):
+    """ラベルの付いた全メールのIDを一覧（最新順）"""
+    message_ids = []
+    page_token = None
+    while True:
+        results = service.users().messages().list(
+            userId='me',
+            labelIds=[label_id],
+            pageToken=page_token
+        ).execute()
+        message_ids.extend(msg['id'] for msg in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return sort_newest_first(message_ids)
+
+
+def list_added_message_ids(service, label_id, start_history_id):
+    """
+    start_history_id 以降にラベルへ追加されたメールのIDを一覧（最新順）
+
+    新着メール（messageAdded）と、既存メールへのラベル付与（labelAdded）の両方を対象にする。
+    履歴が期限切れの場合は HistoryExpired を送出する。
+    """
+    message_ids = set()
+    page_token = None
+    while True:
+        try:
+            results = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                labelId=label_id,
+                historyTypes=['messageAdded', 'labelAdded'],
+                pageToken=page_token
+            ).execute()
+        except Exception as e:
+            if http_status(e) == 404:
+                raise HistoryExpired(str(e))
+            raise
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []) + record.get('labelsAdded', []):
+                message = added['message']
+                if label_id in message.get('labelIds', []):
+                    message_ids.add(message['id'])
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return sort_newest_first(message_ids)
+
+
+def get_header(headers, name):
+    """ヘッダーの値を取得（なければ空文字）"""
+    return next((h['value'] for h in headers if h['name'] == name), "")
+
+
+def get_body_recursive(part):
+    """再帰的にtext/plainの本文を探す"""
+    # mimeTypeがtext/plainで、dataがある場合
+    if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
+        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+
+    # partsがある場合、再帰的に探す
+    if 'parts' in part:
+        for subpart in part['parts']:
+            result = get_body_recursive(subpart)
+            if result:
+                return result
+    return None
+
+
+def find_body_data(part):
+    """本文（text/plain）の base64 データを parse_message と同じ順で探す（デコードしない）"""
+    if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+        return part['body']['data']
+    for subpart in part.get('parts', []):
+        data = find_body_data(subpart)
+        if data:
+            return data
+    return None
+
+
+def body_size(msg_data):
+    """本文のおおよそのバイト数（base64 の長さから求める。本文をデコードしないため不正な文字でも失敗しない）"""
+    payload = msg_data.get('payload', {})
+    data = find_body_data(payload) or payload.get('body', {}).get('data', '')
+    return len(data.rstrip('=')) * 3 // 4
+
+
+def parse_message(msg_data):
+    """messages().get(format='full') の結果から件名・送信者・日付・本文を取り出す"""
+    payload = msg_data['payload']
+    headers = payload['headers']
+
+    # 本文取得（ネストされたpartsに対応）
+    body = get_body_recursive(payload)
+    if not body and 'data' in payload.get('body', {}):
+        # フォールバック: トップレベルのbodyから取得
+        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+
+    return {
+        'id': msg_data['id'],
+        'subject': get_header(headers, 'Subject'),
+        'sender': get_header(headers, 'From'),
+        'date': get_header(headers, 'Date'),
+        'body': body or ""
+    }
+
+
+class MessagePrefetcher:
+    """
+    メッセージ本文をバックグラウンドで先読みするイテレータ
+
+    message_ids の順に (メッセージID, messages().get の結果) を返す。
+    取得に失敗したメッセージは結果の代わりに例外オブジェクトを返す。
+    service_factory はスレッドごとに呼ばれる（googleapiclientのサービスはスレッドセーフでないため）。
+    on_fetched を指定すると、取得できたメッセージのリストを取得スレッドで渡す（アーカイブへの保存等）。
+    metrics（stage_metrics.StageMetrics）を指定すると、バッチごとの取得時間を 'fetch' として記録する。
+    """
+
+    def __init__(self, service_factory, message_ids, batch_size=FETCH_BATCH_SIZE,
+                 workers=FETCH_WORKERS, prefetch_batches=FETCH_PREFETCH_BATCHES, on_fetched=None, metrics=None):
+        self.service_factory = service_factory
+        self.metrics = metrics
+        self.on_fetched = on_fetched
+        self.on_fetched_errors = 0
+        self.message_ids = list(message_ids)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch_batches = max(prefetch_batches, 1)
+        self._local = threading.local()
+
+    def _service(self):
+        if not hasattr(self._local, 'service'):
+            self._local.service = self.service_factory()
+        return self._local.service
+
+    def _get_request(self, service, msg_id):
+        return service.users().messages().get(userId='me', id=msg_id, format='full')
+
+    def _fetch_batch(self, msg_ids):
+        """バッチリクエストでまとめて取得（失敗分は個別に再取得）"""
+        start = time.perf_counter()
+        service = self._service()
+        results = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+
+        try:
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in msg_ids:
+                batch.add(self._get_request(service, msg_id), request_id=msg_id)
+            batch.execute()
+        except Exception:
+            # バッチ全体が失敗した場合は個別取得にフォールバック
+            pass
+
+        for msg_id in msg_ids:
+            if msg_id in results:
+                continue
+            try:
+                results[msg_id] = self._get_request(service, msg_id).execute()
+            except Exception as e:
+                results[msg_id] = e
+        if self.metrics:
+            self.metrics.record('fetch', time.perf_counter() - start)
+
+        if self.on_fetched:
+            try:
+                self.on_fetched([r for r in results.values() if not isinstance(r, Exception)])
+            except Exception:
+                # 保存に失敗しても取得結果は解析に回す
+                self.on_fetched_errors += 1
+        return results
+
+    def __iter__(self):
+        batches = iter([
+            self.message_ids[i:i + self.batch_size]
+            for i in range(0, len(self.message_ids), self.batch_size)
+        ])
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        pending = deque()
+        try:
+            # 先読みは prefetch_batches 個まで。1バッチ消費するごとに次を投入する
+            for msg_ids in batches:
+                pending.append((msg_ids, executor.submit(self._fetch_batch, msg_ids)))
+                if len(pending) >= self.prefetch_batches:
+                    break
+            while pending:
+                msg_ids, future = pending.popleft()
+                results = future.result()
+                next_ids = next(batches, None)
+                if next_ids:
+                    pending.append((next_ids, executor.submit(self._fetch_batch, next_ids)))
+                for msg_id in msg_ids:
+                    yield msg_id, results[msg_id]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
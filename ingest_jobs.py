@@ -0,0 +1,259 @@
+"""
+週報処理ジョブの管理（gunicornの全ワーカーとコマンドラインの実行で共有）
+
+ジョブの状態は DB の ingest_jobs テーブルに保存し、どのワーカーからでもジョブIDで参照・キャンセルできる。
+- 実行中（running）のジョブは部分ユニークインデックスで常に1件まで（同時に2つの処理がDBに書き込まない）
+- 実行中のジョブはハートビートを一定間隔で更新する。プロセスの異常終了等で更新が途絶えたジョブは
+  次のジョブの開始時に failed にしてロックを解放する
+- 進捗が JOB_STALL_SECONDS 秒変わらないジョブ（認証待ちや応答のない呼び出しで止まったもの）は、
+  ハートビートを止めて failed にし、中断を要求する（スレッドが止まったままでもロックを解放する）
+- キャンセルは cancel_requested を立てるだけで、実行側がハートビートの際に気付いて中断する
+- 進捗（処理済み件数・対象件数）もハートビートの際に記録する
+- 終了してから JOB_RETENTION_DAYS 日を過ぎたジョブはログファイルと一緒に削除する
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import report_db
+
+# ハートビート（兼キャンセル要求の確認）の間隔（秒）
+JOB_HEARTBEAT_SECONDS = 2
+
+# ハートビートがこの秒数途絶えたジョブは停止したとみなす
+JOB_STALE_SECONDS = 60
+
+# 進捗（処理済み件数・対象件数）がこの秒数変わらないジョブは止まっているとみなす
+JOB_STALL_SECONDS = 600
+
+# 終了したジョブ（とそのログファイル）を残す日数
+JOB_RETENTION_DAYS = 14
+
+JOB_COLUMNS = ('job_id', 'command', 'status', 'cancel_requested', 'owner', 'log_file',
+               'new_reports', 'total_reports', 'progress_done', 'progress_total', 'error',
+               'created_at', 'heartbeat_at', 'finished_at')
+
+
+class JobConflict(Exception):
+    """他のジョブが実行中"""
+
+    def __init__(self, job_id):
+        super().__init__(f'週報処理（ジョブ {job_id}）が実行中です')
+        self.job_id = job_id
+
+
+def job_owner():
+    """ジョブを実行するプロセス（ホスト名:PID）"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _job_dict(row):
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def get_job(conn, job_id):
+    """ジョブの状態を取得（なければ None）"""
+    row = conn.execute(
+        f'SELECT {", ".join(JOB_COLUMNS)} FROM ingest_jobs WHERE job_id = ?', (job_id,)
+    ).fetchone()
+    return _job_dict(row)
+
+
+def recent_jobs(conn, limit=20):
+    """新しい順のジョブ一覧"""
+    rows = conn.execute(
+        f'SELECT {", ".join(JOB_COLUMNS)} FROM ingest_jobs ORDER BY created_at DESC LIMIT ?', (limit,)
+    ).fetchall()
+    return [_job_dict(row) for row in rows]
+
+
+def expire_stale_jobs(conn):
+    """ハートビートが途絶えた実行中のジョブを failed にする（コミットは呼び出し側で行う）"""
+    conn.execute('''
+        UPDATE ingest_jobs
+        SET status = 'failed', error = 'ジョブを実行していたプロセスが停止しました', finished_at = datetime('now')
+        WHERE status = 'running' AND heartbeat_at < datetime('now', ?)
+    ''', (f'-{JOB_STALE_SECONDS} seconds',))
+
+
+def start_job(conn, command, log_file=None):
+    """
+    ジョブを実行中として登録し、ジョブIDを返す
+
+    他のジョブが実行中なら JobConflict を送出する。
+    """
+    job_id = uuid.uuid4().hex
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        expire_stale_jobs(conn)
+        conn.execute('''
+            INSERT INTO ingest_jobs (job_id, command, status, owner, log_file)
+            VALUES (?, ?, 'running', ?, ?)
+        ''', (job_id, command, job_owner(), log_file))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        running = conn.execute("SELECT job_id FROM ingest_jobs WHERE status = 'running'").fetchone()
+        conn.rollback()
+        raise JobConflict(running[0] if running else '?')
+    except Exception:
+        conn.rollback()
+        raise
+    return job_id
+
+
+def heartbeat(conn, job_id, progress=None):
+    """
+    ハートビートと進捗を更新し、キャンセルが要求されていれば True を返す
+
+    progress は {'done': 処理済み件数, 'total': 対象件数}（空なら進捗は更新しない）。
+    """
+    if progress:
+        conn.execute('''
+            UPDATE ingest_jobs SET heartbeat_at = datetime('now'), progress_done = ?, progress_total = ?
+            WHERE job_id = ? AND status = 'running'
+        ''', (progress.get('done', 0), progress.get('total', 0), job_id))
+    else:
+        conn.execute(
+            "UPDATE ingest_jobs SET heartbeat_at = datetime('now') WHERE job_id = ? AND status = 'running'", (job_id,)
+        )
+    conn.commit()
+    row = conn.execute('SELECT cancel_requested FROM ingest_jobs WHERE job_id = ?', (job_id,)).fetchone()
+    return bool(row and row[0])
+
+
+def finish_job(conn, job_id, status, new_reports=0, total_reports=0, error=None, progress=None):
+    """
+    ジョブの終了を記録する（succeeded / failed / cancelled。progress は最終的な進捗）
+
+    既に終了したジョブ（停止したとみなして failed にしたものを含む）の状態は変えない。
+    """
+    progress = progress or {}
+    conn.execute('''
+        UPDATE ingest_jobs
+        SET status = ?, new_reports = ?, total_reports = ?, error = ?, finished_at = datetime('now'),
+            progress_done = COALESCE(?, progress_done), progress_total = COALESCE(?, progress_total)
+        WHERE job_id = ? AND status = 'running'
+    ''', (status, new_reports, total_reports, error, progress.get('done'), progress.get('total'), job_id))
+    conn.commit()
+
+
+def request_cancel(conn, job_id):
+    """実行中のジョブにキャンセルを要求する（実行中でなければ False）"""
+    cursor = conn.execute(
+        "UPDATE ingest_jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'", (job_id,)
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def cleanup_jobs(conn, retention_days=JOB_RETENTION_DAYS):
+    """終了してから retention_days 日を過ぎたジョブとそのログファイルを削除し、削除したジョブ数を返す"""
+    threshold = f'-{retention_days} days'
+    old_jobs = conn.execute('''
+        SELECT job_id, log_file FROM ingest_jobs
+        WHERE status != 'running' AND finished_at < datetime('now', ?)
+    ''', (threshold,)).fetchall()
+    for _, log_file in old_jobs:
+        if log_file:
+            try:
+                os.remove(log_file)
+            except OSError:
+                pass
+    conn.executemany('DELETE FROM ingest_jobs WHERE job_id = ?', [(job_id,) for job_id, _ in old_jobs])
+    conn.commit()
+    return len(old_jobs)
+
+
+class JobMonitor(threading.Thread):
+    """
+    実行中のジョブのハートビートを更新し、キャンセルが要求されたら cancel_event をセットするスレッド
+
+    progress（実行側が更新する辞書）を指定すると、その内容を進捗として記録する。
+    進捗が JOB_STALL_SECONDS 秒変わらなければ、ジョブを failed にして cancel_event をセットし、終了する
+    （stalled が True になる）。
+    """
+
+    def __init__(self, db_file, job_id, cancel_event, progress=None):
+        super().__init__(name=f'job-monitor-{job_id}', daemon=True)
+        self.db_file = db_file
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.progress = progress
+        self.stalled = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        conn = report_db.connect(self.db_file)
+        last_progress = None
+        last_change = time.monotonic()
+        try:
+            while not self._stopped.wait(JOB_HEARTBEAT_SECONDS):
+                progress = dict(self.progress or {})
+                if progress != last_progress:
+                    last_progress = progress
+                    last_change = time.monotonic()
+                elif time.monotonic() - last_change >= JOB_STALL_SECONDS:
+                    self._give_up(conn, progress)
+                    return
+                try:
+                    if heartbeat(conn, self.job_id, progress):
+                        self.cancel_event.set()
+                except sqlite3.OperationalError:
+                    # 書き込みが混み合っている場合は次の間隔で再試行する
+                    conn.rollback()
+        finally:
+            conn.close()
+
+    def _give_up(self, conn, progress):
+        """止まったジョブのロックを解放し、実行側に中断を要求する（処理が再開しても次の確認で中断する）"""
+        self.stalled = True
+        self.cancel_event.set()
+        try:
+            finish_job(conn, self.job_id, 'failed', error=f'{JOB_STALL_SECONDS}秒間進捗がないため停止しました',
+                       progress=progress)
+        except sqlite3.OperationalError:
+            # 記録できなくても、ハートビートが途絶えるため次のジョブの開始時に failed になる
+            conn.rollback()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def run_job(db_file, job_id, run, cancel_event, progress=None):
+    """
+    登録済みのジョブを現在のスレッドで実行し、終了状態を記録する
+
+    run() は引数なしで呼ばれ、結果の概要（WeeklyReportProcessor.run() の戻り値）を返す。
+    キャンセルが要求されると cancel_event がセットされる（run() 側で確認して中断する）。
+    progress は run() 側が更新する進捗の辞書（WeeklyReportProcessor.progress）。
+    進捗が止まったままのジョブは run() の終了を待たずに failed として記録される（JobMonitor）。
+    run() の例外は failed として記録してから送出し直す。
+    """
+    monitor = JobMonitor(db_file, job_id, cancel_event, progress)
+    monitor.start()
+    summary = {}
+    status = 'failed'
+    error = None
+    try:
+        summary = run() or {}
+        status = 'cancelled' if summary.get('interrupted') else 'succeeded'
+        return summary
+    except BaseException as e:
+        error = str(e) or type(e).__name__
+        raise
+    finally:
+        monitor.stop()
+        conn = report_db.connect(db_file)
+        try:
+            finish_job(conn, job_id, status,
+                       new_reports=summary.get('registered', 0),
+                       total_reports=summary.get('total', summary.get('done', 0)),
+                       error=error,
+                       progress=dict(progress or {}))
+        finally:
+            conn.close()
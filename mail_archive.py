@@ -0,0 +1,127 @@
+"""
+取得したメール（Gmail APIの messages().get の結果）のローカルアーカイブ
+
+メールIDごとにzlib圧縮して別ファイルのSQLiteに保存する。内容はハッシュで参照するため、
+変わっていないメールを再取得しても二重には保存されない（ハッシュはメールIDを含む取得結果全体から求めるため、
+別のメールの同じ本文はまとめない）。
+本文の取得時に書き込み、再処理や再解析（replay）ではGmailにアクセスせずにアーカイブから読み出す。
+"""
+
+import hashlib
+import json
+import threading
+import zlib
+
+import report_db
+
+# zlibの圧縮レベル（取得スレッドで圧縮するため速度とのバランスを取る）
+COMPRESS_LEVEL = 6
+
+
+class NotArchived(Exception):
+    """アーカイブにないメール（オフライン実行時）"""
+
+
+class MailArchive:
+    """
+    スレッドセーフなメールアーカイブ（SQLite）
+
+    mail_blobs に内容（圧縮済みJSON）をハッシュで、archived_mails にメールIDとハッシュの対応を保存する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = report_db.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS mail_blobs (
+                hash TEXT PRIMARY KEY,
+                raw_size INTEGER NOT NULL,
+                data BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS archived_mails (
+                mail_id TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                archived_at TEXT NOT NULL DEFAULT (datetime('now'))
+            ) WITHOUT ROWID
+        ''')
+        self._conn.commit()
+
+    def put_many(self, messages):
+        """messages().get の結果のリストを保存（取得スレッドから呼ばれる）"""
+        blobs = []
+        mails = []
+        for msg_data in messages:
+            raw = json.dumps(msg_data, ensure_ascii=False, sort_keys=True).encode('utf-8')
+            digest = hashlib.sha256(raw).hexdigest()
+            blobs.append((digest, len(raw), zlib.compress(raw, COMPRESS_LEVEL)))
+            mails.append((msg_data['id'], digest))
+        if not mails:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO mail_blobs (hash, raw_size, data) VALUES (?, ?, ?)', blobs
+                )
+                self._conn.executemany('''
+                    INSERT INTO archived_mails (mail_id, hash) VALUES (?, ?)
+                    ON CONFLICT(mail_id) DO UPDATE SET hash = excluded.hash, archived_at = datetime('now')
+                ''', mails)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def get(self, mail_id):
+        """保存されたメールを取得（なければ NotArchived）"""
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT b.data FROM archived_mails m JOIN mail_blobs b ON b.hash = m.hash
+                WHERE m.mail_id = ?
+            ''', (mail_id,)).fetchone()
+        if row is None:
+            raise NotArchived(mail_id)
+        return json.loads(zlib.decompress(row[0]))
+
+    def mail_ids(self):
+        """保存済みのメールIDの集合"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT mail_id FROM archived_mails')}
+
+    def messages(self, message_ids, fetch=None):
+        """
+        message_ids の順に (メールID, messages().get の結果) を返す
+
+        アーカイブにないメールは fetch（未保存のIDのリストを受け取り (ID, 結果) を順に返す関数。
+        MessagePrefetcher 等）で取得する。fetch が None の場合は結果の代わりに NotArchived を返す。
+        """
+        archived = self.mail_ids()
+        missing = [msg_id for msg_id in message_ids if msg_id not in archived]
+        fetched = iter(fetch(missing)) if fetch and missing else iter(())
+        for msg_id in message_ids:
+            if msg_id in archived:
+                try:
+                    yield msg_id, self.get(msg_id)
+                except Exception as e:
+                    yield msg_id, e
+            elif fetch:
+                fetched_id, msg_data = next(fetched)
+                yield fetched_id, msg_data
+            else:
+                yield msg_id, NotArchived(msg_id)
+
+    def stats(self):
+        """保存件数とサイズを取得"""
+        with self._lock:
+            mails = self._conn.execute('SELECT COUNT(*) FROM archived_mails').fetchone()[0]
+            blobs, raw_bytes, stored_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(length(data)), 0) FROM mail_blobs'
+            ).fetchone()
+        return {'mails': mails, 'blobs': blobs, 'raw_bytes': raw_bytes, 'stored_bytes': stored_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
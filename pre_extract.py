@@ -0,0 +1,187 @@
+"""
+AI解析前のルールベースの事前抽出と事前判定
+
+- 報告者（From ヘッダー）・報告日（Date ヘッダー）をヘッダーから決定する
+- 製品名・社員名を Aho-Corasick 法で本文から一括検出する（「2020」→「TF-2020」の数字のみの表記にも対応）
+- 自動応答・配信エラー・本文のないメールなど、明らかに週報でないメールはモデルを呼ばずにスキップする
+
+検出結果はプロンプトのヒントとして使い、リスト全体の代わりにそのメールに関係する項目だけを渡す。
+"""
+
+import re
+import unicodedata
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# 明らかに週報ではないメールの件名（自動応答・配信エラー）
+NON_REPORT_SUBJECT = re.compile(
+    r'自動応答|自動返信|不在通知|配信不能|配信エラー|'
+    r'out of office|automatic reply|auto.?reply|undeliver|delivery status|mail delivery',
+    re.IGNORECASE
+)
+
+# 週報らしさを示す語（本文がほとんどないメールでも、これらを含めばモデルで判定する）
+REPORT_KEYWORDS = ('週報', '報告', '訪問', '打合せ', '打ち合わせ', 'デモ', '商談', '見積', '納品', '来社', '客先', '様')
+
+# 本文がこれより短く、週報らしい語・製品名・社員名のどれも含まないメールはスキップする
+MIN_REPORT_BODY_CHARS = 20
+
+# 「TF-2020」のような製品名から数字部分を取り出す（4桁以上のみ。「DMA-03」等の短い番号は誤検出が多いため除く）
+PRODUCT_NUMBER = re.compile(r'^([A-Z]+)-(\d{4,})$')
+
+# 数字のみの製品表記の優先プレフィックス（「4060」は TFG-4060 ではなく TF-4060 とみなす）
+PREFERRED_PREFIX = 'TF'
+
+# 本文中の数字のみの表記（前後が英数字・記号でなく、年月日・金額でないもの）
+STANDALONE_NUMBER = re.compile(r'(?<![0-9A-Za-z.\-/])(\d{4,})(?![0-9A-Za-z.\-/年月日円%])')
+
+
+def normalize(text):
+    """照合用の正規化（全角英数字を半角に、英字を大文字に）"""
+    return unicodedata.normalize('NFKC', text or '').upper()
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick 法による複数キーワードの一括検出
+
+    keywords は {照合する表記: 正式名} の辞書。照合は normalize() した文字列で行う。
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, canonical in keywords.items():
+            self._add(normalize(pattern), canonical)
+        self._build()
+
+    def _add(self, pattern, canonical):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append((len(pattern), canonical))
+
+    def _build(self):
+        # 幅優先で失敗遷移を作り、失敗先の出力を引き継ぐ（ルート直下の状態の失敗先はルート）
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def finditer(self, text):
+        """(開始位置, 終了位置, 正式名) を出現順に返す"""
+        state = 0
+        for end, char in enumerate(normalize(text), 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, canonical in self._output[state]:
+                yield end - length, end, canonical
+
+    def find(self, text):
+        """
+        検出した正式名を最初の出現順に返す
+
+        長い名前の一部としてだけ出現する名前（「TF-4060-G」中の「TF-4060」等）は除く。
+        """
+        matches = sorted(self.finditer(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        found = []
+        covered_until = 0
+        for start, end, canonical in matches:
+            if end <= covered_until:
+                continue
+            covered_until = max(covered_until, end)
+            if canonical not in found:
+                found.append(canonical)
+        return found
+
+
+class PreExtractor:
+    """報告者・社員・製品のリストから作る事前抽出器"""
+
+    def __init__(self, reporter_list, employee_list, product_list):
+        self.reporter_list = list(reporter_list)
+        self.reporter_matcher = KeywordMatcher({name: name for name in reporter_list})
+        self.employee_matcher = KeywordMatcher({name: name for name in employee_list})
+
+        # 製品名はハイフンなしの表記（「TF4060」）でも検出する
+        products = {}
+        for name in product_list:
+            products[name] = name
+            products.setdefault(name.replace('-', ''), name)
+        self.product_matcher = KeywordMatcher(products)
+
+        # 数字のみの表記 → 製品名（優先プレフィックスのものを優先）
+        self.product_numbers = {}
+        for name in product_list:
+            match = PRODUCT_NUMBER.match(name)
+            if not match:
+                continue
+            prefix, number = match.groups()
+            if number not in self.product_numbers or prefix == PREFERRED_PREFIX:
+                self.product_numbers[number] = name
+
+    def extract(self, subject, body, sender, date):
+        """
+        ヘッダーと本文からヒントを抽出する
+
+        {'reporter': 報告者 or None, 'report_date': 'YYYY-MM-DD' or None,
+         'products': [製品名], 'product_numbers': {数字: 製品名}, 'employees': [社員名]} を返す。
+        """
+        text = f'{subject}\n{body}'
+
+        # 報告者は送信者の表示名から判定（「西田 太郎 <...>」）
+        display_name = (sender or '').split('<')[0]
+        reporters = self.reporter_matcher.find(display_name)
+
+        try:
+            report_date = parsedate_to_datetime(date).strftime('%Y-%m-%d')
+        except (TypeError, ValueError):
+            report_date = None
+
+        products = self.product_matcher.find(text)
+        product_numbers = {}
+        for number in STANDALONE_NUMBER.findall(normalize(text)):
+            name = self.product_numbers.get(number)
+            if name:
+                product_numbers[number] = name
+                if name not in products:
+                    products.append(name)
+
+        return {
+            'reporter': reporters[0] if len(reporters) == 1 else None,
+            'report_date': report_date,
+            'products': products,
+            'product_numbers': product_numbers,
+            'employees': self.employee_matcher.find(body),
+        }
+
+    def skip_reason(self, subject, body, hints):
+        """
+        明らかに週報でないメールならその理由を、そうでなければ None を返す
+
+        スキップしたメールは処理済み（skipped）になり再解析されないため、週報ではないと言い切れる場合に限る。
+        リストにない表現・新しい社員名で書かれた週報を落とさないよう、本文のあるメールは語の有無では判定しない。
+        """
+        if NON_REPORT_SUBJECT.search(subject or ''):
+            return '自動応答・配信エラーのメール'
+        text = f'{subject}\n{body}'
+        if (len((body or '').strip()) < MIN_REPORT_BODY_CHARS
+                and not any(word in text for word in REPORT_KEYWORDS)
+                and not hints['products'] and not hints['employees']):
+            return '本文がほとんどない'
+        return None
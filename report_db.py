@@ -0,0 +1,807 @@
+"""
+週報データベースの共有スキーマ定義とマイグレーション
+
+app.py、weekly_report_processor.py、auto_deploy.py から利用する。
+スキーマのバージョンは PRAGMA user_version で管理する。
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+
+# 接続ごとに設定するPRAGMA
+# WALモードにより、処理スクリプトや編集APIの書き込み中も読み取りがブロックされない
+BUSY_TIMEOUT_MS = 5000               # ロック待ちの最大時間
+CACHE_SIZE_KB = 20000                # ページキャッシュ（約20MB）
+MMAP_SIZE = 256 * 1024 * 1024        # メモリマップI/O（256MB）
+
+# weekly_reports 本体
+REPORTS_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS weekly_reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mail_id TEXT,
+    report_date TEXT,
+    reporter TEXT,
+    client_name TEXT,
+    client_department TEXT,
+    client_person TEXT,
+    employee_name TEXT,
+    product_name TEXT,
+    content TEXT
+)
+'''
+
+# 客先名・製品名の区切り文字（カンマと日本語読点）
+NAME_SEPARATOR = re.compile(r'[,、]')
+
+# 客先・製品のファセット（1案件に複数の客先・製品が紐づく）
+FACET_TABLES = {
+    'report_clients': 'client_name',
+    'report_products': 'product_name',
+}
+
+# メールごとの集計（一覧表示用）
+MAIL_SUMMARY_SELECT = '''
+    SELECT mail_id,
+           MIN(report_date),
+           MIN(reporter),
+           COUNT(*),
+           GROUP_CONCAT(DISTINCT client_name),
+           GROUP_CONCAT(DISTINCT product_name),
+           GROUP_CONCAT(content, ' | ')
+    FROM weekly_reports
+'''
+
+# processed_ids.json の取り込み済みを記録する sync_state のキー
+PROCESSED_IMPORT_KEY = 'processed_ids_imported'
+
+# 全文検索インデックス（trigramトークナイザで日本語の部分一致に対応）
+FTS_TABLE = 'weekly_reports_fts'
+FTS_COLUMNS = ('content', 'client_name', 'client_person', 'product_name')
+
+# trigramは3文字単位で索引するため、これより短い語はLIKE検索にフォールバックする
+FTS_MIN_TERM_LENGTH = 3
+
+
+def connect(path, check_same_thread=True):
+    """PRAGMAを設定済みのデータベース接続を作成"""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+class PooledConnection:
+    """
+    プールから貸し出した接続のラッパー
+
+    close() で実際には閉じずにプールへ返却する。それ以外の属性は元の接続に委譲する。
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """
+    スレッドセーフなSQLite接続プール
+
+    アイドル接続を最大 size 個まで保持し、貸し出し時に死活確認を行う。
+    プールが空の場合は新しい接続を作成するため、呼び出し側が待たされることはない。
+    """
+
+    def __init__(self, path, size=4, row_factory=None):
+        self.path = path
+        self.size = size
+        self.row_factory = row_factory
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = connect(self.path, check_same_thread=False)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        return conn
+
+    def acquire(self):
+        """接続を貸し出す"""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return PooledConnection(self, self._open())
+            try:
+                conn.execute('SELECT 1')  # 死活確認
+                return PooledConnection(self, conn)
+            except sqlite3.Error:
+                conn.close()
+
+    def release(self, conn):
+        """接続を返却する（未確定のトランザクションはロールバック）"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """アイドル接続をすべて閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def table_exists(conn, name):
+    """テーブルが存在するか確認"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def split_names(value):
+    """カンマ・読点区切りの名前を個別の名前のリストに分割"""
+    if not value:
+        return []
+    names = []
+    for name in NAME_SEPARATOR.split(value):
+        name = name.strip()  # 前後の空白を削除
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def ensure_facet_tables(conn):
+    """
+    客先・製品のファセットテーブルを作成する。
+
+    新規作成した場合は既存の weekly_reports からバックフィルする。
+    案件の削除時はトリガーで関連行を削除する。
+    """
+    for table, column in FACET_TABLES.items():
+        if table_exists(conn, table):
+            continue
+
+        conn.execute(f'''
+            CREATE TABLE {table} (
+                name TEXT NOT NULL,
+                report_id INTEGER NOT NULL,
+                PRIMARY KEY (name, report_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_report_id ON {table}(report_id)')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON weekly_reports BEGIN
+                DELETE FROM {table} WHERE report_id = old.id;
+            END
+        ''')
+
+        # 既存データのバックフィル
+        rows = conn.execute(
+            f"SELECT id, {column} FROM weekly_reports WHERE {column} IS NOT NULL AND {column} != ''"
+        ).fetchall()
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {table} (name, report_id) VALUES (?, ?)',
+            [(name, row[0]) for row in rows for name in split_names(row[1])]
+        )
+
+
+def sync_facets(conn, report_id, client_name, product_name):
+    """案件の客先・製品ファセットを登録し直す（追加・更新時に呼び出す）"""
+    values = {'report_clients': client_name, 'report_products': product_name}
+    for table, value in values.items():
+        conn.execute(f'DELETE FROM {table} WHERE report_id = ?', (report_id,))
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {table} (name, report_id) VALUES (?, ?)',
+            [(name, report_id) for name in split_names(value)]
+        )
+
+
+def add_facets_for_mails(conn, mail_ids):
+    """指定メールの案件（新規登録分）の客先・製品ファセットをまとめて登録する"""
+    rows = []
+    for mail_id in mail_ids:
+        rows.extend(conn.execute(
+            'SELECT id, client_name, product_name FROM weekly_reports WHERE mail_id = ?', (mail_id,)
+        ))
+    for table, index in (('report_clients', 1), ('report_products', 2)):
+        conn.executemany(
+            f'INSERT OR IGNORE INTO {table} (name, report_id) VALUES (?, ?)',
+            [(name, row[0]) for row in rows for name in split_names(row[index])]
+        )
+
+
+def facet_condition(table, name):
+    """ファセットの完全一致で絞り込むWHERE句（AND から始まる）とパラメータを返す"""
+    return f' AND id IN (SELECT report_id FROM {table} WHERE name = ?)', [name]
+
+
+def ensure_mail_summaries(conn):
+    """
+    メールごとの集計テーブルを作成する。
+
+    新規作成した場合は既存の weekly_reports から集計してバックフィルする。
+    """
+    if table_exists(conn, 'mail_summaries'):
+        return
+
+    conn.execute('''
+        CREATE TABLE mail_summaries (
+            mail_id TEXT PRIMARY KEY,
+            report_date TEXT,
+            reporter TEXT,
+            report_count INTEGER NOT NULL,
+            clients TEXT,
+            products TEXT,
+            all_content TEXT
+        )
+    ''')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_mail_summaries_date ON mail_summaries(report_date DESC, mail_id DESC)'
+    )
+    conn.execute(
+        f'INSERT INTO mail_summaries {MAIL_SUMMARY_SELECT} WHERE mail_id IS NOT NULL GROUP BY mail_id'
+    )
+
+
+def refresh_mail_summary(conn, mail_id):
+    """
+    指定メールの集計行を再計算する（案件の追加・更新・削除時に呼び出す）
+
+    案件が残っていない場合は集計行を削除する。
+    """
+    refresh_mail_summaries(conn, [mail_id])
+
+
+def refresh_mail_summaries(conn, mail_ids):
+    """複数メールの集計行をまとめて再計算する"""
+    params = [(mail_id,) for mail_id in mail_ids]
+    conn.executemany('DELETE FROM mail_summaries WHERE mail_id = ?', params)
+    conn.executemany(
+        f'INSERT INTO mail_summaries {MAIL_SUMMARY_SELECT} WHERE mail_id = ? GROUP BY mail_id',
+        params
+    )
+
+
+def _rollup_increment(row, delta):
+    """集計テーブルを増減するトリガー本体のSQL（row は new / old）"""
+    return f'''
+        INSERT INTO report_rollups (dimension, key, day, count)
+        VALUES ('reporter', IFNULL({row}.reporter, ''), IFNULL({row}.report_date, ''), {delta})
+        ON CONFLICT(dimension, key, day) DO UPDATE SET count = count + ({delta});
+        INSERT INTO report_rollups (dimension, key, day, count)
+        SELECT 'client', {row}.client_name, IFNULL({row}.report_date, ''), {delta}
+        WHERE {row}.client_name IS NOT NULL AND {row}.client_name != ''
+        ON CONFLICT(dimension, key, day) DO UPDATE SET count = count + ({delta});
+    ''' + (_rollup_delete_empty(row) if delta < 0 else '')
+
+
+def _rollup_delete_empty(row):
+    """減らした行が 0 件になっていれば削除するSQL（主キーで対象の行だけを参照する）"""
+    return f'''
+        DELETE FROM report_rollups
+        WHERE dimension = 'reporter' AND key = IFNULL({row}.reporter, '')
+          AND day = IFNULL({row}.report_date, '') AND count <= 0;
+        DELETE FROM report_rollups
+        WHERE dimension = 'client' AND key = {row}.client_name
+          AND day = IFNULL({row}.report_date, '') AND count <= 0;
+    '''
+
+
+def ensure_rollups(conn):
+    """
+    統計用の集計テーブルと同期用トリガーを作成する。
+
+    報告者別・客先別の件数を日単位で保持し、任意の期間の統計を集計テーブルだけで求める。
+    weekly_reports への書き込みと同じトランザクション内でトリガーにより更新される。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_rollups (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (dimension, key, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_report_rollups_day ON report_rollups(dimension, day)')
+    create_rollup_triggers(conn)
+    rebuild_rollups(conn)
+
+
+def create_rollup_triggers(conn):
+    """集計テーブルを同期するトリガーを作成"""
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS report_rollups_ai AFTER INSERT ON weekly_reports BEGIN
+            {_rollup_increment('new', 1)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS report_rollups_ad AFTER DELETE ON weekly_reports BEGIN
+            {_rollup_increment('old', -1)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS report_rollups_au
+        AFTER UPDATE OF reporter, client_name, report_date ON weekly_reports BEGIN
+            {_rollup_increment('old', -1)}
+            {_rollup_increment('new', 1)}
+        END
+    ''')
+
+
+def recreate_rollup_triggers(conn):
+    """
+    集計テーブルのトリガーを作り直す
+
+    旧トリガーは書き込みのたびに集計テーブル全体を走査して 0 件の行を削除していたため、
+    減らした行だけを削除するものに置き換える。
+    """
+    for name in ('report_rollups_ai', 'report_rollups_ad', 'report_rollups_au'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    create_rollup_triggers(conn)
+
+
+def rebuild_rollups(conn):
+    """集計テーブルを weekly_reports から再構築する（ずれの修復用）"""
+    conn.execute('DELETE FROM report_rollups')
+    conn.execute('''
+        INSERT INTO report_rollups (dimension, key, day, count)
+        SELECT 'reporter', IFNULL(reporter, ''), IFNULL(report_date, ''), COUNT(*)
+        FROM weekly_reports
+        GROUP BY 2, 3
+    ''')
+    conn.execute('''
+        INSERT INTO report_rollups (dimension, key, day, count)
+        SELECT 'client', client_name, IFNULL(report_date, ''), COUNT(*)
+        FROM weekly_reports
+        WHERE client_name IS NOT NULL AND client_name != ''
+        GROUP BY 2, 3
+    ''')
+
+
+BUMP_DATA_VERSION_SQL = (
+    "UPDATE data_version SET version = version + 1, "
+    "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1"
+)
+
+
+def ensure_data_version(conn):
+    """
+    データバージョン（書き込みのたびに増える単一行のカウンタ）を作成する。
+
+    weekly_reports への追加・更新・削除はトリガーで自動的にカウントされる。
+    HTTPキャッシュ（ETag/Last-Modified）の判定に使う。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute(
+        "INSERT OR IGNORE INTO data_version (id, version, updated_at) "
+        "VALUES (1, 1, CAST(strftime('%s', 'now') AS INTEGER))"
+    )
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS data_version_{event.lower()} AFTER {event} ON weekly_reports BEGIN
+                {BUMP_DATA_VERSION_SQL};
+            END
+        ''')
+
+
+def get_data_version(conn):
+    """(バージョン, 最終更新のUNIX時刻, DBのエポック) を取得"""
+    row = conn.execute('SELECT version, updated_at, epoch FROM data_version WHERE id = 1').fetchone()
+    return row[0], row[1], row[2]
+
+
+RESET_DATA_EPOCH_SQL = (
+    "UPDATE data_version SET epoch = lower(hex(randomblob(8))), "
+    "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = 1"
+)
+
+
+def add_data_epoch(conn):
+    """
+    データバージョンにDBのエポック（DBごとのランダムなID）を追加する
+
+    バージョンはDBファイルごとのカウンタのため、DBファイルを差し替えると
+    別の内容で同じバージョンになることがある。ETag 等はエポックと組み合わせて判定する。
+    """
+    conn.execute("ALTER TABLE data_version ADD COLUMN epoch TEXT NOT NULL DEFAULT ''")
+    conn.execute(RESET_DATA_EPOCH_SQL)
+
+
+def reset_data_epoch(conn):
+    """DBのエポックを新しくする（デプロイ用のコピー等、別のDBとして扱わせる場合。コミットは呼び出し側で行う）"""
+    conn.execute(RESET_DATA_EPOCH_SQL)
+
+
+def bump_data_version(conn):
+    """トリガー対象外の書き込み後にデータバージョンを進める"""
+    conn.execute(BUMP_DATA_VERSION_SQL)
+
+
+def ensure_sync_state(conn):
+    """Gmail同期の状態（historyId等）を保存するキー・値テーブルを作成"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def get_sync_state(conn, key):
+    """同期状態の値を取得（なければ None）"""
+    row = conn.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_sync_state(conn, key, value):
+    """同期状態の値を保存（コミットは呼び出し側で行う）"""
+    conn.execute(
+        'INSERT INTO sync_state (key, value) VALUES (?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+        (key, value)
+    )
+
+
+def delete_sync_state(conn, key):
+    """同期状態の値を削除（コミットは呼び出し側で行う）"""
+    conn.execute('DELETE FROM sync_state WHERE key = ?', (key,))
+
+
+# processed_mails.status の値
+# registered: 週報としてDBに登録済み / skipped: 週報ではないと判定
+# imported: 旧 processed_ids.json から移行 / failed: 取得・解析に失敗（次回再処理）
+PROCESSED_STATUSES = ('registered', 'skipped', 'imported')
+
+# 失敗したメールを sync で再試行する上限回数（連続失敗がこの回数に達したら再試行しない）
+MAX_FAILED_ATTEMPTS = 3
+
+
+def ensure_processed_mails(conn):
+    """メールごとの処理状態テーブルを作成"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS processed_mails (
+            mail_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            prompt_version TEXT,
+            last_error TEXT,
+            first_processed_at TEXT NOT NULL DEFAULT (datetime('now')),
+            processed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        ) WITHOUT ROWID
+    ''')
+
+
+def processed_mail_ids(conn):
+    """処理済み（再処理不要）のメールIDの集合を取得"""
+    placeholders = ','.join('?' * len(PROCESSED_STATUSES))
+    rows = conn.execute(
+        f'SELECT mail_id FROM processed_mails WHERE status IN ({placeholders})',
+        PROCESSED_STATUSES
+    )
+    return {row[0] for row in rows}
+
+
+def failed_mail_ids(conn, max_attempts=MAX_FAILED_ATTEMPTS):
+    """
+    失敗したメールのうち再試行するIDを古い順に取得
+
+    連続失敗が max_attempts 回に達したメールは含めない（sync --full で全件を一覧すると再び処理される）。
+    """
+    rows = conn.execute('''
+        SELECT mail_id FROM processed_mails
+        WHERE status = 'failed' AND failed_attempts < ?
+        ORDER BY processed_at, mail_id
+    ''', (max_attempts,))
+    return [row[0] for row in rows]
+
+
+# 処理日時（ミリ秒まで。再処理の開始時刻と比べて、開始と同じ秒に処理済みだったメールを取りこぼさない）
+NOW_MS_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# failed_attempts は連続して失敗した回数（失敗以外の状態になったら 0 に戻す）
+MARK_PROCESSED_SQL = f'''
+    INSERT INTO processed_mails (mail_id, status, report_count, prompt_version, last_error, failed_attempts,
+                                 processed_at)
+    VALUES (?1, ?2, ?3, ?4, ?5, CASE WHEN ?2 = 'failed' THEN 1 ELSE 0 END, {NOW_MS_SQL})
+    ON CONFLICT(mail_id) DO UPDATE SET
+        status = excluded.status,
+        report_count = excluded.report_count,
+        prompt_version = excluded.prompt_version,
+        last_error = excluded.last_error,
+        failed_attempts = CASE WHEN excluded.status = 'failed' THEN processed_mails.failed_attempts + 1 ELSE 0 END,
+        processed_at = excluded.processed_at
+'''
+
+
+def mark_processed(conn, mail_id, status, prompt_version=None, report_count=0, error=None):
+    """
+    メールの処理状態を記録する（コミットは呼び出し側で行う）
+
+    報告行の登録と同じトランザクションで呼ぶことで、登録と処理済みの記録が必ず一緒に確定する。
+    """
+    conn.execute(MARK_PROCESSED_SQL, (mail_id, status, report_count, prompt_version, error))
+
+
+def mark_processed_many(conn, rows):
+    """(メールID, 状態, 報告件数, プロンプトバージョン, エラー) の列をまとめて記録する"""
+    conn.executemany(MARK_PROCESSED_SQL, rows)
+
+
+def import_processed_ids(conn, path):
+    """
+    旧形式の processed_ids.json を processed_mails に取り込む（初回のみ）
+
+    取り込み済みかどうかは sync_state に記録する。取り込んだ件数を返す。
+    """
+    if get_sync_state(conn, PROCESSED_IMPORT_KEY) or not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        mail_ids = json.load(f)
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO processed_mails (mail_id, status, report_count)
+            VALUES (?, 'imported', (SELECT COUNT(*) FROM weekly_reports WHERE mail_id = ?))
+        ''', [(mail_id, mail_id) for mail_id in mail_ids])
+        imported = conn.total_changes - before
+        set_sync_state(conn, PROCESSED_IMPORT_KEY, path)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return imported
+
+
+def ensure_ingest_jobs(conn):
+    """
+    週報処理ジョブのテーブルを作成（操作は ingest_jobs.py）
+
+    実行中（running）のジョブは部分ユニークインデックスで常に1件までに制限する。
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            job_id TEXT PRIMARY KEY,
+            command TEXT NOT NULL,
+            status TEXT NOT NULL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            owner TEXT,
+            log_file TEXT,
+            new_reports INTEGER NOT NULL DEFAULT 0,
+            total_reports INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            heartbeat_at TEXT NOT NULL DEFAULT (datetime('now')),
+            finished_at TEXT
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_ingest_jobs_running ON ingest_jobs(status) WHERE status = 'running'"
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_created ON ingest_jobs(created_at)')
+
+
+def add_ingest_job_progress(conn):
+    """週報処理ジョブに進捗（処理済み件数・対象件数）の列を追加"""
+    conn.execute('ALTER TABLE ingest_jobs ADD COLUMN progress_done INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE ingest_jobs ADD COLUMN progress_total INTEGER NOT NULL DEFAULT 0')
+
+
+def add_failed_attempts(conn):
+    """メールごとの処理状態に連続失敗回数の列を追加（既存の失敗は1回目として数える）"""
+    conn.execute('ALTER TABLE processed_mails ADD COLUMN failed_attempts INTEGER NOT NULL DEFAULT 0')
+    conn.execute("UPDATE processed_mails SET failed_attempts = 1 WHERE status = 'failed'")
+
+
+def fts_supported(conn):
+    """SQLiteがFTS5のtrigramトークナイザを利用できるか判定"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='trigram')")
+        conn.execute('DROP TABLE temp._fts_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def ensure_search_index(conn):
+    """
+    全文検索インデックスと同期用トリガーを作成する。
+
+    既存DBでインデックスが未作成の場合は weekly_reports の内容から再構築（バックフィル）する。
+    FTS5/trigramが使えない環境では何もせず False を返す。
+    """
+    if table_exists(conn, FTS_TABLE):
+        return True
+    if not fts_supported(conn):
+        return False
+
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{col}' for col in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{col}' for col in FTS_COLUMNS)
+
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            {columns},
+            content='weekly_reports',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    ''')
+
+    # 追加・削除・更新時にインデックスを同期
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS weekly_reports_fts_ai AFTER INSERT ON weekly_reports BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS weekly_reports_fts_ad AFTER DELETE ON weekly_reports BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS weekly_reports_fts_au AFTER UPDATE ON weekly_reports BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+
+    # 既存データのバックフィル
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def search_condition(search, use_index=True):
+    """
+    検索語に対応するWHERE句（AND から始まる）とパラメータを返す。
+
+    インデックスが使える場合はFTS5のフレーズ検索、そうでなければ従来のLIKE検索を使う。
+    """
+    if use_index and len(search) >= FTS_MIN_TERM_LENGTH:
+        # ダブルクォートをエスケープしてフレーズとして検索（部分一致）
+        phrase = '"' + search.replace('"', '""') + '"'
+        return (
+            f' AND id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)',
+            [phrase]
+        )
+
+    pattern = f'%{search}%'
+    return (
+        ' AND (content LIKE ? OR client_name LIKE ? OR client_person LIKE ? OR product_name LIKE ?)',
+        [pattern, pattern, pattern, pattern]
+    )
+
+
+# --------------------
+# マイグレーション
+# --------------------
+def migrate_reports_table(conn):
+    """weekly_reports テーブルを作成（旧app.pyで作成されたDBには product_name 列を追加）"""
+    conn.execute(REPORTS_TABLE_SQL)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(weekly_reports)')]
+    if 'product_name' not in columns:
+        conn.execute('ALTER TABLE weekly_reports ADD COLUMN product_name TEXT')
+
+
+def migrate_report_indexes(conn):
+    """APIのクエリ形状に合わせたインデックスを作成"""
+    # メール詳細・メール単位の削除・メールごとの集計
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_mail_id ON weekly_reports(mail_id, id)')
+    # 日付範囲の絞り込みと日付順の一覧
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_date ON weekly_reports(report_date DESC, mail_id)')
+    # 報告者の絞り込み・報告者リスト・報告者別統計
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_reporter ON weekly_reports(reporter, report_date)')
+    # 客先別統計
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weekly_reports_client ON weekly_reports(client_name)')
+
+
+# (バージョン, 説明, 適用関数) の順に追加していく。既存の番号は変更しないこと。
+MIGRATIONS = [
+    (1, 'weekly_reports テーブル', migrate_reports_table),
+    (2, '客先・製品ファセット', ensure_facet_tables),
+    (3, '全文検索インデックス', ensure_search_index),
+    (4, '絞り込み・並び替え用インデックス', migrate_report_indexes),
+    (5, 'メールごとの集計テーブル', ensure_mail_summaries),
+    (6, '統計用の集計テーブル', ensure_rollups),
+    (7, 'データバージョン', ensure_data_version),
+    (8, 'Gmail同期の状態', ensure_sync_state),
+    (9, 'メールごとの処理状態', ensure_processed_mails),
+    (10, '週報処理ジョブ', ensure_ingest_jobs),
+    (11, '週報処理ジョブの進捗', add_ingest_job_progress),
+    (12, '統計用の集計トリガーの更新', recreate_rollup_triggers),
+    (13, 'データバージョンのエポック', add_data_epoch),
+    (14, '処理失敗の再試行回数', add_failed_attempts),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    """現在のスキーマバージョンを取得"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    未適用のマイグレーションを順に適用する。
+
+    各マイグレーションは BEGIN IMMEDIATE のトランザクション内でバージョン更新と一緒に確定するため、
+    複数のワーカーが同時に起動しても二重に適用されない。
+    全文検索インデックス（バージョン3）は FTS5/trigram が使えない環境では作られずにバージョンだけ進むため、
+    インデックスがなければ毎回作成を試みる（SQLite の更新後などに作られる）。
+    全文検索インデックスが利用可能かどうかを返す。
+    """
+    for version, description, apply in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # ロック取得までに他のプロセスが適用済みの場合はスキップ
+            if schema_version(conn) < version:
+                apply(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    if not table_exists(conn, FTS_TABLE) and fts_supported(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ensure_search_index(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return table_exists(conn, FTS_TABLE)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='週報データベースの保守コマンド')
+    parser.add_argument('command', choices=['migrate', 'rebuild-stats'],
+                        help='migrate: マイグレーションを適用 / rebuild-stats: 統計用の集計テーブルを再構築')
+    parser.add_argument('--db', default='weekly_reports.db', help='データベースファイル')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    migrate(conn)
+    if args.command == 'rebuild-stats':
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild_rollups(conn)
+        conn.commit()
+        print('統計用の集計テーブルを再構築しました')
+    print(f'スキーマバージョン: {schema_version(conn)}')
+    conn.close()
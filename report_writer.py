@@ -0,0 +1,128 @@
+"""
+解析結果のバッチ書き込み
+
+メールごとの報告行と処理状態をバッファし、複数通分をまとめて1つのトランザクションで書き込む。
+報告行の登録は executemany で行い、コミット（＝ジャーナルの同期）は1バッチにつき1回になる。
+
+書き込みの保証:
+- 1通分の報告行と processed_mails の記録は必ず同じトランザクションで確定する（一部だけ残ることはない）
+- バッファ中（未フラッシュ）のメールは異常終了時に失われるが、処理済みにもならないため次回の実行で再解析される
+- 確定済みのトランザクションはプロセスが強制終了しても失われない。
+  WAL + synchronous=NORMAL のため、OSのクラッシュや電源断では直近のコミットが巻き戻る可能性がある
+  （その場合も報告行と処理状態は一緒に巻き戻るため、二重登録にはならない）
+"""
+
+import time
+
+import report_db
+
+# 何通分たまったらフラッシュするか
+WRITE_BATCH_MAILS = 20
+
+# 何行分たまったらフラッシュするか（1通に多数の報告がある場合）
+WRITE_BATCH_ROWS = 500
+
+# 最初のメールをバッファしてから何秒経ったらフラッシュするか
+WRITE_BATCH_SECONDS = 5.0
+
+REPORT_INSERT_SQL = '''
+    INSERT INTO weekly_reports
+    (mail_id, report_date, reporter, client_name, client_department, client_person, employee_name, product_name, content)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class ReportWriter:
+    """
+    報告行と処理状態のバッチライター
+
+    add() でメール1通分を追加し、しきい値を超えたら自動でフラッシュする。
+    メールが届かない間も時間のしきい値で書き込むよう、呼び出し側は flush_if_due() を定期的に呼ぶ。
+    close()（with文の終了時を含む）で残りをフラッシュする。
+    metrics（stage_metrics.StageMetrics）を指定すると、フラッシュごとの所要時間を 'write' として記録する。
+    """
+
+    def __init__(self, conn, prompt_version=None, max_mails=WRITE_BATCH_MAILS,
+                 max_rows=WRITE_BATCH_ROWS, max_seconds=WRITE_BATCH_SECONDS, metrics=None):
+        self.conn = conn
+        self.metrics = metrics
+        self.prompt_version = prompt_version
+        self.max_mails = max(max_mails, 1)
+        self.max_rows = max(max_rows, 1)
+        self.max_seconds = max_seconds
+        self._mails = []     # (mail_id, status, report_count, error)
+        self._rows = []      # REPORT_INSERT_SQL の引数
+        self._first_added = None
+        self.flush_count = 0
+        self.flush_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def pending(self):
+        """未フラッシュのメール数"""
+        return len(self._mails)
+
+    def add(self, mail_id, rows, status, error=None):
+        """
+        メール1通分の報告行と処理状態を追加する
+
+        rows は weekly_reports の (mail_id, report_date, ..., content) のタプルのリスト。
+        フラッシュした場合は書き込んだメール数、そうでなければ 0 を返す。
+        """
+        if self._first_added is None:
+            self._first_added = time.monotonic()
+        self._mails.append((mail_id, status, len(rows), error))
+        self._rows.extend(rows)
+        if len(self._mails) >= self.max_mails or len(self._rows) >= self.max_rows:
+            return self.flush()
+        return self.flush_if_due()
+
+    def flush_if_due(self):
+        """最初のメールをバッファしてから max_seconds 秒経っていればフラッシュし、書き込んだメール数を返す"""
+        if self._first_added is not None and time.monotonic() - self._first_added >= self.max_seconds:
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """バッファ中のメールを1つのトランザクションで書き込み、書き込んだメール数を返す"""
+        if not self._mails:
+            return 0
+        start = time.monotonic()
+        conn = self.conn
+        # 失敗の記録だけのメールは既存の報告行に触れない
+        mail_ids = [mail[0] for mail in self._mails if mail[1] != 'failed']
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 以前の実行で登録された行が残っていれば置き換える（再処理時はここで新しい結果と入れ替わる）
+            conn.executemany('DELETE FROM weekly_reports WHERE mail_id = ?', [(m,) for m in mail_ids])
+            conn.executemany(REPORT_INSERT_SQL, self._rows)
+            report_db.add_facets_for_mails(conn, mail_ids)
+            report_db.refresh_mail_summaries(conn, mail_ids)
+            report_db.mark_processed_many(conn, [
+                (mail_id, status, report_count, self.prompt_version, error)
+                for mail_id, status, report_count, error in self._mails
+            ])
+            conn.commit()
+        except BaseException:
+            # 失敗時はバッファを残す（close() や次のフラッシュで再試行できる）
+            conn.rollback()
+            raise
+        flushed = len(self._mails)
+        self._mails = []
+        self._rows = []
+        self._first_added = None
+        elapsed = time.monotonic() - start
+        self.flush_count += 1
+        self.flush_seconds += elapsed
+        if self.metrics:
+            self.metrics.record('write', elapsed)
+        return flushed
+
+    def close(self):
+        """残りをフラッシュする"""
+        return self.flush()
@@ -0,0 +1,96 @@
+"""
+APIレスポンスのプロセス内キャッシュ
+
+LRU + TTL でエントリ数とメモリ使用量を制限する。
+各エントリはデータバージョン（report_db.get_data_version のエポックとバージョン）と一緒に保存し、
+取得時のバージョンと異なれば無効とみなす。データバージョンはDBに保存されているため、
+gunicornの別ワーカーや週報処理スクリプトによる書き込みでも正しく無効化される。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """スレッドセーフな LRU + TTL キャッシュ"""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (version, expires_at, body)
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """キャッシュされた内容を取得（なければ None）"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, expires_at, body = entry
+            if entry_version != version or expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, version, body):
+        """内容をキャッシュ（上限を超えた分は古いものから削除）"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if version != self._version:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, time.monotonic() + self.ttl, body)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """すべてのエントリを削除"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """ヒット・ミス数と使用量を取得"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _check_version(self, version):
+        # データが更新されたら古いバージョンのエントリをまとめて破棄
+        # （DBファイルの差し替えでバージョンが戻る場合もあるため、大小ではなく一致で判定する）
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def _remove(self, key):
+        _, _, body = self._entries.pop(key)
+        self._size -= len(body)
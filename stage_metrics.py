@@ -0,0 +1,55 @@
+"""
+パイプラインの段ごとの処理時間の計測
+
+取得・解析・DB書き込みの各段で所要時間を記録し、件数・合計・平均・p50・p95 を集計する。
+各段は別スレッドで動くため、記録はロックで保護する。
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+def percentile(sorted_values, ratio):
+    """ソート済みの値の百分位数（nearest-rank法）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(ratio * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class StageMetrics:
+    """段ごとの所要時間（秒）の記録"""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        """with ブロックの所要時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self):
+        """{段: {count, total, mean, p50, p95}} を取得"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        return {
+            stage: {
+                'count': len(values),
+                'total': sum(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+            }
+            for stage, values in samples.items()
+        }
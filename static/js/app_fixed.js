@@ -2,7 +2,17 @@
 let allReports = [];
 let selectedReports = new Map();
 let currentPage = 1;
-let totalPages = 1;
+// 1ページの件数
+const REPORTS_PER_PAGE = 10;
+// ページ送りはカーソル（前のページの next_cursor）で行う。pageCursors[n - 1] が nページ目を取得するカーソル
+// （1ページ目は null。表示したページとその次のページの分だけ持つ）
+let pageCursors = [null];
+let hasMorePages = false;
+// 総件数のキャッシュ（同じ絞り込み条件でのページ移動時は再集計しない）
+let cachedTotalCount = null;
+let cachedFilterKey = null;
+// 客先・製品の案件一覧の1ページあたりの件数
+const PROJECTS_PER_PAGE = 50;
 
 // 初期化
 document.addEventListener('DOMContentLoaded', function() {
@@ -111,10 +121,9 @@ async function loadProducts() {
     }
 }
 
-// レポート読み込み
-async function loadReports(page = 1) {
+// レポート読み込み（refreshTotal が true なら、同じ絞り込み条件でも総件数を集計し直す）
+async function loadReports(page = 1, refreshTotal = false) {
     try {
-        currentPage = page;
         const params = new URLSearchParams();
         
         const reporter = document.getElementById('reporterFilter')?.value;
@@ -135,8 +144,25 @@ async function loadReports(page = 1) {
         const search = document.getElementById('searchText')?.value;
         if (search) params.append('search', search);
         
-        params.append('page', page);
-        params.append('per_page', '10');
+        // 絞り込み条件が変わったら1ページ目から数え直す
+        const filterKey = params.toString();
+        if (filterKey !== cachedFilterKey) {
+            cachedFilterKey = filterKey;
+            cachedTotalCount = null;
+            pageCursors = [null];
+            page = 1;
+        }
+        // カーソルが分かっているページ（表示したページとその次のページ）にだけ移動できる
+        page = Math.min(Math.max(page, 1), pageCursors.length);
+        const cursor = pageCursors[page - 1];
+        if (cursor) params.append('cursor', cursor);
+        params.append('per_page', REPORTS_PER_PAGE);
+        
+        // 総件数は条件ごとに1回だけ集計する（再集計を求められた場合・更新や削除の後は集計し直す）
+        const includeTotal = refreshTotal || cachedTotalCount === null;
+        if (!includeTotal) {
+            params.append('include_total', '0');
+        }
         
         const response = await fetch('/api/reports?' + params.toString());
         if (!response.ok) {
@@ -144,16 +170,28 @@ async function loadReports(page = 1) {
         }
         
         const data = await response.json();
+        if (includeTotal) {
+            cachedTotalCount = data.total_count;
+        }
+        // 更新・削除でこのページが空になった場合は前のページを表示する
+        if (data.reports.length === 0 && page > 1) {
+            return loadReports(page - 1);
+        }
+        const total = cachedTotalCount;
+        currentPage = page;
+        // 次のページのカーソルを記録する（それより先のページのカーソルは境目が変わっている可能性があるため捨てる）
+        pageCursors.length = page;
+        if (data.next_cursor) pageCursors.push(data.next_cursor);
+        hasMorePages = data.has_more;
         allReports = data.reports;
-        totalPages = Math.ceil(data.total_count / 10);
         
         displayReports(allReports);
-        displayPagination(data.total_count);
+        displayPagination(total, allReports.length);
         
         // 件数表示を更新
         const totalCount = document.getElementById('totalCount');
         if (totalCount) {
-            totalCount.textContent = data.total_count;
+            totalCount.textContent = total;
         }
     } catch (error) {
         console.error('レポート読み込みエラー:', error);
@@ -241,16 +279,13 @@ function formatDate(dateStr) {
     return date.toLocaleDateString('ja-JP');
 }
 
-// ページネーション表示
-function displayPagination(totalCount) {
+// ページネーション表示（前後のページと、カーソルが分かっているページへのリンク）
+function displayPagination(totalCount, shownCount) {
     const container = document.getElementById('paginationContainer');
     if (!container) return;
     
-    const perPage = 10;
-    const totalPages = Math.ceil(totalCount / perPage);
-    
-    // ページが1つ以下の場合はページネーションを非表示
-    if (totalPages <= 1) {
+    // ページが1つだけの場合はページネーションを非表示
+    if (currentPage === 1 && !hasMorePages) {
         container.innerHTML = '';
         return;
     }
@@ -267,18 +302,8 @@ function displayPagination(totalCount) {
     }
     html += '</li>';
     
-    // ページ番号ボタン
-    const startPage = Math.max(1, currentPage - 2);
-    const endPage = Math.min(totalPages, currentPage + 2);
-    
-    if (startPage > 1) {
-        html += '<li class="page-item"><a class="page-link" href="javascript:void(0)" onclick="loadReports(1)">1</a></li>';
-        if (startPage > 2) {
-            html += '<li class="page-item disabled"><span class="page-link">...</span></li>';
-        }
-    }
-    
-    for (let i = startPage; i <= endPage; i++) {
+    // ページ番号ボタン（表示したページと次のページ）
+    for (let i = 1; i <= pageCursors.length; i++) {
         const active = i === currentPage ? ' active' : '';
         html += `<li class="page-item${active}">`;
         if (i === currentPage) {
@@ -289,17 +314,10 @@ function displayPagination(totalCount) {
         html += '</li>';
     }
     
-    if (endPage < totalPages) {
-        if (endPage < totalPages - 1) {
-            html += '<li class="page-item disabled"><span class="page-link">...</span></li>';
-        }
-        html += `<li class="page-item"><a class="page-link" href="javascript:void(0)" onclick="loadReports(${totalPages})">${totalPages}</a></li>`;
-    }
-    
     // 次へボタン
-    const nextDisabled = currentPage >= totalPages ? ' disabled' : '';
+    const nextDisabled = hasMorePages ? '' : ' disabled';
     html += `<li class="page-item${nextDisabled}">`;
-    if (currentPage < totalPages) {
+    if (hasMorePages) {
         html += `<a class="page-link" href="javascript:void(0)" onclick="loadReports(${currentPage + 1})">次へ</a>`;
     } else {
         html += '<span class="page-link">次へ</span>';
@@ -308,10 +326,11 @@ function displayPagination(totalCount) {
     
     html += '</ul></nav>';
     
-    // 件数表示も追加
-    const startItem = (currentPage - 1) * perPage + 1;
-    const endItem = Math.min(currentPage * perPage, totalCount);
-    html += `<div class="small text-muted mt-2">${startItem} - ${endItem} 件 (全 ${totalCount} 件中)</div>`;
+    // 件数表示も追加（総件数はキャッシュした値のため、再集計のリンクを付ける）
+    const startItem = (currentPage - 1) * REPORTS_PER_PAGE + 1;
+    const endItem = startItem + shownCount - 1;
+    html += `<div class="small text-muted mt-2">${startItem} - ${endItem} 件 (全 ${totalCount} 件中) `;
+    html += `<a href="javascript:void(0)" onclick="loadReports(${currentPage}, true)">再集計</a></div>`;
     
     container.innerHTML = html;
 }
@@ -534,8 +553,8 @@ async function deleteAllProjectsInMail(mailId) {
                     alert('全案件を削除しました');
                     // 選択されたレポートから削除
                     removeSelectedReport(mailId);
-                    // リストを再読み込み
-                    loadReports();
+                    // 現在のページを再読み込み（総件数も集計し直す）
+                    loadReports(currentPage, true);
                 } else {
                     throw new Error('削除に失敗しました');
                 }
@@ -547,27 +566,39 @@ async function deleteAllProjectsInMail(mailId) {
     }
 }
 
+// 「もっと見る」ボタン（客先名・製品名はHTMLに埋め込まず、クリック時の処理に直接渡す）
+function createMoreButton(id, onClick) {
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.id = id;
+    button.className = 'btn btn-outline-secondary btn-sm w-100';
+    button.textContent = 'もっと見る';
+    button.addEventListener('click', onClick);
+    return button;
+}
+
 // 客先案件表示
-async function showClientProjects(client) {
+async function showClientProjects(client, page = 1) {
     try {
-        const response = await fetch('/api/client_projects/' + encodeURIComponent(client));
-        const projects = await response.json();
-        displayClientProjects(client, projects);
+        const response = await fetch('/api/client_projects/' + encodeURIComponent(client) + '?page=' + page + '&per_page=' + PROJECTS_PER_PAGE);
+        const data = await response.json();
+        displayClientProjects(client, data);
     } catch (error) {
         console.error('客先案件読み込みエラー:', error);
     }
 }
 
-function displayClientProjects(client, projects) {
+function displayClientProjects(client, data) {
     const container = document.getElementById('clientProjectsContainer');
     const titleElement = document.getElementById('clientProjectsTitle');
     const areaElement = document.getElementById('clientProjectsArea');
     
     if (!container || !titleElement || !areaElement) return;
     
-    titleElement.textContent = client + 'の案件一覧 (' + projects.length + '件)';
+    const projects = data.projects;
+    titleElement.textContent = client + 'の案件一覧 (' + data.total_count + '件)';
     
-    if (projects.length === 0) {
+    if (projects.length === 0 && data.page === 1) {
         container.innerHTML = '<div class="alert alert-info">該当する案件がありません</div>';
     } else {
         let html = '';
@@ -595,33 +626,45 @@ function displayClientProjects(client, projects) {
             html += '</div>';
             html += '</div>';
         });
-        container.innerHTML = html;
+        
+        // 2ページ目以降は「もっと見る」ボタンを置き換えて追記
+        const moreButton = document.getElementById('clientProjectsMore');
+        if (moreButton) moreButton.remove();
+        if (data.page === 1) {
+            container.innerHTML = html;
+        } else {
+            container.insertAdjacentHTML('beforeend', html);
+        }
+        if (data.has_more) {
+            container.appendChild(createMoreButton('clientProjectsMore', () => showClientProjects(client, data.page + 1)));
+        }
     }
     
     areaElement.style.display = 'block';
 }
 
 // 製品案件表示
-async function showProductProjects(product) {
+async function showProductProjects(product, page = 1) {
     try {
-        const response = await fetch('/api/product_projects/' + encodeURIComponent(product));
-        const projects = await response.json();
-        displayProductProjects(product, projects);
+        const response = await fetch('/api/product_projects/' + encodeURIComponent(product) + '?page=' + page + '&per_page=' + PROJECTS_PER_PAGE);
+        const data = await response.json();
+        displayProductProjects(product, data);
     } catch (error) {
         console.error('製品案件読み込みエラー:', error);
     }
 }
 
-function displayProductProjects(product, projects) {
+function displayProductProjects(product, data) {
     const container = document.getElementById('productProjectsContainer');
     const titleElement = document.getElementById('productProjectsTitle');
     const areaElement = document.getElementById('productProjectsArea');
     
     if (!container || !titleElement || !areaElement) return;
     
-    titleElement.textContent = product + 'の案件一覧 (' + projects.length + '件)';
+    const projects = data.projects;
+    titleElement.textContent = product + 'の案件一覧 (' + data.total_count + '件)';
     
-    if (projects.length === 0) {
+    if (projects.length === 0 && data.page === 1) {
         container.innerHTML = '<div class="alert alert-info">該当する案件がありません</div>';
     } else {
         let html = '';
@@ -649,7 +692,18 @@ function displayProductProjects(product, projects) {
             html += '</div>';
             html += '</div>';
         });
-        container.innerHTML = html;
+        
+        // 2ページ目以降は「もっと見る」ボタンを置き換えて追記
+        const moreButton = document.getElementById('productProjectsMore');
+        if (moreButton) moreButton.remove();
+        if (data.page === 1) {
+            container.innerHTML = html;
+        } else {
+            container.insertAdjacentHTML('beforeend', html);
+        }
+        if (data.has_more) {
+            container.appendChild(createMoreButton('productProjectsMore', () => showProductProjects(product, data.page + 1)));
+        }
     }
     
     areaElement.style.display = 'block';
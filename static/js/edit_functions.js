@@ -99,8 +99,8 @@ async function saveProjectData() {
             const modal = bootstrap.Modal.getInstance(document.getElementById('editModal'));
             modal.hide();
             
-            // 表示を更新
-            loadReports();
+            // 表示を更新（現在のページのまま、総件数も集計し直す）
+            loadReports(currentPage, true);
         } else {
             throw new Error('保存に失敗しました');
         }
@@ -134,8 +134,8 @@ async function deleteProjectData() {
             const modal = bootstrap.Modal.getInstance(document.getElementById('editModal'));
             modal.hide();
             
-            // 表示を更新
-            loadReports();
+            // 表示を更新（現在のページのまま、総件数も集計し直す）
+            loadReports(currentPage, true);
         } else {
             const error = await response.json();
             throw new Error(error.error || '削除に失敗しました');
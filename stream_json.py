@@ -0,0 +1,161 @@
+"""
+ストリーミング生成されるモデル出力の逐次JSONパーサー
+
+モデルの出力（1通分の解析結果のJSONオブジェクト）を届いた分ずつ解析する。
+- 「週報判定」が false と分かった時点で判定を確定し、残りの生成を待たずに打ち切れるようにする
+- 「報告内容」の配列は要素（報告1件）が閉じるたびに解析し、配列の途中でも報告を取り出せるようにする
+
+最上位のオブジェクトの値とその中の「報告内容」の要素だけを追跡する単純な状態機械で、
+値そのものの解析は json.loads で行う。出力が壊れていた場合や「報告内容」にオブジェクト以外の要素がある場合は以降の逐次解析をやめ、
+result() が ValueError を送出する（呼び出し側は全文を通常どおり解析し直す）。
+"""
+
+import json
+import re
+
+# JSON解析前に除去する制御文字（タブと改行以外。weekly_report_processor.parse_model_output と同じ）
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b-\x0c\x0e-\x1f]')
+
+VERDICT_KEY = '週報判定'
+REPORTS_KEY = '報告内容'
+
+
+def loads(raw):
+    return json.loads(CONTROL_CHARS.sub('', raw))
+
+
+class ReportStreamParser:
+    """
+    1通分の解析結果の逐次パーサー
+
+    feed() に出力の断片を順に渡す。週報ではないと確定した時点で feed() は True を返し、
+    以降の断片は不要になる。on_report を指定すると「報告内容」の要素が閉じるたびに呼ばれる。
+    """
+
+    def __init__(self, on_report=None):
+        self.on_report = on_report
+        self.values = {}        # 最上位のオブジェクトの値（解析済みのもの）
+        self.reports = []       # 解析済みの「報告内容」の要素
+        self.not_report = False
+        self.closed = False     # 最上位のオブジェクトが閉じたか
+        self.broken = False     # 逐次解析できない出力だったか
+        self._buffer = ''
+        self._stack = []        # 開いている { と [
+        self._in_string = False
+        self._escape = False
+        self._key = None        # 最上位で現在の値のキー
+        self._expect_key = False
+        self._value_start = None    # 最上位の値（またはキー）の開始位置
+        self._item_start = None     # 「報告内容」の要素の開始位置
+
+    @property
+    def text(self):
+        """これまでに受け取った出力の全文"""
+        return self._buffer
+
+    def feed(self, chunk):
+        """出力の断片を解析し、週報ではないと確定したら True を返す"""
+        offset = len(self._buffer)
+        self._buffer += chunk
+        if self.closed or self.not_report or self.broken:
+            return self.not_report
+        try:
+            for index in range(offset, len(self._buffer)):
+                self._step(self._buffer[index], index)
+                if self.not_report or self.closed:
+                    break
+        except ValueError:
+            self.broken = True
+        return self.not_report
+
+    def _step(self, char, index):
+        depth = len(self._stack)
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if depth == 1 and self._expect_key:
+                    self._key = loads(self._buffer[self._value_start:index + 1])
+                    self._value_start = None
+                elif depth == 1:
+                    self._finish_value(index + 1)
+            return
+
+        if depth == 0:
+            # 最上位のオブジェクトの前（```json 等）は読み飛ばす
+            if char == '{':
+                self._stack.append(char)
+                self._expect_key = True
+            return
+
+        if (depth == 2 and self._key == REPORTS_KEY and self._stack[1] == '['
+                and not char.isspace() and char not in '{],'):
+            # オブジェクト以外の要素は逐次解析せず、全文の解析に任せる（ストリーミングなしの場合と同じ結果にする）
+            raise ValueError('報告内容の要素がオブジェクトではありません')
+
+        if char == '"':
+            self._in_string = True
+            if depth == 1:
+                self._value_start = index
+        elif char in '{[':
+            if depth == 1:
+                self._value_start = index
+            elif depth == 2 and char == '{' and self._key == REPORTS_KEY and self._stack[1] == '[':
+                self._item_start = index
+            self._stack.append(char)
+        elif char in '}]':
+            self._stack.pop()
+            if depth == 1:
+                if self._value_start is not None:
+                    self._finish_value(index)
+                self.closed = True
+            elif depth == 2:
+                self._finish_value(index + 1)
+            elif depth == 3 and self._item_start is not None:
+                self._finish_report(index + 1)
+        elif depth == 1:
+            if char == ':':
+                self._expect_key = False
+            elif char == ',':
+                if self._value_start is not None:
+                    self._finish_value(index)
+                self._expect_key = True
+            elif not char.isspace() and not self._expect_key:
+                # true / false / null / 数値
+                if self._value_start is None:
+                    self._value_start = index
+                if self._key == VERDICT_KEY and self._buffer[self._value_start:index + 1] == 'false':
+                    # 区切りの , を待たずに確定する
+                    self._finish_value(index + 1)
+
+    def _finish_value(self, end):
+        """最上位の値が閉じた"""
+        if self._value_start is None:
+            return
+        if self._key == REPORTS_KEY and self._buffer[self._value_start] == '[':
+            value = self.reports
+        else:
+            value = loads(self._buffer[self._value_start:end])
+        self._value_start = None
+        self.values[self._key] = value
+        if self._key == VERDICT_KEY and value is False:
+            self.not_report = True
+
+    def _finish_report(self, end):
+        """「報告内容」の要素が閉じた"""
+        report = loads(self._buffer[self._item_start:end])
+        self._item_start = None
+        self.reports.append(report)
+        if self.on_report:
+            self.on_report(report)
+
+    def result(self):
+        """解析結果の辞書（逐次解析できなかった・オブジェクトが閉じていない場合は ValueError）"""
+        if self.not_report:
+            return {VERDICT_KEY: False}
+        if self.broken or not self.closed:
+            raise ValueError('逐次解析できない出力です')
+        return dict(self.values)
@@ -0,0 +1,48 @@
+"""
+テスト共通のフィクスチャ
+
+週報処理はフェイクのメール取得元・解析モデル（fake_services.py）で動かし、
+DB・キャッシュ・アーカイブは一時ディレクトリに作成する。
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_services  # noqa: E402
+import weekly_report_processor  # noqa: E402
+
+
+@pytest.fixture
+def make_processor(tmp_path, monkeypatch):
+    """
+    一時ディレクトリで WeeklyReportProcessor を作成する関数
+
+    argv はサブコマンドと引数（parse_args に渡すもの）。進捗の出力は processor.out（StringIO）に書き込まれる。
+    """
+    monkeypatch.chdir(tmp_path)
+    processors = []
+
+    def make(argv, mail_source=None, analyzer=None, **kwargs):
+        if argv[0] in weekly_report_processor.PIPELINE_COMMANDS:
+            # テストではモデル呼び出しのレート制限をかけない
+            argv = argv + ['--rate-per-minute', '0']
+        options = weekly_report_processor.parse_args(argv)
+        processor = weekly_report_processor.WeeklyReportProcessor(
+            options,
+            out=io.StringIO(),
+            mail_source=mail_source or fake_services.FakeMailSource(0),
+            analyzer=analyzer or fake_services.FakeAnalyzer(),
+            db_file=str(tmp_path / weekly_report_processor.DB_FILE),
+            **kwargs
+        )
+        processors.append(processor)
+        return processor
+
+    yield make
+    for processor in processors:
+        processor.close()
@@ -0,0 +1,74 @@
+"""
+解析段（analysis.py）とバッチ解析のテスト
+"""
+
+import base64
+
+import analysis
+import fake_services
+from gmail_source import body_size
+
+
+def broken_mailbox(count, broken_index):
+    """broken_index 番目のメールの本文が UTF-8 として不正なフェイクのメール取得元"""
+    source = fake_services.FakeMailSource(count)
+    messages = source.fake_service.messages
+    broken_id = sorted(messages)[broken_index]
+    part = messages[broken_id]['payload']['parts'][0]
+    part['body']['data'] = base64.urlsafe_b64encode(b'\xff\xfe\x80 broken').decode('ascii')
+    return source, broken_id
+
+
+def test_batch_stage_isolates_inputs_that_cannot_be_sized():
+    def size_of(payload):
+        if payload == 'bad':
+            raise ValueError('cannot size')
+        return len(payload)
+
+    def analyze(payload):
+        if payload == 'bad':
+            raise ValueError('cannot analyze')
+        return payload.upper()
+
+    stage = analysis.BatchAnalysisStage(
+        analyze, lambda payloads: [p.upper() for p in payloads],
+        batch_size=4, size_of=size_of, rate_per_minute=None, max_retries=0
+    )
+    items = [(1, 'a'), (2, 'bad'), (3, 'c'), (4, 'd')]
+    results = {key: (result, error) for key, _, result, error in stage.run(items)}
+    assert results[1] == ('A', None)
+    assert results[3] == ('C', None)
+    assert results[4] == ('D', None)
+    assert results[2][0] is None and isinstance(results[2][1], ValueError)
+
+
+def test_malformed_batch_response_falls_back_without_retrying_the_batch():
+    batch_calls = []
+
+    def analyze_batch(payloads):
+        batch_calls.append(payloads)
+        raise analysis.AnalysisError('not a JSON object')
+
+    stage = analysis.BatchAnalysisStage(
+        lambda payload: payload.upper(), analyze_batch,
+        batch_size=4, rate_per_minute=None, max_retries=3
+    )
+    results = [result for _, _, result, _ in stage.run([(i, p) for i, p in enumerate('abcd')])]
+    assert results == ['A', 'B', 'C', 'D']
+    assert len(batch_calls) == 1
+
+
+def test_batch_sync_records_undecodable_mail_as_failed(make_processor):
+    source, broken_id = broken_mailbox(6, 2)
+    processor = make_processor(['sync', '--batch-size', '4'], mail_source=source)
+    summary = processor.run()
+    assert summary['done'] == 5
+    assert summary['failed'] == 1
+    status = dict(processor.conn.execute('SELECT mail_id, status FROM processed_mails').fetchall())
+    assert status[broken_id] == 'failed'
+    assert sum(1 for value in status.values() if value == 'registered') == 5
+
+
+def test_body_size_does_not_decode():
+    source, broken_id = broken_mailbox(1, 0)
+    assert body_size(source.fake_service.messages[broken_id]) == len(b'\xff\xfe\x80 broken')
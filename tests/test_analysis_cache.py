@@ -0,0 +1,65 @@
+"""
+解析結果キャッシュ（analysis_cache.py）のテスト
+"""
+
+import sqlite3
+
+import pytest
+
+import analysis_cache
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / 'analysis_cache.db')
+
+
+def stored_hits(cache_file):
+    """別の接続から見えるキーごとのヒット数"""
+    conn = sqlite3.connect(cache_file)
+    try:
+        return dict(conn.execute('SELECT key, hit_count FROM analysis_cache'))
+    finally:
+        conn.close()
+
+
+def test_hits_are_written_in_batches(cache_file, monkeypatch):
+    monkeypatch.setattr(analysis_cache, 'TOUCH_BATCH_SIZE', 3)
+    cache = analysis_cache.AnalysisCache(cache_file)
+    for key in 'abcd':
+        cache.put(key, {'週報判定': True, 'key': key})
+
+    changes = cache._conn.total_changes
+    assert cache.get('a') == {'週報判定': True, 'key': 'a'}
+    cache.get('a')
+    cache.get('b')
+    assert cache.get('missing') is None
+    # ヒットのたびには書き込まない
+    assert cache._conn.total_changes == changes
+    assert stored_hits(cache_file) == {'a': 0, 'b': 0, 'c': 0, 'd': 0}
+
+    # 異なるキーが TOUCH_BATCH_SIZE 件たまったらまとめて書き込む
+    cache.get('c')
+    assert stored_hits(cache_file) == {'a': 2, 'b': 1, 'c': 1, 'd': 0}
+    assert cache.stats()['hits'] == 4 and cache.stats()['misses'] == 1
+
+    cache.get('d')
+    cache.close()
+    assert stored_hits(cache_file)['d'] == 1
+
+
+def test_eviction_sees_pending_hits(cache_file):
+    cache = analysis_cache.AnalysisCache(cache_file, max_bytes=200)
+    result = {'週報判定': False, 'pad': 'x' * 40}
+    cache.put('old', result)
+    cache.put('newer', result)
+    # 'old' のヒットは未書き込みでも、削除対象を選ぶ前に反映される
+    cache._conn.execute("UPDATE analysis_cache SET last_used_at = last_used_at - 1 WHERE key = 'old'")
+    cache._conn.execute("UPDATE analysis_cache SET last_used_at = last_used_at - 0.5 WHERE key = 'newer'")
+    assert cache.get('old') is not None
+    cache.put('newest', result)
+    cache.put('latest', result)
+    assert cache.get('old') is not None
+    assert cache.get('newer') is None
+    assert cache.stats()['evictions'] >= 1
+    cache.close()
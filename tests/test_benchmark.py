@@ -0,0 +1,65 @@
+"""
+benchmark サブコマンドのスモークテスト（段ごとの処理時間の表と一時ディレクトリの削除）
+"""
+
+import io
+import os
+import tempfile
+
+import pytest
+
+import weekly_report_processor
+
+BENCH_ARGS = ['benchmark', '--mails', '12', '--mail-latency', '0', '--model-latency', '0', '--skip-rate', '0.25']
+
+
+@pytest.fixture
+def bench_tmp(tmp_path, monkeypatch):
+    # 一時ディレクトリを tmp_path の下に作らせ、後始末を確認できるようにする
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_benchmark_prints_stage_table_and_removes_its_directory(bench_tmp):
+    out = io.StringIO()
+    options = weekly_report_processor.parse_args(BENCH_ARGS)
+    with weekly_report_processor.WeeklyReportProcessor(options, out=out) as processor:
+        bench_dir = processor.bench_dir
+        assert os.path.dirname(bench_dir) == str(bench_tmp)
+        summary = processor.run()
+        assert os.path.exists(os.path.join(bench_dir, weekly_report_processor.DB_FILE))
+
+    assert summary['done'] == 12 and summary['failed'] == 0
+    assert summary['seconds'] > 0
+    assert not os.path.exists(bench_dir)
+    # 作業用のDB・アーカイブを作業ディレクトリ（本番のDBの場所）に作らない
+    assert os.listdir(bench_tmp) == []
+
+    lines = out.getvalue().splitlines()
+    assert '処理したメール: 12/12通' in out.getvalue()
+    header = next(index for index, line in enumerate(lines) if line.startswith('段'))
+    assert lines[header].split() == ['段', '回数', '合計(秒)', '平均(ms)', 'p50(ms)', 'p95(ms)']
+    table = {}
+    for line in lines[header + 1:]:
+        name, *values = line.split()
+        if len(values) != 5:
+            break
+        table[name] = values
+    assert set(table) == {'fetch', 'analyze', 'write'}
+    assert table['analyze'][0] == '12'
+    assert all(float(value) >= 0 for values in table.values() for value in values)
+
+
+def test_benchmark_directory_is_removed_when_the_run_fails(bench_tmp, monkeypatch):
+    options = weekly_report_processor.parse_args(BENCH_ARGS)
+
+    def broken_sync(self):
+        raise RuntimeError('sync failed')
+
+    monkeypatch.setattr(weekly_report_processor.WeeklyReportProcessor, 'run_sync', broken_sync)
+    with pytest.raises(RuntimeError):
+        with weekly_report_processor.WeeklyReportProcessor(options, out=io.StringIO()) as processor:
+            bench_dir = processor.bench_dir
+            processor.run()
+    assert not os.path.exists(bench_dir)
@@ -0,0 +1,115 @@
+"""
+週報処理ジョブ（ingest_jobs.py）の排他・停止したジョブの引き継ぎ・ハートビートのテスト
+"""
+
+import threading
+import time
+
+import pytest
+
+import ingest_jobs
+import report_db
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / 'weekly_reports.db')
+    conn = report_db.connect(path)
+    report_db.migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = report_db.connect(db_file)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def fast_monitor(monkeypatch):
+    monkeypatch.setattr(ingest_jobs, 'JOB_HEARTBEAT_SECONDS', 0.02)
+    monkeypatch.setattr(ingest_jobs, 'JOB_STALL_SECONDS', 0.3)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_second_job_conflicts_with_running_job(conn):
+    job_id = ingest_jobs.start_job(conn, 'sync')
+    with pytest.raises(ingest_jobs.JobConflict) as excinfo:
+        ingest_jobs.start_job(conn, 'reprocess')
+    assert excinfo.value.job_id == job_id
+
+    ingest_jobs.finish_job(conn, job_id, 'succeeded')
+    assert ingest_jobs.start_job(conn, 'reprocess') != job_id
+
+
+def test_stale_job_is_taken_over(conn):
+    stale_id = ingest_jobs.start_job(conn, 'sync')
+    conn.execute("UPDATE ingest_jobs SET heartbeat_at = datetime('now', ?) WHERE job_id = ?",
+                 (f'-{ingest_jobs.JOB_STALE_SECONDS + 5} seconds', stale_id))
+    conn.commit()
+
+    job_id = ingest_jobs.start_job(conn, 'sync')
+    stale = ingest_jobs.get_job(conn, stale_id)
+    assert stale['status'] == 'failed' and stale['error']
+    assert ingest_jobs.get_job(conn, job_id)['status'] == 'running'
+
+    # 停止したとみなしたジョブが後から終了しても、状態は変わらない
+    ingest_jobs.finish_job(conn, stale_id, 'succeeded')
+    assert ingest_jobs.get_job(conn, stale_id)['status'] == 'failed'
+
+
+def test_heartbeat_records_progress_and_picks_up_cancel(db_file, conn, fast_monitor):
+    job_id = ingest_jobs.start_job(conn, 'sync')
+    cancel_event = threading.Event()
+    progress = {}
+
+    def run():
+        for done in range(1, 1000):
+            progress.update(done=done, total=1000)
+            if done == 5:
+                wait_until(lambda: ingest_jobs.get_job(conn, job_id)['progress_done'] >= 5)
+                ingest_jobs.request_cancel(conn, job_id)
+            if cancel_event.wait(0.01):
+                return {'done': done, 'interrupted': True}
+        return {'done': 1000}
+
+    summary = ingest_jobs.run_job(db_file, job_id, run, cancel_event, progress)
+    assert summary['interrupted']
+    job = ingest_jobs.get_job(conn, job_id)
+    assert job['status'] == 'cancelled'
+    assert job['progress_done'] == summary['done'] and job['progress_total'] == 1000
+
+
+def test_job_without_progress_releases_its_lock(db_file, conn, fast_monitor):
+    job_id = ingest_jobs.start_job(conn, 'sync')
+    cancel_event = threading.Event()
+    release = threading.Event()
+    outcome = {}
+
+    def hung():
+        # 認証待ち等で進捗のないまま止まっている処理
+        release.wait(10)
+        return {'done': 0}
+
+    worker = threading.Thread(
+        target=lambda: outcome.update(summary=ingest_jobs.run_job(db_file, job_id, hung, cancel_event, {}))
+    )
+    worker.start()
+    try:
+        wait_until(lambda: ingest_jobs.get_job(conn, job_id)['status'] != 'running')
+        assert cancel_event.is_set()
+        assert ingest_jobs.get_job(conn, job_id)['status'] == 'failed'
+        # 止まったスレッドが残っていても次のジョブを開始できる
+        assert ingest_jobs.start_job(conn, 'sync') != job_id
+    finally:
+        release.set()
+        worker.join()
+    assert ingest_jobs.get_job(conn, job_id)['status'] == 'failed'
@@ -0,0 +1,84 @@
+"""
+週報処理ジョブのログ配信（/api/process_status・/api/process_events）の再開位置のテスト
+"""
+
+import sqlite3
+
+import pytest
+
+import app as app_module
+import ingest_jobs
+import report_db
+
+LINES = ['週報処理を開始します...', '[1/2] メールID 18d0 を登録しました', '[2/2] 客先: ホンダ 技術部', 'ジョブ終了']
+LOG = ''.join(line + '\n' for line in LINES).encode('utf-8')
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'weekly_reports.db')
+    log_file = tmp_path / 'job.log'
+    log_file.write_bytes(LOG)
+    conn = report_db.connect(db_file)
+    report_db.migrate(conn)
+    job_id = ingest_jobs.start_job(conn, 'sync', str(log_file))
+    ingest_jobs.finish_job(conn, job_id, 'succeeded')
+    conn.close()
+
+    pool = report_db.ConnectionPool(db_file, row_factory=sqlite3.Row)
+    monkeypatch.setattr(app_module, 'DATABASE', db_file)
+    monkeypatch.setattr(app_module, 'db_pool', pool)
+    monkeypatch.setattr(app_module, 'search_index_enabled', None)
+    yield app_module.app.test_client(), job_id
+    pool.close_all()
+
+
+def offset_inside(line_index, byte_in_line):
+    """LINES[line_index] の先頭から byte_in_line バイト目の位置"""
+    return sum(len((line + '\n').encode('utf-8')) for line in LINES[:line_index]) + byte_in_line
+
+
+def log_events(body):
+    """SSEの応答から (id, データ) の log イベントを取り出す"""
+    events = []
+    for block in body.split('\n\n'):
+        fields = [line.split(': ', 1) for line in block.split('\n') if ': ' in line]
+        if ('event', 'log') in [tuple(field) for field in fields]:
+            event_id = next(int(value) for key, value in fields if key == 'id')
+            data = '\n'.join(value for key, value in fields if key == 'data')
+            events.append((event_id, data))
+    return events
+
+
+def test_events_resume_from_the_start_of_a_torn_line(job):
+    test_client, job_id = job
+    # 「客」（3バイト）の途中を指す Last-Event-ID
+    offset = offset_inside(2, len('[2/2] 客'.encode('utf-8')) - 1)
+    response = test_client.get(f'/api/process_events/{job_id}', headers={'Last-Event-ID': str(offset)})
+    events = log_events(response.get_data(as_text=True))
+    assert events == [(len(LOG), '\n'.join(LINES[2:]))]
+    assert '�' not in response.get_data(as_text=True)
+
+
+def test_events_resume_exactly_at_a_line_boundary(job):
+    test_client, job_id = job
+    response = test_client.get(f'/api/process_events/{job_id}?offset={offset_inside(1, 0)}')
+    assert log_events(response.get_data(as_text=True)) == [(len(LOG), '\n'.join(LINES[1:]))]
+
+
+@pytest.mark.parametrize('offset, first_line', [(1, 0), (offset_inside(1, 5), 1), (offset_inside(3, 2), 3)])
+def test_status_offset_inside_a_line_returns_whole_lines(job, offset, first_line):
+    test_client, job_id = job
+    data = test_client.get(f'/api/process_status/{job_id}?offset={offset}').get_json()
+    assert data['new_output'] == ''.join(line + '\n' for line in LINES[first_line:])
+    assert data['current_offset'] == len(LOG)
+
+
+def test_line_start_reads_back_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'LOG_SCAN_BYTES', 4)
+    path = tmp_path / 'long.log'
+    path.write_bytes(LOG)
+    with open(path, 'rb') as f:
+        assert app_module.line_start(f, offset_inside(1, 20)) == offset_inside(1, 0)
+        assert app_module.line_start(f, offset_inside(0, 7)) == 0
+        assert app_module.line_start(f, len(LOG) + 100) == len(LOG)
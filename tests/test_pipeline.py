@@ -0,0 +1,106 @@
+"""
+取得→解析→書き込みのパイプライン（WeeklyReportProcessor.run_pipeline）のテスト（fake_services を使う）
+"""
+
+from collections import Counter
+
+import analysis
+import fake_services
+import report_writer
+
+
+class FlakyAnalyzer(fake_services.FakeAnalyzer):
+    """最初の failures 回の呼び出しが一時的なエラー（503）になるプロンプトを持つ解析モデル"""
+
+    def __init__(self, failing, failures=1, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = failing
+        self.failures = failures
+        self.calls = Counter()
+
+    def generate_stream(self, prompt):
+        sender = next((name for name in self.failing if name in prompt), None)
+        if sender:
+            self.calls[sender] += 1
+            if self.calls[sender] <= self.failures:
+                raise fake_services.FakeApiError(503, 'Service Unavailable')
+        return super().generate_stream(prompt)
+
+
+def statuses(conn):
+    return Counter(status for (status,) in conn.execute('SELECT status FROM processed_mails'))
+
+
+def test_mails_are_fetched_analyzed_and_written(make_processor):
+    source = fake_services.FakeMailSource(6)
+    processor = make_processor(['sync', '--flush-mails', '4'], mail_source=source,
+                               analyzer=fake_services.FakeAnalyzer(reports_per_mail=2))
+    summary = processor.run()
+    assert summary == {'done': 6, 'registered': 6, 'failed': 0, 'interrupted': False, 'total': 6}
+
+    conn = processor.conn
+    assert statuses(conn) == {'registered': 6}
+    rows = conn.execute('SELECT mail_id, reporter, report_date FROM weekly_reports').fetchall()
+    assert len(rows) == 12
+    assert {row[0] for row in rows} == set(source.fake_service.messages)
+    assert all(row[1] and row[2] for row in rows)
+    # 集計テーブルと処理済みの記録は報告行と一緒に確定している
+    assert conn.execute('SELECT COUNT(*) FROM mail_summaries').fetchone()[0] == 6
+    assert conn.execute('SELECT SUM(report_count) FROM processed_mails').fetchone()[0] == 12
+    assert processor.archive.mail_ids() == set(source.fake_service.messages)
+
+
+def test_transient_failure_is_retried_at_the_end_of_the_run(make_processor, monkeypatch):
+    # 解析段での即時の再試行をなくし、パイプラインの最後の再試行だけを通す
+    monkeypatch.setattr(analysis, 'ANALYSIS_MAX_RETRIES', 0)
+    analyzer = FlakyAnalyzer(['村田'])
+    processor = make_processor(['sync'], mail_source=fake_services.FakeMailSource(5), analyzer=analyzer)
+    summary = processor.run()
+    assert summary['failed'] == 0 and summary['registered'] == 5
+    assert analyzer.calls['村田'] == 2
+    assert statuses(processor.conn) == {'registered': 5}
+    assert 'の解析に失敗しました（後で再試行します）' in processor.out.getvalue()
+
+
+def test_failure_that_persists_is_recorded_as_failed(make_processor, monkeypatch):
+    monkeypatch.setattr(analysis, 'ANALYSIS_MAX_RETRIES', 0)
+    analyzer = FlakyAnalyzer(['村田'], failures=2)
+    processor = make_processor(['sync'], mail_source=fake_services.FakeMailSource(5), analyzer=analyzer)
+    summary = processor.run()
+    assert summary['failed'] == 1 and summary['registered'] == 4
+    assert statuses(processor.conn) == {'registered': 4, 'failed': 1}
+
+
+def test_processed_mails_are_skipped(make_processor):
+    source = fake_services.FakeMailSource(4)
+    make_processor(['sync'], mail_source=source).run()
+    source.fake_service.add_message('f000000000000001', '週報 2025/03/03 西田', '西田 <n@example.com>',
+                                    'Mon, 03 Mar 2025 09:00:00 +0900', '今週の活動報告です。\nTF-4060のデモを実施。\n')
+
+    # 全件を一覧しても、処理済みのメールは解析し直さない
+    analyzer = fake_services.FakeAnalyzer()
+    processor = make_processor(['sync', '--full'], mail_source=source, analyzer=analyzer)
+    summary = processor.run()
+    assert summary['done'] == 1 and summary['total'] == 5
+    assert analyzer.call_count == 1
+    assert statuses(processor.conn) == {'registered': 5}
+
+
+def test_pipeline_loop_flushes_by_time(make_processor, monkeypatch):
+    # 解析の再試行に回るメールは add() されないため、時間のしきい値は解析結果が届くたびに確認する
+    monkeypatch.setattr(analysis, 'ANALYSIS_MAX_RETRIES', 0)
+    checks = []
+    flush_if_due = report_writer.ReportWriter.flush_if_due
+
+    def counting_flush_if_due(self):
+        checks.append(self.pending)
+        return flush_if_due(self)
+
+    monkeypatch.setattr(report_writer.ReportWriter, 'flush_if_due', counting_flush_if_due)
+    analyzer = FlakyAnalyzer(['村田', '田村'])
+    processor = make_processor(['sync', '--flush-mails', '100', '--flush-seconds', '0'],
+                               mail_source=fake_services.FakeMailSource(5), analyzer=analyzer)
+    assert processor.run()['registered'] == 5
+    # 最初の解析と最後の再試行のどちらでも、結果が届くたびに確認している（add() からの確認を含む）
+    assert len(checks) >= 5 + 2 + 5
+    assert max(checks) <= 1
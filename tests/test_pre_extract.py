@@ -0,0 +1,76 @@
+"""
+事前抽出（pre_extract.py）のキーワード検出と事前判定のテスト
+"""
+
+import pytest
+
+from pre_extract import KeywordMatcher, PreExtractor
+from weekly_report_processor import EMPLOYEE_LIST, PRODUCT_LIST, REPORTER_LIST
+
+
+@pytest.fixture(scope='module')
+def extractor():
+    return PreExtractor(REPORTER_LIST, EMPLOYEE_LIST, PRODUCT_LIST)
+
+
+def hints_for(extractor, subject, body, sender='西田 <n@example.com>'):
+    return extractor.extract(subject, body, sender, 'Mon, 06 Jan 2025 09:00:00 +0900')
+
+
+def test_overlapping_keywords_prefer_the_longest_match():
+    matcher = KeywordMatcher({'TF-4060': 'TF-4060', 'TF-4060-G': 'TF-4060-G', '4060-G': 'X'})
+    assert matcher.find('TF-4060-G を納品') == ['TF-4060-G']
+    assert matcher.find('TF-4060 と TF-4060-G') == ['TF-4060', 'TF-4060-G']
+    # 重なりを含むすべての出現は finditer で得られる
+    assert sorted(m[2] for m in matcher.finditer('TF-4060-G')) == ['TF-4060', 'TF-4060-G', 'X']
+
+
+def test_keywords_sharing_suffixes_are_found_through_failure_links():
+    matcher = KeywordMatcher({'he': 'he', 'she': 'she', 'his': 'his', 'hers': 'hers'})
+    assert [(start, end, name) for start, end, name in matcher.finditer('ushers')] == [
+        (1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers'),
+    ]
+
+
+def test_japanese_names_and_fullwidth_text():
+    matcher = KeywordMatcher({'田村': '田村', '村田': '村田', 'PDL-06': 'PDL-06'})
+    # 「田村田」では田村と村田が一部だけ重なる（どちらも他方に含まれないため両方をヒントにする）
+    assert matcher.find('同行：田村田さん') == ['田村', '村田']
+    assert matcher.find('村田・田村が同行') == ['村田', '田村']
+    # 全角英数字も半角・大文字にそろえて照合する
+    assert matcher.find('ｐｄｌ-０６をデモ') == ['PDL-06']
+
+
+def test_extract_products_employees_and_reporter(extractor):
+    hints = hints_for(extractor, '週報 1/6', 'ホンダ様 TF4060 と 3040 のデモ。同行: 藤原、柳澤\n2025年 見積 12000円')
+    assert hints['reporter'] == '西田'
+    assert hints['report_date'] == '2025-01-06'
+    assert hints['products'] == ['TF-4060', 'TF-3040']
+    assert hints['product_numbers'] == {'3040': 'TF-3040'}
+    assert hints['employees'] == ['藤原', '柳澤']
+
+
+@pytest.mark.parametrize('subject, body', [
+    ('自動応答: 不在にしています', '1月10日まで不在です。戻り次第対応いたします。' * 3),
+    ('Automatic reply: Out of Office', 'I am out of the office.'),
+    ('Undeliverable: 週報', '配信できませんでした'),
+    ('Re:', ''),
+    ('Fw', '了解です'),
+])
+def test_clear_non_reports_are_skipped(extractor, subject, body):
+    hints = hints_for(extractor, subject, body)
+    assert extractor.skip_reason(subject, body, hints)
+
+
+@pytest.mark.parametrize('subject, body', [
+    # 短くても週報らしい語・製品名・社員名を含むメールはモデルで判定する
+    ('週報', '特になし'),
+    ('1/6', 'TF-4060 デモ'),
+    ('Re:', '八木と同行'),
+    # リストにない表現で書かれた本文のあるメールは、語がなくてもスキップしない
+    ('今週の活動', '月曜はA社でシステムの説明、水曜は社内で資料作成を行いました。'),
+    ('', 'Visited ACME on Monday to discuss the new inspection line.'),
+])
+def test_possible_reports_are_not_skipped(extractor, subject, body):
+    hints = hints_for(extractor, subject, body)
+    assert extractor.skip_reason(subject, body, hints) is None
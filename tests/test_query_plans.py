@@ -0,0 +1,141 @@
+"""
+APIのクエリがインデックスを使うことの確認（EXPLAIN QUERY PLAN）
+
+テストクライアントで各APIを呼び、実際に実行された SELECT 文の実行計画を調べる。
+weekly_reports・集計テーブルを全件走査（インデックスなしの SCAN）するクエリがあれば失敗する。
+"""
+
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+import report_db  # noqa: E402
+
+# インデックスなしで走査してはいけないテーブル
+LARGE_TABLES = ('weekly_reports', 'mail_summaries', 'report_rollups')
+
+FULL_SCAN = re.compile(rf'^SCAN ({"|".join(LARGE_TABLES)})$')
+
+MAILS = 200
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'weekly_reports.db')
+    conn = report_db.connect(db_file)
+    report_db.migrate(conn)
+    rows = []
+    for i in range(MAILS):
+        for j in range(3):
+            rows.append((f'm{i:04d}', f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}', f'報告者{i % 7}',
+                         f'客先{(i + j) % 13}, 客先{j}', f'社員{j}', f'TF-{2000 + (i + j) % 9}', f'内容{i}-{j} 訪問しました'))
+    conn.executemany('''
+        INSERT INTO weekly_reports (mail_id, report_date, reporter, client_name, employee_name, product_name, content)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    for report_id, client_name, product_name in conn.execute(
+            'SELECT id, client_name, product_name FROM weekly_reports').fetchall():
+        report_db.sync_facets(conn, report_id, client_name, product_name)
+    for i in range(MAILS):
+        report_db.refresh_mail_summary(conn, f'm{i:04d}')
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+    # 実行された文を記録する接続プールに差し替える
+    statements = []
+    pool = report_db.ConnectionPool(db_file, row_factory=sqlite3.Row)
+    open_conn = pool._open
+
+    def traced_open():
+        conn = open_conn()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(pool, '_open', traced_open)
+    monkeypatch.setattr(app_module, 'DATABASE', db_file)
+    monkeypatch.setattr(app_module, 'db_pool', pool)
+    monkeypatch.setattr(app_module, 'search_index_enabled', None)
+    app_module.init_db()
+    app_module.response_cache.clear()
+
+    explain_conn = report_db.connect(db_file)
+    yield app_module.app.test_client(), statements, explain_conn
+    explain_conn.close()
+    pool.close_all()
+
+
+def query_plan(conn, sql):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def select_plans(conn, statements):
+    """実行された SELECT 文ごとの実行計画"""
+    plans = {}
+    for sql in statements:
+        if sql.lstrip().upper().startswith(('SELECT', 'WITH')) and 'sqlite_master' not in sql:
+            plans[sql] = query_plan(conn, sql)
+    return plans
+
+
+def cursor_after(test_client, url):
+    return test_client.get(url).get_json()['next_cursor']
+
+
+API_CASES = [
+    ('list', '/api/reports?per_page=20', ['idx_mail_summaries_date']),
+    ('list_without_total', '/api/reports?per_page=20&include_total=0', ['idx_mail_summaries_date']),
+    ('reporter_filter', '/api/reports?reporter=報告者1', ['idx_weekly_reports_reporter']),
+    ('date_range', '/api/reports?date_from=2024-03-01&date_to=2024-03-31', ['idx_weekly_reports_date']),
+    ('client_filter', '/api/reports?client=客先3', ['report_clients']),
+    ('product_filter', '/api/reports?product=TF-2003', ['report_products']),
+    ('search', '/api/reports?search=内容12', ['weekly_reports_fts']),
+    ('mail_detail', '/api/mail_detail/m0010', ['idx_weekly_reports_mail_id']),
+    ('reporters', '/api/reporters', ['idx_weekly_reports_reporter']),
+    ('clients', '/api/clients', ['report_clients']),
+    ('products', '/api/products', ['report_products']),
+    ('client_projects', '/api/client_projects/客先3', ['report_clients']),
+    ('product_projects', '/api/product_projects/TF-2003', ['report_products']),
+    ('stats', '/api/stats', ['report_rollups']),
+    ('stats_range', '/api/stats?date_from=2024-01-01&date_to=2024-06-30', ['idx_report_rollups_day']),
+    ('export_filtered', '/api/export?reporter=報告者2', ['idx_weekly_reports_reporter']),
+    ('export_csv_date_range', '/api/export?format=csv&date_from=2024-05-01', ['idx_weekly_reports_date']),
+]
+
+
+@pytest.mark.parametrize('name, url, expected', API_CASES, ids=[case[0] for case in API_CASES])
+def test_api_queries_use_indexes(client, name, url, expected):
+    test_client, statements, conn = client
+    response = test_client.get(url)
+    assert response.status_code == 200
+    response.get_data()
+    plans = select_plans(conn, statements)
+    assert plans, f'{name}: SELECT文が実行されていません'
+
+    steps = [step for plan in plans.values() for step in plan]
+    for sql, plan in plans.items():
+        assert not any(FULL_SCAN.match(step) for step in plan), (sql, plan)
+    for index in expected:
+        assert any(index in step for step in steps), (index, plans)
+
+
+def test_cursor_query_searches_date_index(client):
+    test_client, statements, conn = client
+    next_cursor = cursor_after(test_client, '/api/reports?per_page=20&include_total=0')
+    statements.clear()
+    response = test_client.get(f'/api/reports?per_page=20&include_total=0&cursor={next_cursor}')
+    assert response.status_code == 200
+    steps = [step for plan in select_plans(conn, statements).values() for step in plan]
+    assert any(step.startswith('SEARCH mail_summaries USING') and 'idx_mail_summaries_date' in step
+               for step in steps), steps
+
+
+def test_schema_is_current(client):
+    _, _, conn = client
+    assert report_db.schema_version(conn) == report_db.SCHEMA_VERSION
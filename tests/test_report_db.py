@@ -0,0 +1,29 @@
+"""
+スキーマのマイグレーション（report_db.migrate）のテスト
+"""
+
+import report_db
+
+
+def test_search_index_is_created_once_fts5_becomes_available(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'weekly_reports.db')
+    conn = report_db.connect(db_file)
+    with monkeypatch.context() as patch:
+        # FTS5/trigram が使えない SQLite
+        patch.setattr(report_db, 'fts_supported', lambda conn: False)
+        assert report_db.migrate(conn) is False
+    assert report_db.schema_version(conn) == report_db.SCHEMA_VERSION
+    assert not report_db.table_exists(conn, report_db.FTS_TABLE)
+
+    conn.execute('''
+        INSERT INTO weekly_reports (mail_id, report_date, reporter, client_name, content)
+        VALUES ('m1', '2025-01-06', '西田', 'ホンダ', 'TF-4060のデモを実施')
+    ''')
+    conn.commit()
+
+    # 使えるようになったら次の migrate で作成し、既存の行も検索できる
+    assert report_db.migrate(conn) is True
+    sql, params = report_db.search_condition('デモを実施')
+    assert conn.execute(f'SELECT mail_id FROM weekly_reports WHERE 1 = 1{sql}', params).fetchall() == [('m1',)]
+    assert report_db.migrate(conn) is True
+    conn.close()
@@ -0,0 +1,107 @@
+"""
+解析結果のバッチ書き込み（report_writer.py）のテスト
+"""
+
+import sqlite3
+import time
+
+import pytest
+
+import report_db
+import report_writer
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / 'weekly_reports.db')
+    conn = report_db.connect(path)
+    report_db.migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = report_db.connect(db_file)
+    yield conn
+    conn.close()
+
+
+def rows_for(mail_id, count=2):
+    return [(mail_id, '2025-01-06', '西田', f'客先{i}', None, None, '藤原', 'TF-4060', f'{mail_id} 内容{i}')
+            for i in range(count)]
+
+
+def committed(db_file):
+    """別の接続から見える (報告行数, 処理済みメール数)"""
+    other = report_db.connect(db_file)
+    try:
+        return (other.execute('SELECT COUNT(*) FROM weekly_reports').fetchone()[0],
+                other.execute('SELECT COUNT(*) FROM processed_mails').fetchone()[0])
+    finally:
+        other.close()
+
+
+def test_mails_are_committed_together_in_batches(db_file, conn):
+    writer = report_writer.ReportWriter(conn, prompt_version='2', max_mails=3, max_seconds=60)
+    assert writer.add('m1', rows_for('m1'), 'registered') == 0
+    assert writer.add('m2', [], 'skipped') == 0
+    assert committed(db_file) == (0, 0)
+
+    assert writer.add('m3', rows_for('m3', 3), 'registered') == 3
+    assert committed(db_file) == (5, 3)
+    assert writer.flush_count == 1
+    counts = dict(conn.execute('SELECT mail_id, report_count FROM processed_mails'))
+    assert counts == {'m1': 2, 'm2': 0, 'm3': 3}
+
+    writer.add('m4', rows_for('m4'), 'registered')
+    assert writer.close() == 1
+    assert committed(db_file) == (7, 4)
+
+
+def test_row_threshold_flushes_large_mails(db_file, conn):
+    writer = report_writer.ReportWriter(conn, max_mails=100, max_rows=4, max_seconds=60)
+    assert writer.add('m1', rows_for('m1', 5), 'registered') == 1
+    assert committed(db_file) == (5, 1)
+
+
+def test_flush_if_due_writes_after_max_seconds(db_file, conn):
+    writer = report_writer.ReportWriter(conn, max_mails=100, max_seconds=0.05)
+    assert writer.flush_if_due() == 0
+    writer.add('m1', rows_for('m1'), 'registered')
+    assert writer.flush_if_due() == 0
+    assert committed(db_file) == (0, 0)
+
+    time.sleep(0.06)
+    # 次のメールが届かなくても、時間のしきい値を過ぎたら書き込む
+    assert writer.flush_if_due() == 1
+    assert committed(db_file) == (2, 1)
+    assert writer.pending == 0
+    assert writer.flush_if_due() == 0
+
+
+def test_failed_flush_rolls_back_and_keeps_the_buffer(db_file, conn):
+    writer = report_writer.ReportWriter(conn, max_mails=100, max_seconds=60)
+    writer.add('m1', rows_for('m1'), 'registered')
+    writer.flush()
+
+    # 再処理で m1 を置き換えるバッチの途中で失敗しても、以前の行と処理状態は残る
+    writer.add('m1', rows_for('m1', 3), 'registered')
+    writer.add('m2', [('m2', '2025-01-06')], 'registered')
+    with pytest.raises(sqlite3.ProgrammingError):
+        writer.flush()
+    assert committed(db_file) == (2, 1)
+    assert not conn.in_transaction
+    # バッファは残る（close() や次のフラッシュで再試行できる）
+    assert writer.pending == 2
+
+
+def test_failure_records_do_not_touch_registered_rows(db_file, conn):
+    writer = report_writer.ReportWriter(conn, max_mails=100, max_seconds=60)
+    writer.add('m1', rows_for('m1'), 'registered')
+    writer.flush()
+    writer.add('m1', [], 'failed', error='503')
+    writer.close()
+    assert committed(db_file) == (2, 1)
+    status, error = conn.execute('SELECT status, last_error FROM processed_mails').fetchone()
+    assert (status, error) == ('failed', '503')
@@ -0,0 +1,36 @@
+"""
+再処理（reprocess）の対象選択と中断後の再開のテスト
+"""
+
+import fake_services
+import report_db
+from weekly_report_processor import REPROCESS_STATE_KEY
+
+
+def test_mails_processed_just_before_the_start_are_targets(make_processor):
+    source = fake_services.FakeMailSource(3)
+    make_processor(['sync'], mail_source=source).run()
+    # 処理日時が再処理の開始と同じ秒（ミリ秒なしの古い形式を含む）でも対象になる
+    conn = make_processor(['status']).conn
+    conn.execute("UPDATE processed_mails SET processed_at = datetime('now') "
+                 "WHERE mail_id = (SELECT MIN(mail_id) FROM processed_mails)")
+    conn.commit()
+
+    summary = make_processor(['reprocess'], mail_source=source).run()
+    assert summary['done'] == 3
+
+
+def test_interrupted_reprocess_resumes_where_it_stopped(make_processor):
+    source = fake_services.FakeMailSource(5)
+    make_processor(['sync'], mail_source=source).run()
+
+    processor = make_processor(['reprocess', '--limit', '2'], mail_source=source)
+    assert processor.run()['done'] == 2
+    assert report_db.get_sync_state(processor.conn, REPROCESS_STATE_KEY)
+
+    # 同じ条件で再実行すると、残りの3通だけを処理して完了する
+    processor = make_processor(['reprocess'], mail_source=source)
+    assert processor.run()['done'] == 3
+    assert report_db.get_sync_state(processor.conn, REPROCESS_STATE_KEY) is None
+    processed_at = [row[0] for row in processor.conn.execute('SELECT processed_at FROM processed_mails')]
+    assert all('.' in value for value in processed_at)
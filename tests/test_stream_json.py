@@ -0,0 +1,94 @@
+"""
+ストリーミング出力の逐次JSONパーサー（stream_json.py）のテスト
+"""
+
+import json
+
+import pytest
+
+import fake_services
+import stream_json
+import weekly_report_processor
+
+REPORTS = [
+    {"客先名": "ホンダ", "案件内容": "TF-4060 {デモ} を実施 [第2回]", "製品名": ["TF-4060"]},
+    {"客先名": "日立", "案件内容": "引用 \"見積\" と \\ 区切り\nと改行 }] を含む", "製品名": []},
+]
+OUTPUT = json.dumps({"週報判定": True, "報告者": "西田", "報告日": "2025-01-06", "報告内容": REPORTS},
+                    ensure_ascii=False, indent=2)
+
+
+def feed_all(parser, text, size):
+    for start in range(0, len(text), size):
+        if parser.feed(text[start:start + size]):
+            return True
+    return False
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, len(OUTPUT)])
+def test_split_chunks_give_the_same_result(size):
+    received = []
+    parser = stream_json.ReportStreamParser(on_report=received.append)
+    assert feed_all(parser, '```json\n' + OUTPUT + '\n```', size) is False
+    assert parser.result() == json.loads(OUTPUT)
+    assert received == REPORTS
+
+
+def test_braces_and_escapes_inside_strings_do_not_close_values():
+    received = []
+    parser = stream_json.ReportStreamParser(on_report=received.append)
+    # 最初の報告の途中（文字列中の } の直後）までは報告が確定しない
+    cut = OUTPUT.index('}] を含む') + 2
+    feed_all(parser, OUTPUT[:cut], 1)
+    assert received == REPORTS[:1]
+    feed_all(parser, OUTPUT[cut:], 1)
+    assert received == REPORTS
+    assert parser.result()["報告内容"][1]["案件内容"] == REPORTS[1]["案件内容"]
+
+
+def test_not_report_verdict_stops_early():
+    parser = stream_json.ReportStreamParser()
+    assert feed_all(parser, '{"週報判定": false, "報告者": null, "報告内容": [', 4) is True
+    assert parser.result() == {"週報判定": False}
+
+
+def test_non_object_item_stops_incremental_parsing():
+    received = []
+    parser = stream_json.ReportStreamParser(on_report=received.append)
+    text = '{"週報判定": true, "報告内容": [{"客先名": "A"}, "メモ", {"客先名": "B"}]}'
+    feed_all(parser, text, 3)
+    assert parser.broken
+    assert received == [{"客先名": "A"}]
+    with pytest.raises(ValueError):
+        parser.result()
+    # 呼び出し側が全文を解析し直せるよう、受け取った出力はすべて残る
+    assert parser.text == text
+
+
+def test_truncated_stream_is_not_a_result():
+    received = []
+    parser = stream_json.ReportStreamParser(on_report=received.append)
+    feed_all(parser, OUTPUT[:OUTPUT.index('"日立"')], 5)
+    assert received == REPORTS[:1]
+    assert not parser.closed
+    with pytest.raises(ValueError):
+        parser.result()
+
+
+def test_streamed_reports_become_rows_in_the_analysis_stage(make_processor, monkeypatch):
+    converted = []
+    report_fields = weekly_report_processor.report_fields
+
+    def counting_report_fields(report):
+        converted.append(report)
+        return report_fields(report)
+
+    monkeypatch.setattr(weekly_report_processor, 'report_fields', counting_report_fields)
+    analyzer = fake_services.FakeAnalyzer(stream_chunk_chars=5, reports_per_mail=3)
+    processor = make_processor(['sync'], mail_source=fake_services.FakeMailSource(4), analyzer=analyzer)
+    summary = processor.run()
+    assert summary['registered'] == 4
+    # 逐次解析で届いた報告は1回だけ変換され、そのまま登録される
+    rows = processor.conn.execute('SELECT mail_id, client_name, content FROM weekly_reports').fetchall()
+    assert len(rows) == len(converted) == 12
+    assert sorted(row[2] for row in rows) == sorted(report["案件内容"] for report in converted)
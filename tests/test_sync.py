@@ -0,0 +1,81 @@
+"""
+差分同期（sync）の同期位置と失敗したメールの再試行のテスト
+"""
+
+import base64
+
+import analysis
+import fake_services
+import report_db
+from weekly_report_processor import HISTORY_ID_KEY
+
+
+def mailbox_with_broken_mail(count, broken_index):
+    """broken_index 番目のメールの本文が UTF-8 として不正で、毎回解析に失敗するメールボックス"""
+    source = fake_services.FakeMailSource(count)
+    messages = source.fake_service.messages
+    broken_id = sorted(messages)[broken_index]
+    part = messages[broken_id]['payload']['parts'][0]
+    part['body']['data'] = base64.urlsafe_b64encode(b'\xff\xfe\x80 broken').decode('ascii')
+    return source, broken_id
+
+
+def add_mail(source, msg_id):
+    source.fake_service.add_message(msg_id, '週報 2025/03/03 西田', '西田 <n@example.com>',
+                                    'Mon, 03 Mar 2025 09:00:00 +0900', '今週の活動報告です。\nTF-4060のデモを実施。\n')
+
+
+def sync(make_processor, source):
+    processor = make_processor(['sync'], mail_source=source)
+    return processor, processor.run()
+
+
+def failed_attempts(conn, mail_id):
+    return conn.execute(
+        'SELECT status, failed_attempts FROM processed_mails WHERE mail_id = ?', (mail_id,)
+    ).fetchone()
+
+
+def test_checkpoint_advances_when_a_mail_fails(make_processor):
+    source, broken_id = mailbox_with_broken_mail(4, 1)
+    processor, summary = sync(make_processor, source)
+    assert summary['failed'] == 1
+    assert report_db.get_sync_state(processor.conn, HISTORY_ID_KEY) == str(source.fake_service.history_id)
+    assert failed_attempts(processor.conn, broken_id) == ('failed', 1)
+
+
+def test_failed_mail_is_retried_until_the_cap(make_processor):
+    source, broken_id = mailbox_with_broken_mail(3, 0)
+    sync(make_processor, source)
+
+    # 次の差分には新着メールだけが含まれるが、失敗したメールも再試行される
+    add_mail(source, 'f000000000000001')
+    processor, summary = sync(make_processor, source)
+    assert summary['done'] == 1 and summary['failed'] == 1
+    assert failed_attempts(processor.conn, broken_id) == ('failed', 2)
+    assert report_db.get_sync_state(processor.conn, HISTORY_ID_KEY) == str(source.fake_service.history_id)
+
+    for attempt in range(3, report_db.MAX_FAILED_ATTEMPTS + 1):
+        processor, summary = sync(make_processor, source)
+        assert summary['failed'] == 1
+        assert failed_attempts(processor.conn, broken_id) == ('failed', attempt)
+
+    # 上限に達したら自動では再試行しない
+    processor, summary = sync(make_processor, source)
+    assert summary['failed'] == 0 and summary['done'] == 0
+    assert processor.show_status()['failed_gave_up'] == 1
+
+
+def test_recovered_mail_resets_failed_attempts(make_processor, monkeypatch):
+    monkeypatch.setattr(analysis, 'ANALYSIS_MAX_RETRIES', 0)
+    source = fake_services.FakeMailSource(1)
+    (mail_id,) = source.fake_service.messages
+    broken = fake_services.FakeAnalyzer(responses=['壊れた応答'])
+    processor = make_processor(['sync'], mail_source=source, analyzer=broken)
+    assert processor.run()['failed'] == 1
+    assert failed_attempts(processor.conn, mail_id) == ('failed', 1)
+
+    # 解析できるようになったメールは再試行で登録され、失敗回数が戻る
+    processor, summary = sync(make_processor, source)
+    assert summary['failed'] == 0 and summary['done'] == 1
+    assert failed_attempts(processor.conn, mail_id) == ('registered', 0)
@@ -1,29 +1,46 @@
+"""
+週報メールの解析・DB登録
+
+コマンドラインからは main() のサブコマンドとして実行する（`python weekly_report_processor.py --help`）。
+Webアプリ等から同じプロセス内で実行する場合は WeeklyReportProcessor を使う:
+
+    options = weekly_report_processor.parse_args(['sync'])
+    with weekly_report_processor.WeeklyReportProcessor(options, out=log_file) as processor:
+        summary = processor.run()
+
+モジュールの読み込み時には何も実行しない。GoogleのSDK（Gmail・Vertex AI）は実際に使う時点で読み込み、
+認証も最初にGmailへアクセスする時点で行うため、status / stats はすぐに終わる。
+"""
+
+import argparse
+import io
 import os
-import pickle
-import base64
 import json
-import sqlite3
 import time
 import warnings
 import sys
 import re
-
-# Windows での UTF-8 出力を強制
-if sys.platform == 'win32':
-    import codecs
-    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
-    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
+import shutil
+import signal
+import tempfile
+import threading
 
 # Vertex AI SDK 非推奨警告を抑制
 warnings.filterwarnings("ignore", category=UserWarning, module="vertexai.generative_models._generative_models")
 warnings.filterwarnings("ignore", message="This feature is deprecated.*")
 warnings.filterwarnings("ignore", message=".*deprecated as of June 24, 2025.*")
 
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.cloud import aiplatform
-import vertexai
-from vertexai.generative_models import GenerativeModel
+import analysis
+import analysis_cache
+import backends
+import gmail_source
+import ingest_jobs
+import mail_archive
+import pre_extract
+import report_db
+import report_writer
+import stage_metrics
+import stream_json
 
 # --------------------
 # 設定
@@ -32,7 +49,23 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 PROJECT_ID = "weekly-report-system-470606"  # Google Cloud プロジェクトID
 LOCATION = "us-central1"     # Vertex AI ロケーション（米国中央）
 DB_FILE = "weekly_reports.db"    # SQLite DBファイル
-PROCESSED_FILE = "processed_ids.json"
+PROCESSED_FILE = "processed_ids.json"    # 旧形式の処理済みID（初回のみDBに取り込む）
+MODEL_NAME = "gemini-2.0-flash"    # 解析に使うモデル
+ANALYSIS_CACHE_FILE = "analysis_cache.db"    # 解析結果のキャッシュ（デプロイ対象外）
+ARCHIVE_FILE = "mail_archive.db"    # 取得したメールのアーカイブ（デプロイ対象外）
+PROMPT_VERSION = "2"    # 解析プロンプトや各リストを変更したら上げる（processed_mails に記録）
+HISTORY_ID_KEY = "gmail_history_id"   # 差分同期の基準となるhistoryIdの保存キー
+REPROCESS_STATE_KEY = "reprocess_checkpoint"   # 未完了の再処理（条件と開始時刻）の保存キー
+
+# サブコマンド（引数なしで実行した場合は sync）
+COMMANDS = ('sync', 'status', 'reprocess', 'replay', 'stats', 'benchmark')
+DEFAULT_COMMAND = 'sync'
+
+# メールの取得・解析を行うサブコマンド
+PIPELINE_COMMANDS = ('sync', 'reprocess', 'replay', 'benchmark')
+
+# ジョブとして登録し、同時に1つしか実行しないサブコマンド（benchmark は一時DBを使うため対象外）
+JOB_COMMANDS = ('sync', 'reprocess', 'replay')
 
 # 報告者リスト（敬称なし）
 REPORTER_LIST = ["西田","村田","田村","上島","藤原","柳澤","八木"]
@@ -46,105 +79,124 @@ PRODUCT_LIST = ["DMA-03","PDL-06-SA","PDL-06","DPA-06","TF-3020","TF-3040","TFG-
                "TF-90100","M3D-EL-FP-U","M3D-EL-W","M3D-EL-FP-A","TF-2020","HapLog","YAWASA","ゆびレコーダー","シートトレーサー",
                "IMS-SD","TRC","WTRC","VibraScope","ステアリングセンサ","野球ボールセンサ","FP内蔵ピッチャーマウンド","DSS300-HR","DLR1200","トレッドミル"]
 
-# --------------------
-# Gmail 認証
-# --------------------
-creds = None
-if os.path.exists('token.pkl'):
-    with open('token.pkl', 'rb') as token_file:
-        creds = pickle.load(token_file)
 
-if not creds or not creds.valid:
-    flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-    creds = flow.run_local_server(port=0)
-    with open('token.pkl', 'wb') as token_file:
-        pickle.dump(creds, token_file)
+class ProcessorError(Exception):
+    """処理を続けられないエラー（コマンドラインでは終了コード1になる）"""
 
-service = build('gmail', 'v1', credentials=creds)
 
-# --------------------
-# Vertex AI 初期化
-# --------------------
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "vertex-key.json"
-vertexai.init(project=PROJECT_ID, location=LOCATION)
-model = GenerativeModel("gemini-2.0-flash")
+class Cancelled(Exception):
+    """ジョブのキャンセル要求による中断"""
 
-# --------------------
-# DB初期化
-# --------------------
-conn = sqlite3.connect(DB_FILE)
-c = conn.cursor()
-c.execute('''
-CREATE TABLE IF NOT EXISTS weekly_reports (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    mail_id TEXT,
-    report_date TEXT,
-    reporter TEXT,
-    client_name TEXT,
-    client_department TEXT,
-    client_person TEXT,
-    employee_name TEXT,
-    product_name TEXT,
-    content TEXT
-)
-''')
-conn.commit()
 
 # --------------------
-# 処理済みID読み込み
+# コマンドライン引数
 # --------------------
-if os.path.exists(PROCESSED_FILE):
-    with open(PROCESSED_FILE, 'r', encoding='utf-8') as f:
-        processed_ids = set(json.load(f))
-else:
-    processed_ids = set()
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Gmailの週報メールを解析してDBに登録',
+        epilog=f'サブコマンドを省略した場合は {DEFAULT_COMMAND} を実行する'
+    )
+    commands = parser.add_subparsers(dest='command', metavar='{' + ','.join(COMMANDS) + '}')
 
-# --------------------
-# 週報ラベルID取得
-# --------------------
-labels = service.users().labels().list(userId='me').execute().get('labels', [])
-label_id = next((l['id'] for l in labels if l['name'] == '週報'), None)
-if not label_id:
-    print("ラベル「週報」が見つかりません")
-    exit()
+    # メールを解析するサブコマンドに共通のオプション
+    pipeline = argparse.ArgumentParser(add_help=False)
+    pipeline.add_argument('--flush-mails', type=int, default=report_writer.WRITE_BATCH_MAILS,
+                          help='何通分の解析結果をまとめてDBに書き込むか')
+    pipeline.add_argument('--flush-seconds', type=float, default=report_writer.WRITE_BATCH_SECONDS,
+                          help='解析結果をバッファしておく最大秒数')
+    pipeline.add_argument('--no-cache', action='store_true',
+                          help='解析結果のキャッシュを使わずに必ずモデルを呼ぶ')
+    pipeline.add_argument('--no-prefilter', action='store_true',
+                          help='明らかに週報でないメールの事前判定（モデルを呼ばずにスキップ）を行わない')
+    pipeline.add_argument('--no-stream', action='store_true',
+                          help='ストリーミング生成を使わず、応答全体を受け取ってから解析する')
+    pipeline.add_argument('--concurrency', type=int, default=analysis.ANALYSIS_CONCURRENCY,
+                          help='同時に実行する解析リクエスト数')
+    pipeline.add_argument('--batch-size', type=int, default=1,
+                          help='1回の解析リクエストにまとめる最大メール数（1でバッチ解析を行わない。推奨 %d）'
+                               % analysis.ANALYSIS_BATCH_SIZE)
+    pipeline.add_argument('--batch-max-bytes', type=int, default=analysis.ANALYSIS_BATCH_MAX_BYTES,
+                          help='1回の解析リクエストにまとめるメール本文の合計バイト数（UTF-8）の上限（日本語は1文字約3バイト）')
+    pipeline.add_argument('--rate-per-minute', type=float,
+                          help='1分あたりのモデル呼び出し数の上限（0で無制限。既定は本番 %d、benchmark 無制限）'
+                               % analysis.ANALYSIS_RATE_PER_MINUTE)
+
+    # reprocess / replay の対象条件
+    targets = argparse.ArgumentParser(add_help=False)
+    targets.add_argument('--date-from', help='報告日がこの日以降（YYYY-MM-DD）')
+    targets.add_argument('--date-to', help='報告日がこの日以前（YYYY-MM-DD）')
+    targets.add_argument('--reporter', help='報告者')
+    targets.add_argument('--prompt-version', help='このプロンプトバージョンで処理されたメール')
+    targets.add_argument('--stale', action='store_true',
+                         help='現在のプロンプトバージョンより前に処理されたメール')
+    targets.add_argument('--limit', type=int, help='1回の実行で処理する最大件数')
+    targets.add_argument('--restart', action='store_true',
+                         help='未完了の再処理を破棄して最初からやり直す')
+
+    sync = commands.add_parser('sync', parents=[pipeline], help='新着メールを処理（既定）')
+    sync.add_argument('--full', action='store_true',
+                      help='前回のhistoryIdを使わずに週報ラベルの全メールを一覧する')
+    commands.add_parser('status', help='同期位置・処理状態・未完了の再処理を表示（Gmailにはアクセスしない）')
+    commands.add_parser('reprocess', parents=[pipeline, targets],
+                        help='処理済みメールを現在のプロンプトで再解析')
+    commands.add_parser('replay', parents=[pipeline, targets],
+                        help='reprocess と同じだが、Gmailにアクセスせずアーカイブ済みのメールだけを再解析')
+    commands.add_parser('stats', help='登録済みの週報・解析キャッシュ・アーカイブの統計を表示')
+
+    benchmark = commands.add_parser('benchmark', parents=[pipeline],
+                                    help='合成メールボックスとフェイクのモデルで処理性能を計測')
+    benchmark.add_argument('--mails', type=int, default=500, help='合成メールボックスのメール数')
+    benchmark.add_argument('--mail-latency', type=float, default=0.05, help='Gmail APIの1往復の遅延（秒）')
+    benchmark.add_argument('--model-latency', type=float, default=0.2, help='モデル呼び出しの遅延（秒）')
+    benchmark.add_argument('--error-rate', type=float, default=0.0, help='一時的なエラーの発生率（0〜1）')
+    benchmark.add_argument('--skip-rate', type=float, default=0.1, help='週報ではないと判定されるメールの割合')
+    benchmark.add_argument('--seed', type=int, default=0, help='エラー・判定を決める乱数のシード')
+    return parser
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析する（argv を省略すると sys.argv を使う）"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv.insert(0, DEFAULT_COMMAND)
+    return build_parser().parse_args(argv)
 
-# --------------------
-# 週報メールID取得
-# --------------------
-all_messages = []
-page_token = None
-while True:
-    results = service.users().messages().list(
-        userId='me',
-        labelIds=[label_id],
-        pageToken=page_token
-    ).execute()
-    msgs = results.get('messages', [])
-    all_messages.extend(msgs)
-    page_token = results.get('nextPageToken')
-    if not page_token:
-        break
-
-# 最新順
-all_messages.sort(key=lambda x: int(x['id'], 16), reverse=True)
-
-# 処理状況の表示
-print(f"週報ラベルのメール: {len(all_messages)}件")
-print(f"処理済み: {len(processed_ids)}件")
-print(f"未処理: {len(all_messages) - len(processed_ids)}件")
-print("\n週報処理を開始します...\n")
 
 # --------------------
-# AI解析関数
+# 解析プロンプト
 # --------------------
-def process_weekly_report(subject, body, sender, date):
-    prompt = f"""
-このメールを解析して、純粋なJSON形式のみで出力してください。
+def build_hint_sections(hints):
+    """事前抽出の結果から、プロンプトに渡すリスト部分を作る（そのメールに関係する項目だけ）"""
+    sections = []
+    if hints['reporter']:
+        sections.append(f"報告者（送信者から判定済み。本文で別の報告者が明記されていない限りこの名前を使用）：\n{hints['reporter']}")
+    else:
+        sections.append(f"報告者リスト（この中から報告者を特定）：\n{','.join(REPORTER_LIST)}")
+
+    if hints['employees']:
+        sections.append(f"本文中の社員名（同行社員の特定用）：\n{','.join(hints['employees'])}")
+    else:
+        sections.append("同行社員名：本文中に社員名は見つかりませんでした。記載があれば記載されたとおりに記録してください")
+
+    if hints['products']:
+        sections.append(f"本文中の製品名（該当する製品名はこの正式名称で記録、それ以外は記載されたとおりに記録）：\n{','.join(hints['products'])}")
+    else:
+        sections.append("製品名：製品名リストに該当する製品は見つかりませんでした。記載されたとおりに記録してください")
+    if hints['product_numbers']:
+        aliases = '、'.join(f"「{number}」→「{name}」" for number, name in hints['product_numbers'].items())
+        sections.append(f"数字のみで記載された製品名：{aliases}")
+
+    if hints['report_date']:
+        sections.append(f"報告日が本文から判断できない場合はメール送信日（{hints['report_date']}）を使用してください")
+    return '\n\n'.join(sections)
+
+# 解析の指示（1通ずつの解析とバッチ解析で共通）
+PROMPT_INSTRUCTIONS = """純粋なJSON形式のみで出力してください。
 マークダウンや```記号は使わないでください。
 **重要**: JSON内の文字列では、改行は必ず\\nとしてエスケープしてください。実際の改行文字を含めないでください。
-案件内容は1つの文字列として出力し、改行が必要な場合は\\nを使用してください。
+案件内容は1つの文字列として出力し、改行が必要な場合は\\nを使用してください。"""
 
-重要な変換ルール：
+PROMPT_RULES = """重要な変換ルール：
 - 客先名は必ず簡略化すること
   例：本田技研工業株式会社→ホンダ、トヨタ自動車株式会社→トヨタ、
       株式会社日立製作所→日立、ソニー株式会社→ソニー、
@@ -157,44 +209,64 @@ def process_weekly_report(subject, body, sender, date):
   - IMS-SD-H-*: IMS-SD
 
 出力形式：
-{{
+{
   "週報判定": true/false,
   "報告者": "報告者名（報告者リストから選択、敬称不要）",
   "報告日": "YYYY-MM-DD形式",
   "報告内容": [
-    {{
+    {
       "客先名": "客先名（必ず簡略化・通称を使用）",
       "客先部署名": "客先部署名",
       "客先担当者名": "客先担当者名（敬称不要）",
       "同行社員名": "同行社員名（社員名リストから）",
       "製品名": "製品名",
       "案件内容": "案件内容"
-    }}
+    }
   ]
-}}
+}"""
 
-報告者リスト（この中から報告者を特定）：
-{','.join(REPORTER_LIST)}
+# バッチ解析で各メールの区切りに使う見出し
+BATCH_MAIL_HEADER = "=== メールID: {mail_id} ==="
 
-社員名リスト（同行社員の特定用）：
-{','.join(EMPLOYEE_LIST)}
+def mail_section(subject, body, sender, date):
+    return f"""メール送信者: {sender}
+メール送信日: {date}
+メール件名: {subject}
+メール本文: {body}"""
 
-製品名リスト（この中から該当する製品名を選択、なければ記載されたとおりに記録）：
-{','.join(PRODUCT_LIST)}
+def build_prompt(subject, body, sender, date, hints):
+    """1通分の解析プロンプト"""
+    return f"""
+このメールを解析して、{PROMPT_INSTRUCTIONS}
 
-製品名検出のルール：
-- 数字のみ（例：2020、3040、4060等）が製品名として記載されている場合は、TF-やDSA-等のプレフィックスを付けて製品名リストと照合してください
-- 例：「2020」→「TF-2020」、「3040」→「TF-3040」として製品名リストにあるか確認
-- リストに一致するものがあればその正式名称を使用し、なければ記載されたとおりに記録してください
+{PROMPT_RULES}
 
-メール送信者: {sender}
-メール送信日: {date}
-メール件名: {subject}
-メール本文: {body}
+{build_hint_sections(hints)}
+
+{mail_section(subject, body, sender, date)}
 """
-    response = model.generate_content(prompt)
-    content = response.text
-    
+
+def build_batch_prompt(entries):
+    """複数メールをまとめた解析プロンプト（entries は (メールID, メール, ヒント) のリスト）"""
+    mails = "\n\n".join(
+        f"{BATCH_MAIL_HEADER.format(mail_id=mail_id)}\n{build_hint_sections(hints)}\n\n"
+        f"{mail_section(message['subject'], message['body'], message['sender'], message['date'])}"
+        for mail_id, message, hints in entries
+    )
+    return f"""
+以下の{len(entries)}通のメールをそれぞれ解析して、{PROMPT_INSTRUCTIONS}
+
+{PROMPT_RULES}
+
+複数のメールを解析するため、メールIDをキー、各メールの解析結果（上記の出力形式）を値とする1つのJSONオブジェクトを出力してください。
+例：{{"メールID1": {{"週報判定": true, ...}}, "メールID2": {{"週報判定": false}}}}
+すべてのメールIDについて必ず結果を出力してください。
+
+{mails}
+"""
+
+def parse_model_output(content):
+    """モデルの出力テキストをJSONとして解析"""
     # マークダウンのコードブロック記号を除去
     if content.startswith('```'):
         content = content.split('\n', 1)[1]
@@ -208,141 +280,808 @@ def process_weekly_report(subject, body, sender, date):
     try:
         return json.loads(content)
     except json.JSONDecodeError as e:
-        print(f"JSON解析エラー: {e}")
-        return None
+        # 再試行対象（モデルの出力は毎回異なるため）
+        raise analysis.AnalysisError(f"JSON解析エラー: {e}")
 
 # --------------------
 # DB登録関数
 # --------------------
-def db_insert(mail_id, report_date, reporter, report):
+def report_fields(report):
+    """報告内容1件を weekly_reports の客先名〜案件内容の列の値に変換"""
     # リスト型のフィールドをカンマ区切りの文字列に変換
     product_name = report.get("製品名")
     if isinstance(product_name, list):
         product_name = ", ".join(product_name)
-    
+
     client_person = report.get("客先担当者名")
     if isinstance(client_person, list):
         client_person = ", ".join(client_person)
-    
+
     employee_name = report.get("同行社員名")
     if isinstance(employee_name, list):
         employee_name = ", ".join(employee_name)
-    
-    c.execute('''
-    INSERT INTO weekly_reports
-    (mail_id, report_date, reporter, client_name, client_department, client_person, employee_name, product_name, content)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        mail_id,
-        report_date,
-        reporter,
+
+    return (
         report.get("客先名"),
         report.get("客先部署名"),
         client_person,
         employee_name,
         product_name,
         report.get("案件内容")
-    ))
-    conn.commit()
+    )
+
+
+def report_rows(mail_id, result, streamed=()):
+    """
+    1通分の解析結果を weekly_reports の行（INSERTの引数）のリストに変換
+
+    streamed は逐次解析で届いた (報告, report_fields() の値) のリスト。結果の報告内容が逐次解析した
+    報告そのものであれば変換済みの値を使う（全文を解析し直した場合などは変換し直す）。
+    """
+    if not result.get("週報判定"):
+        return []
+    reports = result.get("報告内容", [])
+    if len(streamed) == len(reports) and all(report is item for report, (item, _) in zip(reports, streamed)):
+        fields = [values for _, values in streamed]
+    else:
+        fields = [report_fields(report) for report in reports]
+    # 報告者・報告日はモデルが返さなかった場合にヘッダーから補うため、結果が確定してから埋める
+    return [(mail_id, result.get("報告日"), result.get("報告者")) + values for values in fields]
+
+
+class WeeklyReportProcessor:
+    """
+    週報処理の1回分の実行（サブコマンドごとの処理とそれが使う接続・キャッシュを持つ）
+
+    options は parse_args() の結果。out を指定すると進捗をそのストリームに書き込む（既定は標準出力）。
+    mail_source / analyzer を省略すると Gmail / Vertex AI を使う（benchmark ではフェイク）。
+    db_file を省略すると DB_FILE を使う。cancel_event がセットされると、解析済みの結果を書き込んで中断する。
+    progress には解析中の進捗 {'done': 処理済み件数, 'total': 対象件数} を書き込む（ジョブの進捗表示用）。
+    解析キャッシュ・メールアーカイブはメールを解析するサブコマンドの場合だけ開く。
+    """
+
+    def __init__(self, options, out=None, mail_source=None, analyzer=None, db_file=None, cancel_event=None,
+                 progress=None):
+        self.options = argparse.Namespace(**vars(options))
+        self.out = out
+        self.cancel_event = cancel_event
+        self.progress = {} if progress is None else progress
+        self.db_file = db_file or DB_FILE
+        self.archive_file = ARCHIVE_FILE
+        self.processed_file = PROCESSED_FILE
+        self.cache_file = ANALYSIS_CACHE_FILE
+        self.bench_dir = None
+
+        # --------------------
+        # バックエンド（メール取得元・解析モデル）
+        # --------------------
+        if self.options.command == 'benchmark':
+            import fake_services
+
+            # 合成メールボックスとフェイクのモデルを使い、一時ディレクトリのDBに書き込む
+            self.bench_dir = tempfile.mkdtemp(prefix='weekly_report_benchmark_')
+            self.db_file = os.path.join(self.bench_dir, DB_FILE)
+            self.archive_file = os.path.join(self.bench_dir, ARCHIVE_FILE)
+            self.processed_file = os.path.join(self.bench_dir, PROCESSED_FILE)
+            self.options.no_cache = True
+            mail_source = mail_source or fake_services.FakeMailSource(
+                self.options.mails, latency=self.options.mail_latency,
+                error_rate=self.options.error_rate, seed=self.options.seed
+            )
+            analyzer = analyzer or fake_services.FakeAnalyzer(
+                latency=self.options.model_latency, error_rate=self.options.error_rate,
+                skip_rate=self.options.skip_rate, seed=self.options.seed
+            )
+        # Gmailの認証・Vertex AIの初期化は最初に必要になった時点で行う（replay ではGmailにアクセスしない）
+        self.mail_source = mail_source or backends.GmailMailSource(scopes=SCOPES)
+        self.analyzer = analyzer or backends.VertexAnalyzer(PROJECT_ID, LOCATION, MODEL_NAME)
+
+        # 段ごとの処理時間（取得・解析・DB書き込み）
+        self.metrics = stage_metrics.StageMetrics()
+
+        # モデル呼び出しのレート制限（キャッシュヒット時はトークンを消費しない）
+        rate_per_minute = getattr(self.options, 'rate_per_minute', None)
+        if rate_per_minute is None:
+            rate_per_minute = 0 if self.options.command == 'benchmark' else analysis.ANALYSIS_RATE_PER_MINUTE
+        self.model_rate_limiter = analysis.TokenBucket(rate_per_minute / 60.0) if rate_per_minute else None
+
+        # 報告者・社員・製品のリストから作る事前抽出器（プロンプトのヒントと事前判定に使う）
+        self.extractor = pre_extract.PreExtractor(REPORTER_LIST, EMPLOYEE_LIST, PRODUCT_LIST)
+
+        # --------------------
+        # DB初期化
+        # --------------------
+        # WALモードで接続し、処理中もWebアプリからの読み取りをブロックしない
+        self.conn = report_db.connect(self.db_file)
+        report_db.migrate(self.conn)
+
+        self.result_cache = None
+        self.archive = None
+        if self.options.command in PIPELINE_COMMANDS:
+            # 同じ内容のメールは解析結果をキャッシュから返す
+            if not self.options.no_cache:
+                self.result_cache = analysis_cache.AnalysisCache(self.cache_file)
+            # 取得したメールは圧縮してアーカイブし、再処理ではGmailの代わりにアーカイブから読み出す
+            self.archive = mail_archive.MailArchive(self.archive_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.result_cache:
+            self.result_cache.close()
+        if self.archive:
+            self.archive.close()
+        self.conn.close()
+        if self.bench_dir:
+            # ベンチマーク用の一時DBは残さない
+            shutil.rmtree(self.bench_dir, ignore_errors=True)
+
+    def print(self, *values, **kwargs):
+        """進捗の表示（out に書き込む）"""
+        print(*values, file=self.out or sys.stdout, flush=True, **kwargs)
+
+    def run(self):
+        """サブコマンドを実行し、結果の概要（辞書）を返す"""
+        command = self.options.command
+        if command == 'status':
+            return self.show_status()
+        if command == 'stats':
+            return self.show_stats()
+
+        if command in ('reprocess', 'replay'):
+            summary = self.run_reprocess()
+        elif command == 'benchmark':
+            summary = self.run_benchmark()
+        else:
+            summary = self.run_sync()
+        self.print_db_stats()
+        return summary
+
+    def run_as_job(self):
+        """
+        ジョブとして登録して run() を実行する
+
+        他のジョブ（Webアプリからの実行を含む）が実行中なら ingest_jobs.JobConflict を送出する。
+        実行中はWebアプリからキャンセルできる。
+        """
+        job_id = ingest_jobs.start_job(self.conn, self.options.command)
+        self.cancel_event = self.cancel_event or threading.Event()
+        return ingest_jobs.run_job(self.db_file, job_id, self.run, self.cancel_event, self.progress)
+
+    def check_cancelled(self):
+        if self.cancel_event and self.cancel_event.is_set():
+            raise Cancelled()
+
+    # --------------------
+    # AI解析関数
+    # --------------------
+    def prepare_analysis(self, subject, body, sender, date):
+        """
+        事前抽出・事前判定・キャッシュの確認を行う
+
+        (ヒント, キャッシュキー, モデルを呼ばずに決まった結果 or None) を返す。
+        """
+        hints = self.extractor.extract(subject, body, sender, date)
+        if not self.options.no_prefilter:
+            skip_reason = self.extractor.skip_reason(subject, body, hints)
+            if skip_reason:
+                # 明らかに週報でないメールはモデルを呼ばない
+                return hints, None, {"週報判定": False, "事前判定": skip_reason}
+
+        cache_key = analysis_cache.cache_key(subject, body, sender, date, PROMPT_VERSION, self.analyzer.name)
+        if self.result_cache:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return hints, cache_key, cached
+        return hints, cache_key, None
+
+    def finish_analysis(self, result, hints, cache_key):
+        """ヘッダーから確定できる項目をモデルが返さなかった場合は補い、キャッシュに保存する"""
+        if result.get("週報判定"):
+            if not result.get("報告者") and hints['reporter']:
+                result["報告者"] = hints['reporter']
+            if not result.get("報告日") and hints['report_date']:
+                result["報告日"] = hints['report_date']
+
+        if self.result_cache:
+            self.result_cache.put(cache_key, result)
+        return result
+
+    def call_model(self, prompt):
+        if self.model_rate_limiter:
+            self.model_rate_limiter.acquire()
+        return self.analyzer.generate(prompt)
+
+    def call_model_stream(self, prompt, on_report=None):
+        """
+        ストリーミング生成でモデルを呼び、出力を届いた分ずつ解析する
+
+        「週報判定」が false と分かった時点で残りの生成を打ち切る。報告内容は要素が届くたびに解析し、
+        on_report があれば解析した報告を渡して呼ぶ。
+        逐次解析できない出力だった場合は全文を parse_model_output() で解析する。
+        """
+        if self.model_rate_limiter:
+            self.model_rate_limiter.acquire()
+        parser = stream_json.ReportStreamParser(on_report=on_report)
+        chunks = self.analyzer.generate_stream(prompt)
+        try:
+            for chunk in chunks:
+                if parser.feed(chunk):
+                    break
+        finally:
+            chunks.close()
+
+        try:
+            return parser.result()
+        except ValueError:
+            return parse_model_output(parser.text.strip())
+
+    def process_weekly_report(self, subject, body, sender, date, on_report=None):
+        """1通を解析する（on_report はストリーミング生成で報告が届くたびに呼ばれる）"""
+        hints, cache_key, result = self.prepare_analysis(subject, body, sender, date)
+        if result is not None:
+            return result
+
+        prompt = build_prompt(subject, body, sender, date, hints)
+        if self.options.no_stream:
+            result = parse_model_output(self.call_model(prompt))
+        else:
+            result = self.call_model_stream(prompt, on_report)
+        return self.finish_analysis(result, hints, cache_key)
+
+    def process_weekly_reports(self, messages):
+        """
+        複数メールを1回のモデル呼び出しで解析する（バッチ解析）
+
+        メールごとの結果のリストを返す。バッチの応答に含まれなかった・不正だったメールは
+        結果の代わりに AnalysisError を返す（解析段が1通ずつ解析し直す）。
+        """
+        results = []
+        entries = []
+        for message in messages:
+            hints, cache_key, result = self.prepare_analysis(
+                message['subject'], message['body'], message['sender'], message['date']
+            )
+            results.append(result)
+            if result is None:
+                entries.append((len(results) - 1, message, hints, cache_key))
+        if not entries:
+            return results
+
+        prompt = build_batch_prompt([(message['id'], message, hints) for _, message, hints, _ in entries])
+        output = parse_model_output(self.call_model(prompt))
+        if not isinstance(output, dict):
+            raise analysis.AnalysisError("バッチ応答がJSONオブジェクトではありません")
+
+        for index, message, hints, cache_key in entries:
+            result = output.get(message['id'])
+            if isinstance(result, dict) and "週報判定" in result:
+                results[index] = self.finish_analysis(result, hints, cache_key)
+            else:
+                results[index] = analysis.AnalysisError(f"バッチ応答にメールID {message['id']} の結果がありません")
+        return results
+
+    # --------------------
+    # 解析パイプライン
+    # --------------------
+    def analyze_message(self, msg_data):
+        """メールを解析し、登録する報告行も作る（解析段のスレッドで実行される）"""
+        message = gmail_source.parse_message(msg_data)
+        # ストリーミング生成では、届いた報告をその場で行の値に変換しておく
+        streamed = []
+
+        def on_report(report):
+            streamed.append((report, report_fields(report)))
+
+        start_time = time.time()
+        result = self.process_weekly_report(
+            message['subject'], message['body'], message['sender'], message['date'], on_report=on_report
+        )
+        rows = report_rows(message['id'], result, streamed)
+        elapsed = time.time() - start_time
+        self.metrics.record('analyze', elapsed)
+        return message, result, rows, elapsed
+
+    def analyze_messages(self, msg_datas):
+        """複数メールをまとめて解析（バッチ解析段のスレッドで実行される）"""
+        messages = [gmail_source.parse_message(msg_data) for msg_data in msg_datas]
+        start_time = time.time()
+        results = self.process_weekly_reports(messages)
+        elapsed = time.time() - start_time
+        self.metrics.record('analyze_batch', elapsed)
+        return [
+            result if isinstance(result, Exception) else (message, result, report_rows(message['id'], result), elapsed)
+            for message, result in zip(messages, results)
+        ]
+
+    def create_stage(self, concurrency):
+        """解析段を作成（--batch-size が2以上なら複数メールを1回のリクエストにまとめる）"""
+        options = dict(
+            concurrency=concurrency,
+            rate_per_minute=None,    # レート制限はモデル呼び出し時に行う（model_rate_limiter）
+            max_retries=analysis.ANALYSIS_MAX_RETRIES
+        )
+        if self.options.batch_size > 1:
+            return analysis.BatchAnalysisStage(
+                self.analyze_message,
+                self.analyze_messages,
+                batch_size=self.options.batch_size,
+                max_batch_size=self.options.batch_max_bytes,
+                # 本文をデコードせずに見積もる（メールは解析段のスレッドで1回だけ解析する）
+                size_of=gmail_source.body_size,
+                **options
+            )
+        return analysis.AnalysisStage(self.analyze_message, **options)
+
+    def print_result(self, position, msg_id, message, result, elapsed):
+        """解析結果を表示"""
+        self.print(f"\n{position} メールID: {msg_id}")
+        self.print(f"送信者: {message['sender']}")
+        self.print(f"件名: {message['subject']}")
+        self.print(f"解析時間: {elapsed:.2f}秒")
+        self.print("-"*60)
+
+        # 週報判定
+        if result.get("週報判定"):
+            self.print(f"[OK] 週報と判定されました")
+            self.print(f"  報告者: {result.get('報告者')}")
+            self.print(f"  報告日: {result.get('報告日')}")
+            self.print(f"  報告件数: {len(result.get('報告内容', []))}件")
+            self.print("-"*60)
+
+            # 各報告内容を表示
+            for i, report in enumerate(result.get("報告内容", []), 1):
+                self.print(f"\n【報告 {i}】")
+                self.print(f"  客先名: {report.get('客先名') or '-'}")
+                self.print(f"  客先部署: {report.get('客先部署名') or '-'}")
+                self.print(f"  客先担当者: {report.get('客先担当者名') or '-'}")
+                self.print(f"  同行社員: {report.get('同行社員名') or '-'}")
+                self.print(f"  製品名: {report.get('製品名') or '-'}")
+                self.print(f"  案件内容: {report.get('案件内容') or '-'}")
+
+    def save_mail_result(self, writer, mail_id, result, rows):
+        """1通分の報告行（解析段で変換済み）と処理済みの記録をバッチライターに追加する"""
+        flushed = writer.add(mail_id, rows, 'registered' if result.get("週報判定") else 'skipped')
+        if flushed:
+            self.print(f"\n[書き込み] {flushed}通分をDBに確定しました")
+
+    def fetch_messages(self, message_ids):
+        """Gmailから本文をバッチ取得・先読みし、取得したメールはアーカイブに保存する"""
+        return gmail_source.MessagePrefetcher(
+            self.mail_source.service,
+            message_ids,
+            batch_size=gmail_source.FETCH_BATCH_SIZE,
+            workers=gmail_source.FETCH_WORKERS,
+            prefetch_batches=gmail_source.FETCH_PREFETCH_BATCHES,
+            on_fetched=self.archive.put_many,
+            metrics=self.metrics
+        )
+
+    def run_pipeline(self, message_ids, writer, concurrency=analysis.ANALYSIS_CONCURRENCY, record_failures=True,
+                     offline=False):
+        """
+        メールを取得・解析してDBに登録する
+
+        アーカイブ済みのメールはアーカイブから読み出し、それ以外はGmailから取得する（offline の場合は取得しない）。
+        本文の取得は解析と並行して行い、解析は並行実行して結果はメールの順番どおりに登録する。
+        解析に失敗したメールは最後に1回だけ再試行する。
+        record_failures が True の場合、失敗したメールを processed_mails に failed として記録する。
+        {'done': 処理したメール数, 'registered': うち週報と判定されたメール数, 'failed': 失敗したメール数,
+         'interrupted': 中断されたか} を返す。
+        """
+        messages = self.archive.messages(message_ids, fetch=None if offline else self.fetch_messages)
+        stage = self.create_stage(concurrency)
+
+        counts = {'done': 0, 'registered': 0, 'failed': 0, 'interrupted': False}
+        self.progress.update(done=0, total=len(message_ids))
+
+        def register(msg_id, message, result, rows, elapsed):
+            counts['done'] += 1
+            self.progress['done'] += 1
+            position = f"[{counts['done']}/{len(message_ids)}]"
+            self.print_result(position, msg_id, message, result, elapsed)
+            # 報告行の登録と処理済みの記録（バッチ単位で1トランザクションで確定）
+            self.save_mail_result(writer, msg_id, result, rows)
+            if result.get("週報判定"):
+                counts['registered'] += 1
+                self.print("\n" + "="*60)
+                self.print(f"[完了] {position} メールID {msg_id} をDBに登録しました")
+            elif result.get("事前判定"):
+                self.print(f"[スキップ] 週報ではないと判定されました（事前判定: {result['事前判定']}）")
+                self.print("="*60)
+            else:
+                self.print(f"[スキップ] 週報ではないと判定されました")
+                self.print("="*60)
+
+        def fail(msg_id, error):
+            counts['failed'] += 1
+            self.progress['done'] += 1
+            if record_failures:
+                writer.add(msg_id, [], 'failed', error=str(error))
+
+        def flush_if_due():
+            # add() が呼ばれない間（再試行に回るメールが続く間など）も、バッファ中の分は時間のしきい値で確定する
+            flushed = writer.flush_if_due()
+            if flushed:
+                self.print(f"\n[書き込み] {flushed}通分をDBに確定しました")
+
+        # 解析に失敗したメールは再試行キューに入れ、処理済みにはしない
+        retry_queue = []
+        try:
+            for msg_id, msg_data, analyzed, error in stage.run(messages):
+                self.check_cancelled()
+                flush_if_due()
+                if isinstance(msg_data, Exception):
+                    # 取得に失敗したメールは処理済みにせず、次回の実行で再取得する
+                    self.print(f"メールID {msg_id} の取得に失敗しました: {msg_data}")
+                    fail(msg_id, msg_data)
+                    continue
+                if error is not None:
+                    self.print(f"メールID {msg_id} の解析に失敗しました（後で再試行します）: {error}")
+                    retry_queue.append((msg_id, msg_data))
+                    continue
+                register(msg_id, *analyzed)
+
+            if retry_queue:
+                self.print(f"\n解析に失敗した{len(retry_queue)}件のメールを再試行します...")
+                for msg_id, msg_data, analyzed, error in stage.run(retry_queue):
+                    self.check_cancelled()
+                    flush_if_due()
+                    if error is not None:
+                        self.print(f"メールID {msg_id} の解析に失敗しました（次回の実行で再処理します）: {error}")
+                        fail(msg_id, error)
+                        continue
+                    register(msg_id, *analyzed)
+        except (KeyboardInterrupt, Cancelled) as e:
+            # Ctrl-C（またはSIGTERM）・キャンセル要求では解析中のメールを破棄し、解析済みの分だけ書き込んで終了する
+            counts['interrupted'] = True
+            reason = 'キャンセルされました' if isinstance(e, Cancelled) else '中断されました'
+            self.print(f"\n{reason}。解析済みの結果を書き込んで終了します...")
+        finally:
+            flushed = writer.close()
+            if flushed:
+                self.print(f"[書き込み] {flushed}通分をDBに確定しました")
+
+        return counts
+
+    def create_writer(self):
+        """報告行と処理済みの記録は複数通分をまとめて1トランザクションで書き込む（保証は report_writer.py を参照）"""
+        return report_writer.ReportWriter(
+            self.conn,
+            prompt_version=PROMPT_VERSION,
+            max_mails=self.options.flush_mails,
+            max_rows=report_writer.WRITE_BATCH_ROWS,
+            max_seconds=self.options.flush_seconds,
+            metrics=self.metrics
+        )
+
+    # --------------------
+    # 同期（Gmailの新着メールを処理）
+    # --------------------
+    def run_sync(self):
+        conn = self.conn
+        # 処理状態は processed_mails テーブルで管理する（旧 processed_ids.json は初回のみ取り込む）
+        imported = report_db.import_processed_ids(conn, self.processed_file)
+        if imported:
+            self.print(f"{self.processed_file} から処理済みID {imported}件を取り込みました")
+        processed_ids = report_db.processed_mail_ids(conn)
+
+        service = self.mail_source.service()
+
+        # 週報ラベルID取得
+        label_id = gmail_source.get_label_id(service, '週報')
+        if not label_id:
+            raise ProcessorError("ラベル「週報」が見つかりません")
+
+        # 一覧の前に現在のhistoryIdを控えておき、処理中に届いたメールは次回の差分に含める
+        sync_history_id = gmail_source.get_current_history_id(service)
+        last_history_id = None if getattr(self.options, 'full', False) else report_db.get_sync_state(conn, HISTORY_ID_KEY)
+
+        message_ids = None
+        if last_history_id:
+            try:
+                message_ids = gmail_source.list_added_message_ids(service, label_id, last_history_id)
+                self.print(f"差分同期: historyId {last_history_id} 以降に追加されたメール {len(message_ids)}件")
+            except gmail_source.HistoryExpired:
+                self.print("履歴の有効期限が切れているため、全件を一覧します")
+
+        if message_ids is None:
+            # 初回・--full 指定時・履歴の期限切れ時は全件を一覧
+            message_ids = gmail_source.list_label_message_ids(service, label_id)
+
+        pending_ids = [msg_id for msg_id in message_ids if msg_id not in processed_ids]
+        # 前回までに失敗したメールは一覧に含まれなくても再試行する（連続失敗の上限まで）
+        listed = set(pending_ids)
+        retry_ids = [msg_id for msg_id in report_db.failed_mail_ids(conn) if msg_id not in listed]
+        pending_ids.extend(retry_ids)
+
+        # 処理状況の表示
+        self.print(f"週報ラベルのメール: {gmail_source.get_label_total(service, label_id)}件")
+        self.print(f"処理済み: {len(processed_ids)}件")
+        self.print(f"未処理: {len(pending_ids)}件（うち前回失敗の再試行 {len(retry_ids)}件）")
+        self.print("\n週報処理を開始します...\n")
+
+        counts = self.run_pipeline(pending_ids, self.create_writer(), self.options.concurrency)
+
+        # 失敗したメールは processed_mails から再試行するため、同期位置は失敗があっても進める。
+        # 中断時は一覧したメールが未記録のまま残るので進めない（次回の差分に再び含める）
+        if not counts['interrupted']:
+            report_db.set_sync_state(conn, HISTORY_ID_KEY, sync_history_id)
+            conn.commit()
+        else:
+            self.print(f"\n処理が中断されたため、同期位置（historyId）は更新しません")
+
+        counts['total'] = len(processed_ids) + counts['done']
+        self.print(f"\n処理完了: {counts['total']}件のメールを処理しました。")
+        return counts
+
+    # --------------------
+    # 再処理（プロンプト・リスト変更後の既存メールの再解析）
+    # --------------------
+    def reprocess_filters(self):
+        """再処理の対象条件（チェックポイントの照合に使う）"""
+        options = self.options
+        return {
+            'date_from': options.date_from,
+            'date_to': options.date_to,
+            'reporter': options.reporter,
+            'prompt_version': options.prompt_version,
+            'stale': options.stale,
+            'target_version': PROMPT_VERSION,
+            'offline': options.command == 'replay',
+        }
+
+    def select_reprocess_targets(self, filters, started_at):
+        """
+        再処理対象のメールIDを最新順に取得する
+
+        started_at 以降に処理されたメール（この再処理で処理済み）は除く。
+        日付・報告者の条件は登録済みの報告（mail_summaries）で判定するため、週報でないメールは対象外になる。
+        """
+        query = '''
+            SELECT p.mail_id
+            FROM processed_mails p
+            LEFT JOIN mail_summaries s ON s.mail_id = p.mail_id
+            WHERE p.status IN ('registered', 'skipped', 'imported')
+              AND p.processed_at < ?
+        '''
+        params = [started_at]
+        if filters['date_from']:
+            query += ' AND s.report_date >= ?'
+            params.append(filters['date_from'])
+        if filters['date_to']:
+            query += ' AND s.report_date <= ?'
+            params.append(filters['date_to'])
+        if filters['reporter']:
+            query += ' AND p.mail_id IN (SELECT mail_id FROM weekly_reports WHERE reporter = ?)'
+            params.append(filters['reporter'])
+        if filters['prompt_version']:
+            query += ' AND p.prompt_version = ?'
+            params.append(filters['prompt_version'])
+        if filters['stale']:
+            query += ' AND (p.prompt_version IS NULL OR p.prompt_version != ?)'
+            params.append(filters['target_version'])
+        mail_ids = {row[0] for row in self.conn.execute(query, params)}
+        if filters['offline']:
+            # replay ではアーカイブにあるメールだけが対象。条件の指定がなければ未処理のアーカイブ済みメールも含める
+            archived = self.archive.mail_ids()
+            mail_ids &= archived
+            if not any(filters[key] for key in ('date_from', 'date_to', 'reporter', 'prompt_version')):
+                known = {row[0] for row in self.conn.execute('SELECT mail_id FROM processed_mails')}
+                mail_ids |= archived - known
+        return gmail_source.sort_newest_first(mail_ids)
+
+    def run_reprocess(self):
+        """
+        条件に合う処理済みメールを現在のプロンプトで再解析し、メールごとに報告行を入れ替える
+
+        本文はアーカイブ済みならアーカイブから読み出す。replay ではGmailにアクセスせずアーカイブだけを使う。
+        進捗は processed_mails の processed_at（報告行と同じトランザクションで更新）で管理する。
+        開始時刻・処理日時はミリ秒まで記録するため、開始直前に処理されたメールも対象に含まれる
+        （ミリ秒を持たない古い処理日時は同じ秒の開始時刻より前として比較される）。
+        中断した場合は同じ条件で再実行すると続きから再開する。
+        """
+        conn = self.conn
+        filters = self.reprocess_filters()
+        checkpoint = report_db.get_sync_state(conn, REPROCESS_STATE_KEY)
+        if checkpoint and not self.options.restart:
+            checkpoint = json.loads(checkpoint)
+            if checkpoint['filters'] != filters:
+                self.print(f"未完了の再処理の条件: {checkpoint['filters']}")
+                raise ProcessorError("条件の異なる再処理が未完了です。続きから再開するには同じ条件で実行し、"
+                                     "破棄するには --restart を指定してください")
+            started_at = checkpoint['started_at']
+            self.print(f"{started_at} に開始した再処理を続きから再開します")
+        else:
+            started_at = conn.execute(f"SELECT {report_db.NOW_MS_SQL}").fetchone()[0]
+            report_db.set_sync_state(conn, REPROCESS_STATE_KEY,
+                                     json.dumps({'filters': filters, 'started_at': started_at}, ensure_ascii=False))
+            conn.commit()
+
+        target_ids = self.select_reprocess_targets(filters, started_at)
+        if self.options.limit:
+            target_ids = target_ids[:self.options.limit]
+        self.print(f"再処理対象: {len(target_ids)}件（プロンプトバージョン {PROMPT_VERSION}）")
+        self.print("\n再処理を開始します...\n")
+
+        # 失敗したメールは以前の結果を残し、次回の再開時に再び対象にする
+        counts = self.run_pipeline(
+            target_ids, self.create_writer(), self.options.concurrency, record_failures=False,
+            offline=filters['offline']
+        )
+
+        if (counts['failed'] == 0 and not counts['interrupted']
+                and not self.select_reprocess_targets(filters, started_at)):
+            report_db.delete_sync_state(conn, REPROCESS_STATE_KEY)
+            conn.commit()
+        else:
+            self.print("\n未処理のメールが残っています。同じ条件で再実行すると続きから再開します")
+
+        self.print(f"\n再処理完了: {counts['done']}件のメールを処理しました。")
+        return counts
+
+    # --------------------
+    # 性能計測（benchmark）
+    # --------------------
+    def run_benchmark(self):
+        """合成メールボックスをフェイクのモデルで処理し、スループットと段ごとの処理時間を表示する"""
+        options = self.options
+        self.print(f"ベンチマーク: メール {options.mails}通, Gmail遅延 {options.mail_latency}秒, "
+                   f"モデル遅延 {options.model_latency}秒, エラー率 {options.error_rate}, 並列数 {options.concurrency}")
+        self.print(f"作業ディレクトリ: {self.bench_dir}（終了時に削除）")
+
+        start = time.perf_counter()
+        # メールごとの詳細表示は計測の邪魔になるため捨てる
+        out = self.out
+        self.out = io.StringIO()
+        try:
+            counts = self.run_sync()
+        finally:
+            self.out = out
+        elapsed = time.perf_counter() - start
+
+        done = self.conn.execute("SELECT COUNT(*) FROM processed_mails WHERE status != 'failed'").fetchone()[0]
+        fake_service = self.mail_source.fake_service
+        self.print(f"\n処理したメール: {done}/{options.mails}通, 所要時間 {elapsed:.2f}秒, "
+                   f"スループット {done / elapsed:.1f}通/秒")
+        self.print(f"Gmail API 往復: {fake_service.request_count}回 "
+                   f"(うちバッチ {fake_service.batch_count}回), モデル呼び出し: {self.analyzer.call_count}回 "
+                   f"(うち週報判定で打ち切り {self.analyzer.cancelled_count}回)")
+        self.print(f"\n{'段':<14}{'回数':>8}{'合計(秒)':>12}{'平均(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+        for stage, summary in self.metrics.summary().items():
+            self.print(f"{stage:<14}{summary['count']:>8}{summary['total']:>12.2f}{summary['mean'] * 1000:>12.1f}"
+                       f"{summary['p50'] * 1000:>12.1f}{summary['p95'] * 1000:>12.1f}")
+        counts['seconds'] = elapsed
+        return counts
+
+    # --------------------
+    # 状態・統計の表示（Gmail・モデルにはアクセスしない）
+    # --------------------
+    def show_status(self):
+        """同期位置・処理状態・未完了の再処理を表示する"""
+        conn = self.conn
+        status_counts = dict(conn.execute('SELECT status, COUNT(*) FROM processed_mails GROUP BY status'))
+        last_processed = conn.execute('SELECT MAX(processed_at) FROM processed_mails').fetchone()[0]
+        stale = conn.execute('''
+            SELECT COUNT(*) FROM processed_mails
+            WHERE status IN ('registered', 'skipped') AND (prompt_version IS NULL OR prompt_version != ?)
+        ''', (PROMPT_VERSION,)).fetchone()[0]
+        history_id = report_db.get_sync_state(conn, HISTORY_ID_KEY)
+        checkpoint = report_db.get_sync_state(conn, REPROCESS_STATE_KEY)
+
+        self.print(f"データベース: {self.db_file}（スキーマ v{report_db.schema_version(conn)}）")
+        self.print(f"同期位置（historyId）: {history_id or '未同期（次回は全件を一覧）'}")
+        self.print(f"最終処理日時: {last_processed or '-'}")
+        gave_up = conn.execute(
+            "SELECT COUNT(*) FROM processed_mails WHERE status = 'failed' AND failed_attempts >= ?",
+            (report_db.MAX_FAILED_ATTEMPTS,)
+        ).fetchone()[0]
+        self.print("処理済みメール: " + ", ".join(
+            f"{status} {status_counts.get(status, 0)}件" for status in ('registered', 'skipped', 'imported', 'failed')
+        ) + f"（failed のうち再試行上限に達したもの {gave_up}件）")
+        self.print(f"プロンプトバージョン: {PROMPT_VERSION}（以前のバージョンで処理済み: {stale}件）")
+        if checkpoint:
+            checkpoint = json.loads(checkpoint)
+            self.print(f"未完了の再処理: {checkpoint['started_at']} 開始, 条件 {checkpoint['filters']}")
+        else:
+            self.print("未完了の再処理: なし")
+        return {
+            'history_id': history_id,
+            'last_processed_at': last_processed,
+            'statuses': status_counts,
+            'failed_gave_up': gave_up,
+            'stale': stale,
+            'reprocess_checkpoint': checkpoint,
+        }
+
+    def print_db_stats(self):
+        """登録済みの週報数と、この実行での解析キャッシュ・アーカイブの状況を表示する"""
+        self.print(f"データベースに登録された週報数を確認中...")
+
+        # 最終的なDB統計を表示
+        total_reports, unique_mails = self.conn.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT mail_id) FROM weekly_reports'
+        ).fetchone()
+        self.print(f"登録済み週報: {total_reports}件 ({unique_mails}通のメールから)")
+
+        if self.result_cache:
+            stats = self.result_cache.stats()
+            self.print(f"解析キャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件 "
+                       f"(保存 {stats['entries']}件, {stats['bytes'] / 1024 / 1024:.1f}MB, 削除 {stats['evictions']}件)")
+
+        archive_stats = self.archive.stats()
+        self.print(f"メールアーカイブ: {archive_stats['mails']}通 "
+                   f"({archive_stats['stored_bytes'] / 1024 / 1024:.1f}MB, "
+                   f"圧縮前 {archive_stats['raw_bytes'] / 1024 / 1024:.1f}MB)")
+        return {'reports': total_reports, 'mails': unique_mails}
+
+    def show_stats(self):
+        """登録済みの週報（報告者別・期間）と解析キャッシュ・アーカイブの使用量を表示する"""
+        conn = self.conn
+        total_reports, unique_mails, first_date, last_date = conn.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT mail_id), MIN(report_date), MAX(report_date) FROM weekly_reports'
+        ).fetchone()
+        self.print(f"登録済み週報: {total_reports}件 ({unique_mails}通のメールから)")
+        self.print(f"報告日: {first_date or '-'} 〜 {last_date or '-'}")
+        reporters = conn.execute('''
+            SELECT COALESCE(reporter, '(不明)'), COUNT(*) FROM weekly_reports
+            GROUP BY reporter ORDER BY COUNT(*) DESC
+        ''').fetchall()
+        for reporter, count in reporters:
+            self.print(f"  {reporter}: {count}件")
+        summary = {'reports': total_reports, 'mails': unique_mails, 'reporters': dict(reporters)}
+
+        # キャッシュ・アーカイブは既にある場合だけ開く（stats で新しいファイルを作らない）
+        if os.path.exists(self.cache_file):
+            result_cache = analysis_cache.AnalysisCache(self.cache_file)
+            stats = result_cache.stats()
+            result_cache.close()
+            self.print(f"解析キャッシュ: {stats['entries']}件, {stats['bytes'] / 1024 / 1024:.1f}MB "
+                       f"(上限 {stats['max_bytes'] / 1024 / 1024:.0f}MB)")
+            summary['cache'] = stats
+        if os.path.exists(self.archive_file):
+            archive = mail_archive.MailArchive(self.archive_file)
+            archive_stats = archive.stats()
+            archive.close()
+            self.print(f"メールアーカイブ: {archive_stats['mails']}通 "
+                       f"({archive_stats['stored_bytes'] / 1024 / 1024:.1f}MB, "
+                       f"圧縮前 {archive_stats['raw_bytes'] / 1024 / 1024:.1f}MB)")
+            summary['archive'] = archive_stats
+        return summary
+
 
 # --------------------
-# メール処理ループ
+# 実行
 # --------------------
-for msg in all_messages:
-    msg_id = msg['id']
-    if msg_id in processed_ids:
-        continue
-
-    msg_data = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-    headers = msg_data['payload']['headers']
-    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "")
-    sender = next((h['value'] for h in headers if h['name'] == 'From'), "")
-    date = next((h['value'] for h in headers if h['name'] == 'Date'), "")
-
-    # 本文取得（ネストされたpartsに対応）
-    def get_body_recursive(part):
-        """再帰的にtext/plainの本文を探す"""
-        # mimeTypeがtext/plainで、dataがある場合
-        if part.get('mimeType') == 'text/plain' and 'data' in part.get('body', {}):
-            return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-
-        # partsがある場合、再帰的に探す
-        if 'parts' in part:
-            for subpart in part['parts']:
-                result = get_body_recursive(subpart)
-                if result:
-                    return result
-        return None
-
-    body = ""
-    payload = msg_data['payload']
-    body = get_body_recursive(payload)
-    if not body and 'data' in payload.get('body', {}):
-        # フォールバック: トップレベルのbodyから取得
-        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-    if not body:
-        body = ""
-
-    # AI解析
-    start_time = time.time()
-    result = process_weekly_report(subject, body, sender, date)
-    elapsed = time.time() - start_time
-
-    if result is None:
-        print(f"メールID {msg_id} の解析に失敗しました")
-        processed_ids.add(msg_id)
-        continue
-
-    # 解析結果を表示
-    print(f"\n[{len(processed_ids)+1}/{len(all_messages)}] メールID: {msg_id}")
-    print(f"送信者: {sender}")
-    print(f"件名: {subject}")
-    print(f"解析時間: {elapsed:.2f}秒")
-    print("-"*60)
-    
-    # 週報判定
-    if result.get("週報判定"):
-        reporter = result.get("報告者")
-        report_date = result.get("報告日")
-        
-        print(f"[OK] 週報と判定されました")
-        print(f"  報告者: {reporter}")
-        print(f"  報告日: {report_date}")
-        print(f"  報告件数: {len(result.get('報告内容', []))}件")
-        print("-"*60)
-        
-        # 各報告内容を表示
-        for i, report in enumerate(result.get("報告内容", []), 1):
-            print(f"\n【報告 {i}】")
-            print(f"  客先名: {report.get('客先名') or '-'}")
-            print(f"  客先部署: {report.get('客先部署名') or '-'}")
-            print(f"  客先担当者: {report.get('客先担当者名') or '-'}")
-            print(f"  同行社員: {report.get('同行社員名') or '-'}")
-            print(f"  製品名: {report.get('製品名') or '-'}")
-            print(f"  案件内容: {report.get('案件内容') or '-'}")
-            
-            # DBに登録
-            db_insert(msg_id, report_date, reporter, report)
-        
-        print("\n" + "="*60)
-        print(f"[完了] [{len(processed_ids)+1}/{len(all_messages)}] メールID {msg_id} をDBに登録しました")
-    else:
-        print(f"[スキップ] 週報ではないと判定されました")
-        print("="*60)
+def main(argv=None):
+    """コマンドラインから実行する（終了コードを返す）"""
+    # Windows での UTF-8 出力を強制
+    if sys.platform == 'win32':
+        import codecs
+        sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
+        sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
 
-    # 処理済みIDに追加
-    processed_ids.add(msg_id)
-    with open(PROCESSED_FILE, 'w', encoding='utf-8') as f:
-        json.dump(list(processed_ids), f, ensure_ascii=False, indent=2)
+    options = parse_args(argv)
 
-print(f"\n処理完了: {len(processed_ids)}件のメールを処理しました。")
-print(f"データベースに登録された週報数を確認中...")
+    # SIGTERM（Webアプリからの停止等）もCtrl-Cと同様に扱い、解析済みの結果を書き込んでから終了する
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        with WeeklyReportProcessor(options) as processor:
+            if options.command in JOB_COMMANDS:
+                # Webアプリ等からの実行と同時にDBへ書き込まないよう、ジョブとして登録して実行する
+                processor.run_as_job()
+            else:
+                processor.run()
+    except (ProcessorError, ingest_jobs.JobConflict) as e:
+        print(e)
+        return 1
+    return 0
 
-# 最終的なDB統計を表示
-c.execute('SELECT COUNT(*) FROM weekly_reports')
-total_reports = c.fetchone()[0]
-c.execute('SELECT COUNT(DISTINCT mail_id) FROM weekly_reports')
-unique_mails = c.fetchone()[0]
-print(f"登録済み週報: {total_reports}件 ({unique_mails}通のメールから)")
 
-conn.close()
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())